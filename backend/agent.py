@@ -28,7 +28,8 @@ IMPORTANT RULES:
 2. When the user asks to "book an appointment" or "schedule a visit", IMMEDIATELY call `check_appointment_availability` with "{user_id}" and a query like "next available".
 3. After getting slots, present them to the user and ask which one they want.
 4. If the user selects a slot, call `book_appointment` with the slot details.
-5. Do NOT call `log_interaction` unless explicitly asked to log something.
+5. To move an existing appointment, call `reschedule_appointment` instead of cancelling and booking again.
+6. Do NOT call `log_interaction` unless explicitly asked to log something.
 """
 
 
@@ -3,26 +3,37 @@ Agent Router
 Orchestrates agent workflow and provides FastAPI endpoints
 """
 
-from datetime import datetime
-from typing import Dict, Optional
+from datetime import datetime, time
+from typing import Dict, List, Literal, Optional
 from uuid import UUID
+import asyncio
 import sys
 import os
 
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
 from pydantic import BaseModel, Field
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from agents.scheduling_agent import suggest_slots
-from agents.booking_agent import book_slot, cancel_booking
-from agents.notification_agent import (
-    send_notification,
-    send_appointment_reminder,
-    send_booking_confirmation
+from agents.availability_grid import get_availability_grid, MAX_GRID_DAYS
+from agents.booking_agent import (
+    book_slot,
+    book_series,
+    cancel_booking,
+    reschedule_booking,
+    expand_recurrence,
+    MAX_SERIES_OCCURRENCES
 )
-from agents.medication_reminder_agent import run_reminder_cycle, clear_daily_reminder_cache
+from agents.idempotency import run_idempotent
+from agents.notification_agent import send_notification, pool_metrics, send_scheduler
+from agents.notification_outbox import get_outbox
+from agents.medication_reminder_agent import run_reminder_cycle, clear_daily_reminder_cache, set_reminder_time
+from agents.reminder_scheduler import reminder_scheduler, get_shard_progress
+from agents.appointment_reminders import appointment_reminders
+from entity_cache import entity_cache_stats
+from change_feed import change_feed
 
 
 # Create FastAPI router
@@ -36,15 +47,54 @@ class SchedulingRequest(BaseModel):
     patient_id: str = Field(..., description="Patient UUID")
 
 
+class AvailabilityGridRequest(BaseModel):
+    patient_id: str = Field(..., description="Patient UUID")
+    start_date: Optional[str] = Field(None, description="ISO date of the first day (defaults to today)")
+    days: int = Field(14, ge=1, le=MAX_GRID_DAYS, description="Number of days to cover")
+    doctor_ids: Optional[List[str]] = Field(None, description="Optional subset of doctor UUIDs")
+
+
 class BookingRequest(BaseModel):
     patient_id: str = Field(..., description="Patient UUID")
     doctor_id: str = Field(..., description="Doctor UUID")
     appointment_time: str = Field(..., description="ISO datetime string")
     upload_id: Optional[str] = Field(None, description="Optional prescription reference")
+    idempotency_key: Optional[str] = Field(None, max_length=128, description="Client key for safe retries")
+
+
+class RecurrenceRule(BaseModel):
+    start: str = Field(..., description="ISO datetime of the first occurrence")
+    frequency: Literal["daily", "weekly"] = Field("weekly", description="Repeat frequency")
+    interval: int = Field(1, ge=1, le=12, description="Repeat every N days/weeks")
+    count: int = Field(..., ge=1, le=MAX_SERIES_OCCURRENCES, description="Number of occurrences")
+
+
+class BulkBookingRequest(BaseModel):
+    patient_id: str = Field(..., description="Patient UUID")
+    doctor_id: str = Field(..., description="Doctor UUID")
+    recurrence: Optional[RecurrenceRule] = Field(None, description="Recurrence rule to expand")
+    appointment_times: Optional[List[str]] = Field(
+        None, max_items=MAX_SERIES_OCCURRENCES, description="Explicit ISO datetime strings"
+    )
+    upload_id: Optional[str] = Field(None, description="Optional prescription reference")
+    idempotency_key: Optional[str] = Field(None, max_length=128, description="Client key for safe retries")
 
 
 class CancelBookingRequest(BaseModel):
     schedule_id: str = Field(..., description="Schedule UUID to cancel")
+    idempotency_key: Optional[str] = Field(None, max_length=128, description="Client key for safe retries")
+
+
+class RescheduleBookingRequest(BaseModel):
+    schedule_id: str = Field(..., description="Schedule UUID to move")
+    appointment_time: str = Field(..., description="New ISO datetime string")
+    idempotency_key: Optional[str] = Field(None, max_length=128, description="Client key for safe retries")
+
+
+class ReminderTimeRequest(BaseModel):
+    drug_id: str = Field(..., description="Drug UUID")
+    slot: Literal["morning", "afternoon", "night"] = Field(..., description="Slot to change")
+    remind_at: Optional[str] = Field(None, description="Reminder time as HH:MM (omit for the slot default)")
 
 
 class NotificationRequest(BaseModel):
@@ -83,6 +133,22 @@ def get_current_user_from_header(authorization: Optional[str] = Header(None)) ->
     return user_id
 
 
+def require_admin(user_id: str = Depends(get_current_user_from_header)) -> str:
+    """Allow only users listed in ADMIN_USER_IDS (operational endpoints)"""
+    from auth import ADMIN_USER_IDS
+
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    return user_id
+
+
+def raise_for_idempotent_replay(result: Dict):
+    """Map an in-flight idempotency replay to 409 Conflict"""
+    if result.get("status") == "in_progress":
+        raise HTTPException(status_code=409, detail=result["error"])
+
+
 # ==================== AGENT ENDPOINTS ====================
 
 @router.post("/schedule/suggest")
@@ -121,21 +187,74 @@ async def suggest_appointment_slots(
         raise HTTPException(status_code=500, detail=f"Scheduling failed: {str(e)}")
 
 
+@router.post("/schedule/grid")
+async def availability_grid(
+    request: AvailabilityGridRequest,
+    user_id: str = Depends(get_current_user_from_header)
+):
+    """
+    Get a doctors x days x time-blocks availability grid for calendar views
+
+    Each doctor gets one bitstring per day, one character per block
+    ("1" = available, "0" = unavailable).
+
+    Example request:
+    ```json
+    {
+        "patient_id": "uuid-here",
+        "start_date": "2026-01-12",
+        "days": 30
+    }
+    ```
+    """
+    try:
+        # Validate patient_id matches authenticated user
+        if request.patient_id != user_id:
+            raise HTTPException(status_code=403, detail="Cannot view availability for another patient")
+
+        start_date = datetime.fromisoformat(request.start_date) if request.start_date else None
+
+        grid = await get_availability_grid(
+            UUID(request.patient_id),
+            start_date,
+            request.days,
+            request.doctor_ids
+        )
+
+        return {
+            "success": True,
+            **grid
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Availability lookup failed: {str(e)}")
+
+
 @router.post("/booking/create")
 async def create_booking(
     request: BookingRequest,
-    user_id: str = Depends(get_current_user_from_header)
+    user_id: str = Depends(get_current_user_from_header),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Book an appointment slot
 
+    Retries carrying the same idempotency key (``Idempotency-Key`` header or
+    ``idempotency_key`` field) return the original result without booking
+    or notifying again.
+
     Example request:
     ```json
     {
         "patient_id": "uuid-here",
         "doctor_id": "uuid-here",
         "appointment_time": "2026-01-15T10:00:00",
-        "upload_id": "optional-uuid"
+        "upload_id": "optional-uuid",
+        "idempotency_key": "optional-client-key"
     }
     ```
     """
@@ -146,35 +265,86 @@ async def create_booking(
 
         # Parse appointment time
         appointment_dt = datetime.fromisoformat(request.appointment_time)
-
-        # Call booking agent
-        result = await book_slot(
-            UUID(request.patient_id),
-            UUID(request.doctor_id),
-            appointment_dt,
-            request.upload_id
+        patient_uuid = UUID(request.patient_id)
+        doctor_uuid = UUID(request.doctor_id)
+
+        # Confirmation is queued in the outbox by the booking agent
+        result = await run_idempotent(
+            f"booking:{user_id}",
+            idempotency_key or request.idempotency_key,
+            lambda: book_slot(patient_uuid, doctor_uuid, appointment_dt, request.upload_id)
         )
+        raise_for_idempotent_replay(result)
 
         if not result.get("success"):
             raise HTTPException(status_code=400, detail=result.get("error", "Booking failed"))
 
-        # Send confirmation notification (optional)
-        try:
-            from supabase_client import get_supabase_client
-            supabase = get_supabase_client()
+        return result
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Booking failed: {str(e)}")
 
-            # Get patient phone and doctor name
-            patient = supabase.table("patients").select("phone, name").eq("pid", request.patient_id).execute()
-            doctor = supabase.table("doctors").select("doctor_name").eq("did", request.doctor_id).execute()
 
-            if patient.data and doctor.data:
-                phone = patient.data[0].get("phone")
-                doctor_name = doctor.data[0].get("doctor_name")
+@router.post("/booking/bulk")
+async def create_bulk_booking(
+    request: BulkBookingRequest,
+    user_id: str = Depends(get_current_user_from_header),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Book a series of appointments from a recurrence rule or an explicit list
 
-                if phone:
-                    await send_booking_confirmation(phone, doctor_name, request.appointment_time)
-        except Exception as notif_error:
-            print(f"Failed to send confirmation notification: {notif_error}")
+    All occurrences are checked and inserted in one pass; the response has a
+    result per occurrence, so conflicts do not block the rest of the series.
+
+    Example request:
+    ```json
+    {
+        "patient_id": "uuid-here",
+        "doctor_id": "uuid-here",
+        "recurrence": {
+            "start": "2026-01-15T10:00:00",
+            "frequency": "weekly",
+            "count": 6
+        }
+    }
+    ```
+    """
+    try:
+        # Validate patient_id matches authenticated user
+        if request.patient_id != user_id:
+            raise HTTPException(status_code=403, detail="Cannot book for another patient")
+
+        if bool(request.recurrence) == bool(request.appointment_times):
+            raise HTTPException(status_code=400, detail="Provide either recurrence or appointment_times")
+
+        if request.recurrence:
+            rule = request.recurrence
+            slots = expand_recurrence(
+                datetime.fromisoformat(rule.start),
+                rule.frequency,
+                rule.count,
+                rule.interval
+            )
+        else:
+            slots = [datetime.fromisoformat(value) for value in request.appointment_times]
+
+        patient_uuid = UUID(request.patient_id)
+        doctor_uuid = UUID(request.doctor_id)
+
+        result = await run_idempotent(
+            f"bulk:{user_id}",
+            idempotency_key or request.idempotency_key,
+            lambda: book_series(patient_uuid, doctor_uuid, slots, request.upload_id)
+        )
+        raise_for_idempotent_replay(result)
+
+        if result.get("status") not in ("confirmed", "partial", "conflict"):
+            raise HTTPException(status_code=400, detail=result.get("error", "Booking failed"))
 
         return result
 
@@ -183,51 +353,102 @@ async def create_booking(
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Booking failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Bulk booking failed: {str(e)}")
 
 
 @router.post("/booking/cancel")
 async def cancel_appointment(
     request: CancelBookingRequest,
-    user_id: str = Depends(get_current_user_from_header)
+    user_id: str = Depends(get_current_user_from_header),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Cancel an existing appointment
 
+    Retries carrying the same idempotency key return the original result.
+
     Example request:
     ```json
     {
-        "schedule_id": "uuid-here"
+        "schedule_id": "uuid-here",
+        "idempotency_key": "optional-client-key"
     }
     ```
     """
     try:
-        # Verify the schedule belongs to the authenticated user
-        from supabase_client import get_supabase_client
-        supabase = get_supabase_client()
-
-        schedule = supabase.table("schedule").select("pid").eq("schedule_id", request.schedule_id).execute()
+        schedule_uuid = UUID(request.schedule_id)
+        patient_uuid = UUID(user_id)
+
+        # Ownership-checked conditional delete: only the owner's row can match
+        result = await run_idempotent(
+            f"cancel:{user_id}",
+            idempotency_key or request.idempotency_key,
+            lambda: cancel_booking(schedule_uuid, patient_uuid)
+        )
+        raise_for_idempotent_replay(result)
 
-        if not schedule.data:
+        if result.get("status") == "not_found":
             raise HTTPException(status_code=404, detail="Appointment not found")
 
-        if schedule.data[0]["pid"] != user_id:
-            raise HTTPException(status_code=403, detail="Cannot cancel another patient's appointment")
-
-        # Call booking agent to cancel
-        result = await cancel_booking(UUID(request.schedule_id))
-
         if not result.get("success"):
             raise HTTPException(status_code=400, detail=result.get("error", "Cancellation failed"))
 
         return result
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid UUID: {str(e)}")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cancellation failed: {str(e)}")
 
 
+@router.post("/booking/reschedule")
+async def reschedule_appointment(
+    request: RescheduleBookingRequest,
+    user_id: str = Depends(get_current_user_from_header),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Move an existing appointment to a new time in one atomic operation
+
+    Example request:
+    ```json
+    {
+        "schedule_id": "uuid-here",
+        "appointment_time": "2026-01-16T14:00:00",
+        "idempotency_key": "optional-client-key"
+    }
+    ```
+    """
+    try:
+        schedule_uuid = UUID(request.schedule_id)
+        patient_uuid = UUID(user_id)
+        new_dt = datetime.fromisoformat(request.appointment_time)
+
+        result = await run_idempotent(
+            f"reschedule:{user_id}",
+            idempotency_key or request.idempotency_key,
+            lambda: reschedule_booking(schedule_uuid, patient_uuid, new_dt)
+        )
+        raise_for_idempotent_replay(result)
+
+        if result.get("status") == "not_found":
+            raise HTTPException(status_code=404, detail="Appointment not found")
+
+        if not result.get("success"):
+            raise HTTPException(status_code=400, detail=result.get("error", "Reschedule failed"))
+
+        return result
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reschedule failed: {str(e)}")
+
+
 @router.post("/notification/send")
 async def send_custom_notification(
     request: NotificationRequest,
@@ -252,27 +473,186 @@ async def send_custom_notification(
         raise HTTPException(status_code=500, detail=f"Notification failed: {str(e)}")
 
 
+@router.get("/notification/metrics")
+async def notification_metrics(
+    user_id: str = Depends(require_admin)
+):
+    """
+    Connection pool and send scheduler metrics for outgoing notifications (admin only)
+    """
+    return {
+        "success": True,
+        "http_pool": pool_metrics.to_dict(),
+        "send_scheduler": send_scheduler.stats()
+    }
+
+
+@router.get("/cache/metrics")
+async def entity_cache_metrics(
+    user_id: str = Depends(require_admin)
+):
+    """
+    Hit rate, size and eviction counts of the patient and doctor caches,
+    and the change feed that invalidates them (admin only)
+    """
+    return {
+        "success": True,
+        "caches": entity_cache_stats(),
+        "change_feed": change_feed.stats()
+    }
+
+
+@router.get("/notification/outbox")
+async def notification_outbox_status(
+    user_id: str = Depends(require_admin)
+):
+    """
+    Outbox queue depth and dead-lettered notifications (admin only)
+    Dead letters are listed without their payloads (contacts, message details)
+    """
+    try:
+        outbox = get_outbox()
+        return {
+            "success": True,
+            "counts": outbox.stats(),
+            "dead_letters": outbox.dead_letters()
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Outbox lookup failed: {str(e)}")
+
+
+@router.post("/notification/outbox/{outbox_id}/retry")
+async def retry_dead_letter(
+    outbox_id: int,
+    user_id: str = Depends(require_admin)
+):
+    """
+    Re-queue a dead-lettered notification (admin only)
+    """
+    if not get_outbox().retry_dead_letter(outbox_id):
+        raise HTTPException(status_code=404, detail="Dead-lettered notification not found")
+
+    return {"success": True, "message": "Notification re-queued"}
+
+
+# The manually triggered cycle, if any (kept so the task is not garbage collected)
+_manual_cycle: Optional[asyncio.Task] = None
+
+
+def _report_manual_cycle(task: asyncio.Task):
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"Manual reminder cycle failed: {task.exception()}")
+        return
+    result = task.result()
+    print(f"Manual reminder cycle finished: {result.get('message') or result.get('error')}")
+
+
 @router.post("/reminders/run")
-async def trigger_reminder_cycle():
+async def trigger_reminder_cycle(response: Response, background: bool = False):
     """
-    Manually trigger medication reminder cycle
-    In production, this would be called by a cron job
+    Manually trigger medication reminder cycle for the whole current slot
+    Reminders also go out automatically at each drug slot's remind_at time
+
+    Returns the cycle summary when it finishes. With ?background=true it
+    returns 202 at once instead (sends are rate limited, so a large cycle
+    can take minutes) and progress is shown by /reminders/status.
 
     No authentication required for cron jobs
     """
+    global _manual_cycle
+
+    if not background:
+        try:
+            return await run_reminder_cycle()
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Reminder cycle failed: {str(e)}")
+
+    response.status_code = 202
+    if _manual_cycle is not None and not _manual_cycle.done():
+        return {"success": True, "status": "running", "message": "A reminder cycle is already running"}
+
+    _manual_cycle = asyncio.create_task(run_reminder_cycle())
+    _manual_cycle.add_done_callback(_report_manual_cycle)
+    return {"success": True, "status": "started", "message": "Reminder cycle started"}
+
+
+@router.post("/reminders/time")
+async def update_reminder_time(
+    request: ReminderTimeRequest,
+    user_id: str = Depends(get_current_user_from_header)
+):
+    """
+    Set when the patient is reminded to take a drug in one slot
+
+    Example request:
+    ```json
+    {
+        "drug_id": "uuid-here",
+        "slot": "morning",
+        "remind_at": "07:30"
+    }
+    ```
+    """
     try:
-        result = await run_reminder_cycle()
+        drug_uuid = UUID(request.drug_id)
+        remind_at = time.fromisoformat(request.remind_at) if request.remind_at else None
+
+        result = await set_reminder_time(user_id, str(drug_uuid), request.slot, remind_at)
+
+        if result.get("status") == "not_found":
+            raise HTTPException(status_code=404, detail=result.get("error"))
+
+        if not result.get("success"):
+            raise HTTPException(status_code=400, detail=result.get("error", "Update failed"))
+
         return result
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
+
+
+@router.get("/reminders/status")
+async def reminder_scheduler_status(
+    user_id: str = Depends(require_admin)
+):
+    """
+    Reminder scheduler state: leadership, next run and last cycle result,
+    plus the appointment reminder index (admin only)
+    """
+    return {
+        "success": True,
+        **reminder_scheduler.status(),
+        "appointment_reminders": appointment_reminders.stats()
+    }
+
+
+@router.get("/reminders/shards")
+async def reminder_shard_progress(
+    user_id: str = Depends(require_admin)
+):
+    """
+    Last run and result of every reminder shard (admin only)
+    """
+    try:
+        return {"success": True, "shards": await get_shard_progress()}
+
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Reminder cycle failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to read shard progress: {str(e)}")
 
 
 @router.post("/reminders/clear-cache")
 async def clear_reminder_cache():
     """
-    Clear the daily reminder cache
-    Should be called once per day
+    Drop sent-reminder records from previous days
+    Optional; the ledger also expires old days on its own
     """
     try:
         result = await clear_daily_reminder_cache()
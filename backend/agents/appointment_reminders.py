@@ -0,0 +1,303 @@
+"""
+Appointment Reminders
+Sends T-24h and T-1h reminders from an in-memory index of upcoming appointments
+"""
+
+import asyncio
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import sys
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import get_async_supabase_client
+from change_feed import change_bus
+from agents.availability_grid import parse_db_datetime
+from agents.notification_outbox import enqueue_notification
+from agents.reminder_ledger import get_reminder_ledger, appointment_reminder_key
+from agents.reminder_scheduler import LEASES, REMINDER_LEADER_ELECTION, DatabaseLease
+
+
+APPOINTMENT_REMINDERS_ENABLED = os.getenv("APPOINTMENT_REMINDERS_ENABLED", "true").lower() == "true"
+
+# (label, lead time) for each reminder; the index in this tuple is stored in the ledger key
+APPOINTMENT_REMINDER_OFFSETS: Tuple[Tuple[str, timedelta], ...] = (
+    ("24h", timedelta(hours=24)),
+    ("1h", timedelta(hours=1)),
+)
+
+# Only appointments this far ahead are indexed
+APPOINTMENT_REMINDER_HORIZON = timedelta(hours=48)
+# The horizon is reloaded this often to pick up bookings made by other workers
+APPOINTMENT_REMINDER_REFRESH_SECONDS = 600.0
+# Bookings changed on other workers (change feed) trigger a reload at most this often
+APPOINTMENT_REMINDER_REFRESH_DEBOUNCE_SECONDS = 5.0
+# A reminder that comes due while the service is down is still sent if this late
+APPOINTMENT_REMINDER_GRACE = timedelta(minutes=15)
+
+JOB_NAME = "appointment_reminders"
+
+# (fire_at, schedule_id, offset index, appointment_time)
+HeapEntry = Tuple[datetime, str, int, datetime]
+
+
+class AppointmentReminderIndex:
+    """
+    Min-heap of pending reminder times for appointments inside the horizon
+
+    Booking, rescheduling and cancelling update the index directly, so
+    firing never scans the schedule table. A rescheduled appointment leaves
+    stale heap entries behind; they are skipped when popped because their
+    appointment time no longer matches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._appointments: Dict[str, Dict] = {}
+        self._heap: List[HeapEntry] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.refresh_requested = False
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> asyncio.Event:
+        """Attach the service's event loop so updates can wake it"""
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _wake(self):
+        # Updates may come from tool threads running their own event loops
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def upsert(self, schedule_id, appointment_time: datetime, contact: Optional[str], doctor_name: Optional[str]):
+        """Index (or re-index) one appointment"""
+        if not contact:
+            return
+
+        schedule_id = str(schedule_id)
+        appointment_time = appointment_time.replace(tzinfo=None)
+        now = datetime.now()
+
+        with self._lock:
+            current = self._appointments.get(schedule_id)
+            if appointment_time <= now or appointment_time > now + APPOINTMENT_REMINDER_HORIZON:
+                self._appointments.pop(schedule_id, None)
+                return
+
+            self._appointments[schedule_id] = {
+                "appointment_time": appointment_time,
+                "contact": contact,
+                "doctor_name": doctor_name
+            }
+            if current and current["appointment_time"] == appointment_time:
+                return  # Heap entries are already in place
+
+            for index, (_, lead) in enumerate(APPOINTMENT_REMINDER_OFFSETS):
+                fire_at = appointment_time - lead
+                if fire_at > now - APPOINTMENT_REMINDER_GRACE:
+                    heapq.heappush(self._heap, (fire_at, schedule_id, index, appointment_time))
+
+        self._wake()
+
+    def remove(self, schedule_id):
+        with self._lock:
+            self._appointments.pop(str(schedule_id), None)
+
+    def on_schedule_change(self, event: Dict):
+        """
+        Apply a schedule row change (see change_feed)
+
+        Events only carry the time, not the contact details, so a change
+        this worker has not indexed yet triggers a reload of the horizon.
+        """
+        if event["op"] == "DELETE":
+            self.remove(event["id"])
+            return
+        if event["op"] != "RESET":
+            at = parse_db_datetime(event["appointment_time"]) if event.get("appointment_time") else None
+            with self._lock:
+                current = self._appointments.get(str(event["id"]))
+            if current and current["appointment_time"] == at:
+                return  # This worker's own booking, already indexed
+            now = datetime.now()
+            if current is None and (at is None or at <= now or at > now + APPOINTMENT_REMINDER_HORIZON):
+                return  # Outside the horizon
+        if not self.refresh_requested:
+            # Further changes before the reload are covered by it; no need to wake again
+            self.refresh_requested = True
+            self._wake()
+
+    def replace_window(self, rows: List[Dict], start: datetime, end: datetime):
+        """
+        Reconcile the index with a fresh load of [start, end)
+
+        Appointments missing from the load were cancelled elsewhere;
+        appointments before the window have already taken place.
+        """
+        loaded = {str(row["schedule_id"]) for row in rows}
+        with self._lock:
+            for schedule_id in [
+                sid for sid, appt in self._appointments.items()
+                if appt["appointment_time"] < start
+                or (appt["appointment_time"] < end and sid not in loaded)
+            ]:
+                del self._appointments[schedule_id]
+
+        for row in rows:
+            self.upsert(row["schedule_id"], row["appointment_time"], row.get("contact"), row.get("doctor_name"))
+
+    def pop_due(self, now: datetime) -> List[Dict]:
+        """Remove and return reminders due at or before now"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, schedule_id, index, appointment_time = heapq.heappop(self._heap)
+                appt = self._appointments.get(schedule_id)
+                if appt is None or appt["appointment_time"] != appointment_time:
+                    continue  # Cancelled or rescheduled
+                if fire_at < now - APPOINTMENT_REMINDER_GRACE:
+                    continue  # Too late to be useful
+                due.append({"schedule_id": schedule_id, "offset_index": index, "fire_at": fire_at, **appt})
+        return due
+
+    def next_due(self) -> Optional[datetime]:
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def stats(self) -> Dict:
+        next_due = self.next_due()
+        with self._lock:
+            return {
+                "appointments": len(self._appointments),
+                "pending_reminders": len(self._heap),
+                "next_due": next_due.isoformat() if next_due else None
+            }
+
+
+appointment_reminders = AppointmentReminderIndex()
+change_bus.subscribe("schedule", appointment_reminders.on_schedule_change)
+
+
+async def load_upcoming_appointments(start: datetime, end: datetime) -> List[Dict]:
+    """
+    Fetch appointments in [start, end) with contact details
+
+    A range scan on idx_schedule_appointment_time, bounded by the horizon.
+    """
+    supabase = get_async_supabase_client()
+
+    response = await supabase.table("schedule").select(
+        "schedule_id, appointment_time, patients(phone), doctors(doctor_name)"
+    ).gte("appointment_time", start.isoformat()).lt("appointment_time", end.isoformat()).execute()
+
+    return [
+        {
+            "schedule_id": row["schedule_id"],
+            "appointment_time": parse_db_datetime(row["appointment_time"]),
+            "contact": (row.get("patients") or {}).get("phone"),
+            "doctor_name": (row.get("doctors") or {}).get("doctor_name")
+        }
+        for row in response.data or []
+    ]
+
+
+async def send_due_reminders(index: AppointmentReminderIndex, due: List[Dict]) -> int:
+    """
+    Queue due reminders through the notification outbox
+
+    Appointments are re-read in one query first, so a change made on
+    another worker since the last refresh is never announced.
+
+    Returns:
+        Number of reminders queued
+    """
+    supabase = get_async_supabase_client()
+    response = await supabase.table("schedule").select("schedule_id, appointment_time").in_(
+        "schedule_id", list({item["schedule_id"] for item in due})
+    ).execute()
+    current = {
+        row["schedule_id"]: parse_db_datetime(row["appointment_time"])
+        for row in response.data or [] if row.get("appointment_time")
+    }
+
+    ledger = get_reminder_ledger()
+    queued = 0
+    for item in due:
+        actual = current.get(item["schedule_id"])
+        if actual is None:
+            index.remove(item["schedule_id"])
+            continue
+        if actual != item["appointment_time"]:
+            index.upsert(item["schedule_id"], actual, item["contact"], item["doctor_name"])
+            continue
+
+        # Partitioned by send date: the ledger is shared with medication
+        # reminders, and a future partition would roll (purge) theirs
+        key = appointment_reminder_key(item["schedule_id"], item["offset_index"])
+        sent_on = item["fire_at"].date()
+        if not ledger.claim([key], sent_on)[0]:
+            continue  # Already sent
+
+        if enqueue_notification(
+            "appointment_reminder",
+            contact=item["contact"],
+            doctor_name=item["doctor_name"],
+            appointment_time=item["appointment_time"].isoformat()
+        ) is None:
+            ledger.release([key], sent_on)
+        else:
+            queued += 1
+
+    return queued
+
+
+async def run_appointment_reminders(index: AppointmentReminderIndex = appointment_reminders, lease=None):
+    """
+    Fire appointment reminders until cancelled
+
+    Sleeps until the earliest pending reminder; booking changes wake it
+    early. Only the lease holder sends.
+    """
+    lease = lease or LEASES.get(REMINDER_LEADER_ELECTION, DatabaseLease)(JOB_NAME)
+    wakeup = index.bind(asyncio.get_running_loop())
+    refreshed_at: Optional[datetime] = None
+
+    while True:
+        wakeup.clear()
+        try:
+            if await lease.acquire():
+                now = datetime.now()
+                since_refresh = (now - refreshed_at).total_seconds() if refreshed_at else None
+                if since_refresh is None or since_refresh >= APPOINTMENT_REMINDER_REFRESH_SECONDS or \
+                        (index.refresh_requested and since_refresh >= APPOINTMENT_REMINDER_REFRESH_DEBOUNCE_SECONDS):
+                    index.refresh_requested = False
+                    start = now - APPOINTMENT_REMINDER_GRACE
+                    end = now + APPOINTMENT_REMINDER_HORIZON
+                    index.replace_window(await load_upcoming_appointments(start, end), start, end)
+                    refreshed_at = now
+
+                due = index.pop_due(now)
+                if due:
+                    await send_due_reminders(index, due)
+            else:
+                refreshed_at = None  # Reload on taking over
+        except Exception as e:
+            print(f"Error in appointment reminders: {e}")
+
+        now = datetime.now()
+        delay = min(lease.renew_seconds, APPOINTMENT_REMINDER_REFRESH_SECONDS)
+        next_due = index.next_due()
+        if next_due is not None:
+            delay = min(delay, (next_due - now).total_seconds())
+        if index.refresh_requested:
+            delay = min(delay, APPOINTMENT_REMINDER_REFRESH_DEBOUNCE_SECONDS)
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=max(delay, 0.5))
+        except asyncio.TimeoutError:
+            pass
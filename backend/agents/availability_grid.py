@@ -0,0 +1,207 @@
+"""
+Availability Grid
+Builds doctors x days x time-blocks availability grids for calendar views
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from uuid import UUID
+import sys
+import os
+
+import numpy as np
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import get_async_supabase_client
+from agents.scheduling_agent import (
+    SLOT_HOURS,
+    SLOT_DURATION_MINUTES,
+    WEEKEND_DAYS,
+    get_patient_doctors,
+)
+from agents.slot_holds import slot_holds
+
+
+MAX_GRID_DAYS = 62
+
+# Block start times as minutes since midnight
+BLOCK_STARTS = np.array([hour * 60 for hour in SLOT_HOURS], dtype=np.int32)
+
+
+def parse_db_datetime(value: str) -> datetime:
+    """Parse an ISO timestamp from the database into a naive wall-clock datetime"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def normalize_datetime(value: datetime) -> datetime:
+    """Express a requested time like parse_db_datetime values (naive; offsets converted to UTC)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def build_working_mask(start_date: datetime, days: int, now: Optional[datetime] = None) -> np.ndarray:
+    """
+    Build the (days, blocks) mask of bookable working-hour blocks
+
+    Weekends and blocks that have already started are masked out.
+    """
+    now = now or datetime.now()
+    day0 = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    day_offsets = np.arange(days)
+    weekdays = (day0.weekday() + day_offsets) % 7
+    working_days = ~np.isin(weekdays, WEEKEND_DAYS)
+
+    # Minutes from day0 to each block start, compared against "now"
+    block_minutes = day_offsets[:, None] * 24 * 60 + BLOCK_STARTS[None, :]
+    now_minutes = (now - day0).total_seconds() / 60
+    not_past = block_minutes > now_minutes
+
+    return working_days[:, None] & not_past
+
+
+def build_booked_mask(
+    doctor_ids: List[str],
+    booked: List[Dict],
+    start_date: datetime,
+    days: int
+) -> np.ndarray:
+    """
+    Build the (doctors, days, blocks) mask of booked blocks
+
+    Args:
+        doctor_ids: Doctor UUIDs, in grid row order
+        booked: Rows with "did" and "appointment_time"
+        start_date: First day of the grid
+        days: Number of days in the grid
+
+    Returns:
+        Boolean array, True where the block is taken
+    """
+    mask = np.zeros((len(doctor_ids), days, len(SLOT_HOURS)), dtype=bool)
+    if not booked:
+        return mask
+
+    row_of = {did: i for i, did in enumerate(doctor_ids)}
+    day0 = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    rows, minutes = [], []
+    for record in booked:
+        row = row_of.get(str(record.get("did")))
+        if row is None or not record.get("appointment_time"):
+            continue
+        rows.append(row)
+        minutes.append((parse_db_datetime(record["appointment_time"]) - day0).total_seconds() // 60)
+
+    if not rows:
+        return mask
+
+    rows = np.array(rows, dtype=np.int64)
+    minutes = np.array(minutes, dtype=np.int64)
+    day_idx = minutes // (24 * 60)
+    minute_of_day = minutes % (24 * 60)
+
+    # Map each booking onto the block that covers it
+    block_idx = np.searchsorted(BLOCK_STARTS, minute_of_day, side="right") - 1
+    valid = (
+        (day_idx >= 0) & (day_idx < days) & (block_idx >= 0)
+        & (minute_of_day < BLOCK_STARTS[np.clip(block_idx, 0, None)] + SLOT_DURATION_MINUTES)
+    )
+
+    mask[rows[valid], day_idx[valid], block_idx[valid]] = True
+    return mask
+
+
+def encode_bitstrings(grid: np.ndarray) -> List[List[str]]:
+    """
+    Serialize a (doctors, days, blocks) grid as one bitstring per doctor per day
+
+    "1" marks an available block, "0" an unavailable one.
+    """
+    doctors, days, blocks = grid.shape
+    text = (grid.astype(np.uint8) + ord("0")).tobytes().decode("ascii")
+    width = days * blocks
+    return [
+        [text[d * width + i * blocks:d * width + (i + 1) * blocks] for i in range(days)]
+        for d in range(doctors)
+    ]
+
+
+async def get_booked_times(doctor_ids: List[str], start: datetime, end: datetime) -> List[Dict]:
+    """
+    Fetch booked appointment times for a set of doctors within [start, end)
+    """
+    if not doctor_ids:
+        return []
+
+    supabase = get_async_supabase_client()
+
+    try:
+        response = await supabase.table("schedule").select("did, appointment_time").in_(
+            "did", doctor_ids
+        ).gte("appointment_time", start.isoformat()).lt("appointment_time", end.isoformat()).execute()
+
+        return response.data or []
+    except Exception as e:
+        print(f"Error fetching booked times: {e}")
+        return []
+
+
+async def get_availability_grid(
+    pid: UUID,
+    start_date: Optional[datetime] = None,
+    days: int = 14,
+    doctor_ids: Optional[List[str]] = None
+) -> Dict:
+    """
+    Main function: Build the availability grid for a patient's doctors
+
+    Args:
+        pid: Patient UUID
+        start_date: First day of the grid (defaults to today)
+        days: Number of days to cover
+        doctor_ids: Optional subset of the patient's doctors
+
+    Returns:
+        Grid dict with one bitstring per doctor per day
+    """
+    if days < 1 or days > MAX_GRID_DAYS:
+        raise ValueError(f"days must be between 1 and {MAX_GRID_DAYS}")
+
+    start_date = (start_date or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    end_date = start_date + timedelta(days=days)
+
+    doctors = await get_patient_doctors(pid)
+    if doctor_ids:
+        wanted = set(doctor_ids)
+        doctors = [doc for doc in doctors if str(doc["did"]) in wanted]
+
+    ids = [str(doc["did"]) for doc in doctors]
+    booked = await get_booked_times(ids, start_date, end_date)
+
+    # Slots held for other patients are shown as taken
+    booked += [
+        {"did": did, "appointment_time": time}
+        for did, time in slot_holds.held_by_others(ids, pid)
+    ]
+
+    available = build_working_mask(start_date, days)[None, :, :] & ~build_booked_mask(ids, booked, start_date, days)
+    bitstrings = encode_bitstrings(available)
+
+    return {
+        "start_date": start_date.date().isoformat(),
+        "days": days,
+        "blocks": [f"{hour:02d}:00" for hour in SLOT_HOURS],
+        "block_minutes": SLOT_DURATION_MINUTES,
+        "doctors": [
+            {
+                "doctor_id": ids[i],
+                "doctor_name": doctors[i]["doctor_name"],
+                "availability": bitstrings[i]
+            }
+            for i in range(len(ids))
+        ]
+    }
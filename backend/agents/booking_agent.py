@@ -3,8 +3,9 @@ Booking Agent
 Handles transactional appointment booking with database validation
 """
 
-from datetime import datetime
-from typing import Dict, Optional
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 from uuid import UUID
 import sys
 import os
@@ -12,7 +13,22 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from supabase_client import get_supabase_client
+from supabase_client import get_async_supabase_client
+from repository import get_repository
+from entity_cache import patient_cache, patient_doctors_cache
+from agents.slot_holds import slot_holds, slot_key
+from agents.scheduling_agent import SLOT_DURATION_MINUTES
+from agents.availability_grid import get_booked_times, parse_db_datetime, normalize_datetime
+from agents.notification_outbox import enqueue_notification
+from agents.appointment_reminders import appointment_reminders
+from agents.idempotency import forget_tool_results
+
+
+MAX_SERIES_OCCURRENCES = 52
+RECURRENCE_STEPS = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+}
 
 
 class BookingConfirmation:
@@ -35,170 +51,379 @@ class BookingConfirmation:
         }
 
 
-async def validate_slot_availability(pid: UUID, did: UUID, slot_datetime: datetime) -> bool:
+# book_appointment RPC status -> user-facing error
+BOOKING_ERRORS = {
+    "invalid": "Slot is not available or invalid patient/doctor",
+    "no_upload": "Failed to create booking. Please ensure you have uploaded a prescription.",
+    "conflict": "Slot is no longer available. Please choose another time.",
+    "not_found": "Appointment not found",
+}
+
+
+async def create_booking_record(
+    pid: UUID,
+    did: UUID,
+    slot_datetime: datetime,
+    upload_id: Optional[str] = None
+) -> Dict:
     """
-    Validate that a slot is still available
-    Check for conflicts in schedule table
+    Atomically validate and insert a booking via the book_appointment RPC
+
+    Patient/doctor validation, upload reference lookup and the insert all
+    happen in one database call. Overlapping bookings are rejected by the
+    schedule exclusion constraints.
 
     Args:
         pid: Patient UUID
         did: Doctor UUID
         slot_datetime: Requested appointment time
+        upload_id: Optional upload ID (prescription reference)
 
     Returns:
-        True if slot is available, False otherwise
+        RPC result dict with "status" and, on success, "schedule_id"
     """
-    supabase = get_supabase_client()
+    result = await get_repository().book_appointment(str(pid), str(did), slot_datetime, upload_id)
+
+    return result or {"status": "failed", "error": "Empty response from booking service"}
+
+
+async def book_slot(pid: UUID, did: UUID, slot: datetime, upload_id: Optional[str] = None) -> Dict:
+    """
+    Main function: Book an appointment slot
+
+    Args:
+        pid: Patient UUID
+        did: Doctor UUID
+        slot: Appointment datetime
+        upload_id: Optional prescription reference
 
+    Returns:
+        BookingConfirmation dict or error dict
+    """
     try:
-        # Note: Current schema doesn't have appointment_time in schedule table
-        # This is a placeholder for when the schema is extended
-        # For now, we'll do basic validation
+        # Slots suggested to another patient stay reserved until their hold expires
+        holder = slot_holds.holder(slot_key(did, slot))
+        if holder and holder != str(pid):
+            return {
+                "success": False,
+                "error": BOOKING_ERRORS["conflict"],
+                "status": "conflict"
+            }
 
-        # Check if doctor exists
-        doctor_check = supabase.table("doctors").select("did").eq("did", str(did)).execute()
-        if not doctor_check.data:
-            return False
+        record = await create_booking_record(pid, did, slot, upload_id)
+        status = record.get("status")
 
-        # Check if patient exists
-        patient_check = supabase.table("patients").select("pid").eq("pid", str(pid)).execute()
-        if not patient_check.data:
-            return False
+        if status == "invalid":
+            # The patient or doctor is gone; stop serving their cached rows
+            patient_cache.invalidate(pid)
+            patient_doctors_cache.invalidate(pid)
 
-        # TODO: When appointment_time is added to schedule table, check:
-        # - No existing appointment for this patient at this time
-        # - No existing appointment for this doctor at this time
+        if status != "confirmed":
+            return {
+                "success": False,
+                "error": BOOKING_ERRORS.get(status, record.get("error", "Booking failed")),
+                "status": status if status in BOOKING_ERRORS else "failed"
+            }
+
+        slot_holds.release_patient(pid)
 
-        return True
+        # Confirmation is delivered by the outbox dispatcher, off the request path
+        if record.get("phone"):
+            enqueue_notification(
+                "booking_confirmation",
+                contact=record["phone"],
+                doctor_name=record.get("doctor_name"),
+                appointment_time=slot.isoformat()
+            )
+        appointment_reminders.upsert(record["schedule_id"], slot, record.get("phone"), record.get("doctor_name"))
+
+        confirmation = BookingConfirmation(
+            schedule_id=record["schedule_id"],
+            patient_id=str(pid),
+            doctor_id=str(did),
+            appointment_time=slot.isoformat(),
+            status="confirmed"
+        )
+
+        return {
+            "success": True,
+            "booking": confirmation.to_dict(),
+            "status": "confirmed",
+            "message": "Appointment booked successfully"
+        }
 
     except Exception as e:
-        print(f"Error validating slot: {e}")
-        return False
+        print(f"Error in book_slot: {e}")
+        return {
+            "success": False,
+            "error": f"Booking failed: {str(e)}",
+            "status": "failed"
+        }
 
 
-async def create_booking_record(pid: UUID, did: UUID, upload_id: Optional[str] = None) -> Optional[str]:
+def expand_recurrence(start: datetime, frequency: str, count: int, interval: int = 1) -> List[datetime]:
     """
-    Create a booking record in the schedule table
+    Expand a simple recurrence rule into appointment times
+
+    Args:
+        start: First occurrence
+        frequency: "daily" or "weekly"
+        count: Number of occurrences
+        interval: Repeat every N days/weeks
+
+    Returns:
+        List of occurrence datetimes
+    """
+    if frequency not in RECURRENCE_STEPS:
+        raise ValueError(f"Unsupported frequency: {frequency}")
+    if count < 1 or count > MAX_SERIES_OCCURRENCES:
+        raise ValueError(f"count must be between 1 and {MAX_SERIES_OCCURRENCES}")
+    if interval < 1:
+        raise ValueError("interval must be at least 1")
+
+    step = RECURRENCE_STEPS[frequency] * interval
+    return [start + step * i for i in range(count)]
+
+
+def find_conflicts(slots: List[datetime], booked_times: List[datetime]) -> List[bool]:
+    """
+    Flag slots that overlap an existing booking (one pass over sorted times)
+    """
+    duration = timedelta(minutes=SLOT_DURATION_MINUTES)
+    booked_times = sorted(booked_times)
+
+    conflicts = []
+    for slot in slots:
+        # Latest booking starting before this slot ends
+        i = bisect_right(booked_times, slot + duration - timedelta(microseconds=1))
+        conflicts.append(i > 0 and booked_times[i - 1] > slot - duration)
+    return conflicts
+
+
+async def book_series(
+    pid: UUID,
+    did: UUID,
+    slots: List[datetime],
+    upload_id: Optional[str] = None
+) -> Dict:
+    """
+    Book a series of appointments (recurring or explicit list)
+
+    All occurrences are checked against the doctor's bookings and other
+    patients' holds in one pass, then the free ones are inserted with a
+    single book_appointment_series RPC call.
 
     Args:
         pid: Patient UUID
         did: Doctor UUID
-        upload_id: Optional upload ID (prescription reference)
+        slots: Appointment datetimes
+        upload_id: Optional prescription reference
 
     Returns:
-        schedule_id if successful, None otherwise
+        Summary dict with per-occurrence results
     """
-    supabase = get_supabase_client()
+    # Compared with naive database times below, so offsets are normalized first
+    slots = sorted({normalize_datetime(slot) for slot in slots})
+    if not slots:
+        return {"success": False, "error": "No appointment times given", "status": "failed"}
+    if len(slots) > MAX_SERIES_OCCURRENCES:
+        return {
+            "success": False,
+            "error": f"At most {MAX_SERIES_OCCURRENCES} appointments can be booked at once",
+            "status": "failed"
+        }
 
     try:
-        # Get a valid upload_id if not provided
-        if not upload_id:
-            # Find the most recent upload for this patient and doctor
-            upload_query = supabase.table("uploads").select("upload_id").eq("pid", str(pid)).order("upload_timestamp", desc=True).limit(1).execute()
-
-            if upload_query.data:
-                upload_id = upload_query.data[0]["upload_id"]
+        duration = timedelta(minutes=SLOT_DURATION_MINUTES)
+        booked = await get_booked_times([str(did)], slots[0] - duration, slots[-1] + duration)
+        booked_times = [parse_db_datetime(row["appointment_time"]) for row in booked if row.get("appointment_time")]
+        held = {time for _, time in slot_holds.held_by_others([did], pid)}
+
+        results: Dict[datetime, Dict] = {}
+        free = []
+        for slot, conflict in zip(slots, find_conflicts(slots, booked_times)):
+            if conflict or slot_key(did, slot)[1] in held:
+                results[slot] = {"status": "conflict", "error": BOOKING_ERRORS["conflict"]}
             else:
-                # If no uploads exist, we still need one for FK constraint
-                # In production, this should be handled differently
-                print("Warning: No upload_id found, booking without prescription reference")
-                return None
-
-        # Create schedule record
-        booking_data = {
-            "pid": str(pid),
-            "did": str(did),
-            "upload_id": upload_id
-        }
-
-        response = supabase.table("schedule").insert(booking_data).execute()
-
-        if response.data:
-            return response.data[0]["schedule_id"]
+                free.append(slot)
+
+        if free:
+            record = await get_repository().book_appointment_series(str(pid), str(did), free, upload_id) or {}
+            status = record.get("status")
+
+            if status != "completed":
+                return {
+                    "success": False,
+                    "error": BOOKING_ERRORS.get(status, record.get("error", "Booking failed")),
+                    "status": status if status in BOOKING_ERRORS else "failed"
+                }
+
+            # RPC results come back in the order the times were sent
+            for slot, item in zip(free, record.get("results", [])):
+                results[slot] = item
+
+        occurrences = []
+        for slot in slots:
+            item = results.get(slot, {"status": "failed", "error": "No result returned"})
+            occurrences.append({
+                "appointment_time": slot.isoformat(),
+                "status": item.get("status"),
+                "schedule_id": item.get("schedule_id"),
+                "error": item.get("error")
+            })
+
+        booked_times = [item["appointment_time"] for item in occurrences if item["status"] == "confirmed"]
+        booked_count = len(booked_times)
+        if booked_count:
+            slot_holds.release_patient(pid)
+
+            if record.get("phone"):
+                enqueue_notification(
+                    "series_confirmation",
+                    contact=record["phone"],
+                    doctor_name=record.get("doctor_name"),
+                    appointment_times=booked_times
+                )
+            for item in occurrences:
+                if item["status"] == "confirmed":
+                    appointment_reminders.upsert(
+                        item["schedule_id"],
+                        datetime.fromisoformat(item["appointment_time"]),
+                        record.get("phone"),
+                        record.get("doctor_name")
+                    )
 
-        return None
+        return {
+            "success": booked_count > 0,
+            "status": "confirmed" if booked_count == len(slots) else ("partial" if booked_count else "conflict"),
+            "booked": booked_count,
+            "conflicts": len(slots) - booked_count,
+            "total": len(slots),
+            "occurrences": occurrences,
+            "message": f"Booked {booked_count} of {len(slots)} appointments"
+        }
 
     except Exception as e:
-        print(f"Error creating booking: {e}")
-        return None
+        print(f"Error in book_series: {e}")
+        return {
+            "success": False,
+            "error": f"Booking failed: {str(e)}",
+            "status": "failed"
+        }
 
 
-async def book_slot(pid: UUID, did: UUID, slot: datetime, upload_id: Optional[str] = None) -> Dict:
+async def reschedule_booking(schedule_id: UUID, pid: UUID, new_slot: datetime) -> Dict:
     """
-    Main function: Book an appointment slot
+    Move an existing appointment to a new time
+
+    The ownership check, conflict check and update happen in one call to the
+    reschedule_appointment RPC, so the patient never loses the original slot
+    unless the new one is secured. Slots held for other patients are
+    rejected first, like in book_slot.
 
     Args:
-        pid: Patient UUID
-        did: Doctor UUID
-        slot: Appointment datetime
-        upload_id: Optional prescription reference
+        schedule_id: Schedule UUID to move
+        pid: Patient UUID that must own the appointment
+        new_slot: New appointment datetime
 
     Returns:
-        BookingConfirmation dict or error dict
+        Rescheduled booking dict or error dict
     """
-    try:
-        # 1. Validate slot availability
-        is_available = await validate_slot_availability(pid, did, slot)
+    supabase = get_async_supabase_client()
 
-        if not is_available:
+    try:
+        # Slots suggested to another patient stay reserved, as in book_slot
+        current = await supabase.table("schedule").select("did").eq(
+            "schedule_id", str(schedule_id)
+        ).eq("pid", str(pid)).limit(1).execute()
+        if current.data:
+            holder = slot_holds.holder(slot_key(current.data[0]["did"], new_slot))
+            if holder and holder != str(pid):
+                return {
+                    "success": False,
+                    "error": BOOKING_ERRORS["conflict"],
+                    "status": "conflict"
+                }
+
+        response = await supabase.rpc("reschedule_appointment", {
+            "p_schedule_id": str(schedule_id),
+            "p_pid": str(pid),
+            "p_new_time": new_slot.isoformat()
+        }).execute()
+        record = response.data or {}
+        status = record.get("status")
+
+        if status != "rescheduled":
             return {
                 "success": False,
-                "error": "Slot is not available or invalid patient/doctor",
-                "status": "failed"
+                "error": BOOKING_ERRORS.get(status, record.get("error", "Reschedule failed")),
+                "status": status if status in BOOKING_ERRORS else "failed"
             }
 
-        # 2. Create booking record
-        schedule_id = await create_booking_record(pid, did, upload_id)
+        slot_holds.release_patient(pid)
+        forget_tool_results(pid)
 
-        if not schedule_id:
-            return {
-                "success": False,
-                "error": "Failed to create booking. Please ensure you have uploaded a prescription.",
-                "status": "failed"
-            }
+        if record.get("phone"):
+            enqueue_notification(
+                "reschedule_confirmation",
+                contact=record["phone"],
+                doctor_name=record.get("doctor_name"),
+                appointment_time=new_slot.isoformat()
+            )
+        appointment_reminders.upsert(schedule_id, new_slot, record.get("phone"), record.get("doctor_name"))
 
-        # 3. Create confirmation
         confirmation = BookingConfirmation(
-            schedule_id=schedule_id,
+            schedule_id=str(schedule_id),
             patient_id=str(pid),
-            doctor_id=str(did),
-            appointment_time=slot.isoformat(),
-            status="confirmed"
+            doctor_id=str(record.get("doctor_id")),
+            appointment_time=new_slot.isoformat(),
+            status="rescheduled"
         )
 
         return {
             "success": True,
             "booking": confirmation.to_dict(),
-            "status": "confirmed",
-            "message": "Appointment booked successfully"
+            "previous_time": record.get("previous_time"),
+            "status": "rescheduled",
+            "message": "Appointment rescheduled successfully"
         }
 
     except Exception as e:
-        print(f"Error in book_slot: {e}")
+        print(f"Error rescheduling booking: {e}")
         return {
             "success": False,
-            "error": f"Booking failed: {str(e)}",
+            "error": f"Reschedule failed: {str(e)}",
             "status": "failed"
         }
 
 
-async def cancel_booking(schedule_id: UUID) -> Dict:
+async def cancel_booking(schedule_id: UUID, pid: Optional[UUID] = None) -> Dict:
     """
     Cancel an existing appointment
 
+    When pid is given, the delete is conditional on ownership so the check
+    and the delete happen in a single round trip.
+
     Args:
         schedule_id: Schedule UUID to cancel
+        pid: Optional patient UUID that must own the appointment
 
     Returns:
         Success/failure dict
     """
-    supabase = get_supabase_client()
+    supabase = get_async_supabase_client()
 
     try:
-        # Delete the schedule record
-        response = supabase.table("schedule").delete().eq("schedule_id", str(schedule_id)).execute()
+        query = supabase.table("schedule").delete().eq("schedule_id", str(schedule_id))
+        if pid is not None:
+            query = query.eq("pid", str(pid))
+
+        response = await query.execute()
 
         if response.data:
+            appointment_reminders.remove(schedule_id)
+            # A rebook of the freed slot must not replay the original booking
+            forget_tool_results(pid if pid is not None else response.data[0].get("pid"))
             return {
                 "success": True,
                 "message": "Appointment cancelled successfully",
@@ -208,7 +433,7 @@ async def cancel_booking(schedule_id: UUID) -> Dict:
         return {
             "success": False,
             "error": "Appointment not found",
-            "status": "failed"
+            "status": "not_found"
         }
 
     except Exception as e:
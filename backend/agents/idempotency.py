@@ -0,0 +1,170 @@
+"""
+Idempotency Cache
+Replays completed booking/cancellation results for retried requests
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_TOOL_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TOOL_TTL_SECONDS", "120"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IN_FLIGHT_TTL_SECONDS = 60.0
+
+STATE_NEW = "new"
+STATE_IN_FLIGHT = "in_flight"
+STATE_COMPLETED = "completed"
+
+# Results with these statuses are transient and must not be replayed
+RETRYABLE_STATUSES = {"failed", "rate_limited"}
+
+# Marks keys derived from tool arguments rather than supplied by a client
+TOOL_KEY_PREFIX = "tool"
+
+
+class IdempotencyCache:
+    """
+    Bounded TTL cache of completed results and in-flight markers
+
+    Tool calls run their coroutines on the app loop (scripts use their own
+    loop); no method awaits while holding the lock, so a plain threading lock
+    is enough and the cache is safe to share across loops.
+    """
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key: str) -> Tuple[str, Optional[Dict]]:
+        """
+        Claim a key, or report what is already stored under it
+
+        Returns:
+            (STATE_NEW, None) if the caller now owns the key,
+            (STATE_IN_FLIGHT, None) if another request is running it,
+            (STATE_COMPLETED, result) if a result can be replayed
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1], entry[2]
+
+            self._entries[key] = (now + IN_FLIGHT_TTL_SECONDS, STATE_IN_FLIGHT, None)
+            self._entries.move_to_end(key)
+            self._evict(now)
+            return STATE_NEW, None
+
+    def complete(self, key: str, result: Dict, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        """Store the final result for a claimed key"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, STATE_COMPLETED, result)
+            self._entries.move_to_end(key)
+
+    def release(self, key: str):
+        """Drop a claimed key so the request can be retried"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_prefix(self, prefix: str) -> int:
+        """Drop every key starting with prefix; returns how many were dropped"""
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        if len(self._entries) <= self.max_entries:
+            return
+        # Over capacity: drop expired entries first, then the least recently used
+        for key in [k for k, (expires, _, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+idempotency_cache = IdempotencyCache()
+
+
+def tool_key(*parts) -> str:
+    """Build an idempotency key from a tool call's arguments"""
+    return ":".join([TOOL_KEY_PREFIX] + [str(part) for part in parts])
+
+
+def forget_tool_results(pid) -> int:
+    """
+    Drop a patient's tool-derived booking and reschedule results
+
+    Called after a cancel or reschedule changes the patient's bookings, so an
+    identical tool call made afterwards runs again instead of replaying a
+    result that no longer describes the schedule. Client-supplied keys are
+    left alone.
+    """
+    return sum(
+        idempotency_cache.discard_prefix(f"{scope}:{pid}:{TOOL_KEY_PREFIX}:")
+        for scope in ("booking", "reschedule")
+    )
+
+
+async def run_idempotent(
+    scope: str,
+    key: Optional[str],
+    operation: Callable[[], Awaitable[Dict]],
+    ttl: float = IDEMPOTENCY_TTL_SECONDS
+) -> Dict:
+    """
+    Run an operation at most once per (scope, key)
+
+    Without a key the operation simply runs. A replay of a completed key
+    returns the stored result without touching the database; a replay of a
+    key that is still running returns an "in_progress" result.
+
+    Args:
+        scope: Namespace for the key, e.g. "booking:<patient_id>"
+        key: Client-supplied idempotency key
+        operation: Zero-argument coroutine function to run
+        ttl: How long a completed result is kept
+
+    Returns:
+        The operation's result dict
+    """
+    if not key:
+        return await operation()
+
+    cache_key = f"{scope}:{key}"
+    state, stored = idempotency_cache.begin(cache_key)
+
+    if state == STATE_COMPLETED:
+        return stored
+    if state == STATE_IN_FLIGHT:
+        return {
+            "success": False,
+            "error": "A request with this idempotency key is already in progress",
+            "status": "in_progress"
+        }
+
+    try:
+        result = await operation()
+    except BaseException:
+        idempotency_cache.release(cache_key)
+        raise
+
+    if result.get("status") in RETRYABLE_STATUSES:
+        idempotency_cache.release(cache_key)
+    else:
+        idempotency_cache.complete(cache_key, result, ttl)
+
+    return result
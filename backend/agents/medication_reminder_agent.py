@@ -3,22 +3,68 @@ Medication Reminder Agent
 Cron-based medication reminder system
 """
 
-from datetime import datetime, time
-from typing import List, Dict, Set
+from datetime import date, datetime, time
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from uuid import UUID
+import asyncio
+import random
 import sys
 import os
+import time as clock
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from supabase_client import get_supabase_client
-from agents.notification_agent import send_medication_reminder
-
+from supabase_client import get_async_supabase_client
+from repository import get_repository
+from change_feed import change_bus
+from agents.notification_agent import send_notifications_batch, format_medication_digest
+from agents.reminder_ledger import get_reminder_ledger, reminder_key
+from agents.reminder_shards import shard_buckets, shard_label
+
+
+# Concurrent bridge batch calls per reminder cycle
+REMINDER_SEND_CONCURRENCY = int(os.getenv("REMINDER_SEND_CONCURRENCY", "8"))
+# Patients per batch call
+REMINDER_CHUNK_SIZE = int(os.getenv("REMINDER_CHUNK_SIZE", "50"))
+# Rows per due_medications page
+REMINDER_PAGE_SIZE = int(os.getenv("REMINDER_PAGE_SIZE", "1000"))
+# Reminder time used when a drug slot has none of its own
+SLOT_DEFAULT_TIMES = {
+    "morning": time(8, 0),
+    "afternoon": time(13, 0),
+    "night": time(20, 0)
+}
+# Progress of the cycle running in this worker, for status endpoints
+cycle_progress: Dict = {"running": False}
+# Latencies kept for percentile reporting
+LATENCY_SAMPLE_SIZE = 10000
+
+
+class LatencySample:
+    """Fixed-size reservoir of send latencies, so memory stays flat"""
+
+    def __init__(self, size: int = LATENCY_SAMPLE_SIZE):
+        self.size = size
+        self.values: List[float] = []
+        self.count = 0
+
+    def add(self, value: float):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < self.size:
+                self.values[index] = value
 
-# Track sent reminders to avoid duplicates (in-memory for now)
-# In production, this should be persisted in database
-SENT_REMINDERS: Set[str] = set()
+    def percentile_ms(self, pct: float) -> float:
+        """Nearest-rank percentile in milliseconds"""
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        rank = max(int(len(ordered) * pct / 100 + 0.5) - 1, 0)
+        return round(ordered[min(rank, len(ordered) - 1)] * 1000, 1)
 
 
 def get_current_slot() -> str:
@@ -38,157 +84,392 @@ def get_current_slot() -> str:
         return "night"
 
 
+def _medication_from_row(record: Dict) -> Dict:
+    """Map a due_medications view row to a medication record"""
+    return {
+        "slot_id": record["slot_id"],
+        "drug_id": record["drug_id"],
+        "drug_name": record.get("drug_name") or "Unknown",
+        "patient_id": record.get("pid"),
+        "patient_name": record.get("patient_name") or "Unknown",
+        "patient_phone": record.get("patient_phone") or "",
+        "slot": record["slot"]
+    }
+
+
+async def stream_due_medications(
+    slot: Optional[str] = None,
+    page_size: int = REMINDER_PAGE_SIZE,
+    remind_after: Optional[time] = None,
+    remind_until: Optional[time] = None,
+    buckets: Optional[List[int]] = None
+) -> AsyncIterator[List[Dict]]:
+    """
+    Stream due medications, one keyset-paginated page at a time
+
+    Pages are ordered by (pid, slot_id) and each page resumes after the
+    last row of the previous one, so no page costs more than the first.
+    A patient's rows never straddle two yielded pages: the trailing
+    patient of a page is held back and yielded with the next one.
+    A failed fetch raises, so a cycle is never mistaken for complete.
+
+    Args:
+        slot: Optional time slot (morning/afternoon/night)
+        page_size: Rows fetched per query
+        remind_after: Only reminder times after this (exclusive)
+        remind_until: Only reminder times up to this (inclusive)
+        buckets: Only patients in these shard buckets
+
+    Yields:
+        Lists of medication records with patient contact info
+    """
+    repository = get_repository()
+    last_pid, last_slot_id = None, None
+    carry: List[Dict] = []
+
+    while True:
+        rows = await repository.fetch_due_medications(
+            slot=slot,
+            remind_after=remind_after,
+            remind_until=remind_until,
+            buckets=buckets,
+            after=(last_pid, last_slot_id) if last_pid is not None else None,
+            limit=page_size
+        )
+
+        if not rows:
+            break
+
+        last_pid, last_slot_id = rows[-1]["pid"], rows[-1]["slot_id"]
+        page = carry + [_medication_from_row(row) for row in rows]
+
+        if len(rows) < page_size:
+            carry = page
+            break
+
+        # Hold back the last patient; their rows may continue on the next page
+        split = len(page)
+        while split > 0 and page[split - 1]["patient_id"] == last_pid:
+            split -= 1
+        page, carry = page[:split], page[split:]
+        if page:
+            yield page
+
+    if carry:
+        yield carry
+
+
 async def get_due_medications(slot: str) -> List[Dict]:
     """
     Query database for medications due in the current slot
 
+    Loads every page; prefer stream_due_medications for large slots.
+
     Args:
         slot: Time slot (morning/afternoon/night)
 
     Returns:
         List of medication records with patient contact info
     """
-    supabase = get_supabase_client()
+    medications = []
+    async for page in stream_due_medications(slot):
+        medications.extend(page)
+    return medications
+
+
+async def get_reminder_times() -> List[time]:
+    """
+    Distinct reminder times across all drug slots, earliest first
+    """
+    supabase = get_async_supabase_client()
+
+    try:
+        response = await supabase.table("reminder_times").select("remind_at").execute()
+        times = {time.fromisoformat(row["remind_at"]) for row in response.data or [] if row.get("remind_at")}
+        return sorted(times)
+    except Exception as e:
+        print(f"Error fetching reminder times: {e}")
+        return sorted(set(SLOT_DEFAULT_TIMES.values()))
+
+
+async def set_reminder_time(pid: str, drug_id: str, slot: str, remind_at: Optional[time]) -> Dict:
+    """
+    Set when a patient is reminded to take a drug in one slot
+
+    Args:
+        pid: Patient UUID (must own the drug)
+        drug_id: Drug UUID
+        slot: Time slot (morning/afternoon/night)
+        remind_at: Reminder time, or None for the slot default
+
+    Returns:
+        Success/failure dict
+    """
+    supabase = get_async_supabase_client()
 
     try:
-        # Query drug_slots table for the current slot
-        # Join with drugs, patients to get complete information
-        response = supabase.table("drug_slots").select(
-            "slot_id, slot, drug_id, drugs(drug_name, pid, patients(phone, name))"
-        ).eq("slot", slot).execute()
+        drug = await supabase.table("drugs").select("drug_id").eq("drug_id", drug_id).eq("pid", pid).execute()
+        if not drug.data:
+            return {"success": False, "status": "not_found", "error": "Medication not found"}
+
+        response = await supabase.table("drug_slots").update({
+            "remind_at": remind_at.isoformat() if remind_at else None
+        }).eq("drug_id", drug_id).eq("slot", slot).execute()
 
         if not response.data:
-            return []
-
-        medications = []
-        for record in response.data:
-            # Extract nested data
-            drug_info = record.get("drugs", {})
-            patient_info = drug_info.get("patients", {})
-
-            medications.append({
-                "slot_id": record["slot_id"],
-                "drug_id": record["drug_id"],
-                "drug_name": drug_info.get("drug_name", "Unknown"),
-                "patient_id": drug_info.get("pid"),
-                "patient_name": patient_info.get("name", "Unknown"),
-                "patient_phone": patient_info.get("phone", ""),
-                "slot": record["slot"]
-            })
-
-        return medications
+            return {"success": False, "status": "not_found", "error": f"Medication has no {slot} slot"}
 
+        change_bus.publish("drug_slots", "UPDATE", id=response.data[0].get("slot_id"), pid=pid)
+
+        return {
+            "success": True,
+            "status": "updated",
+            "drug_id": drug_id,
+            "slot": slot,
+            "remind_at": response.data[0].get("remind_at")
+        }
     except Exception as e:
-        print(f"Error fetching due medications: {e}")
-        return []
+        print(f"Error setting reminder time: {e}")
+        return {"success": False, "status": "failed", "error": f"Failed to set reminder time: {str(e)}"}
 
 
-def generate_reminder_key(patient_id: str, drug_id: str, slot: str, date: str) -> str:
+def generate_reminder_key(patient_id: str, drug_id: str, slot: str) -> bytes:
     """
-    Generate unique key for tracking sent reminders
+    Generate compact key for tracking sent reminders
+
+    The date is not part of the key; the ledger partitions keys by day.
 
     Args:
         patient_id: Patient UUID
         drug_id: Drug UUID
         slot: Time slot
-        date: Date in YYYY-MM-DD format
 
     Returns:
-        Unique reminder key
+        Reminder key bytes
     """
-    return f"{patient_id}:{drug_id}:{slot}:{date}"
+    return reminder_key(patient_id, drug_id, slot)
 
 
-async def send_reminders_for_medications(medications: List[Dict]) -> Dict:
+async def send_reminders_for_medications(
+    medications: List[Dict],
+    latencies: Optional[LatencySample] = None,
+    on: Optional[date] = None
+) -> Dict:
     """
-    Send reminders for a list of medications
+    Send reminders for a list of medications, one message per patient per slot
 
     Args:
         medications: List of medication records
+        latencies: Optional sample to record send latencies into
+        on: Day the reminders belong to (defaults to today)
 
     Returns:
         Summary of sent reminders
     """
-    sent_count = 0
     failed_count = 0
     skipped_count = 0
-    current_date = datetime.now().strftime("%Y-%m-%d")
+    ledger = get_reminder_ledger()
+
+    # Group unsent reminders into one digest per (patient, slot); each
+    # digest keeps the per-drug keys so sent-tracking stays per drug
+    digests: Dict[tuple, Dict] = {}
 
     for med in medications:
         # Generate reminder key
         reminder_key = generate_reminder_key(
             med["patient_id"],
             med["drug_id"],
-            med["slot"],
-            current_date
+            med["slot"]
         )
 
         # Check if already sent today
-        if reminder_key in SENT_REMINDERS:
+        if ledger.seen(reminder_key, on):
             skipped_count += 1
             continue
 
-        # Send notification
         contact = med["patient_phone"]
         if not contact:
             print(f"No phone number for patient {med['patient_name']}")
             failed_count += 1
             continue
 
-        result = await send_medication_reminder(
-            contact=contact,
-            drug_name=med["drug_name"],
-            slot=med["slot"]
-        )
+        digest = digests.setdefault((med["patient_id"], med["slot"]), {
+            "patient_id": med["patient_id"],
+            "contact": contact,
+            "slot": med["slot"],
+            "keys": [],
+            "drug_names": []
+        })
+        if reminder_key in digest["keys"]:
+            continue  # Same drug listed twice in this slot
+        digest["keys"].append(reminder_key)
+        digest["drug_names"].append(med["drug_name"])
+
+    # Claim reminders in the shared ledger before sending, so another
+    # worker running the same cycle skips them
+    keys = [key for digest in digests.values() for key in digest["keys"]]
+    claimed = dict(zip(keys, ledger.claim(keys, on))) if keys else {}
+
+    for group, digest in list(digests.items()):
+        owned = [i for i, key in enumerate(digest["keys"]) if claimed[key]]
+        skipped_count += len(digest["keys"]) - len(owned)
+        if not owned:
+            del digests[group]
+            continue
+        digest["keys"] = [digest["keys"][i] for i in owned]
+        digest["drug_names"] = [digest["drug_names"][i] for i in owned]
 
+    started = clock.monotonic()
+    outcomes = await dispatch_digests(list(digests.values()))
+    elapsed = clock.monotonic() - started
+
+    sent_count = 0
+    messages_sent = 0
+    latencies = latencies if latencies is not None else LatencySample()
+    for digest, result, latency in outcomes:
+        latencies.add(latency)
         if result.get("success"):
-            sent_count += 1
-            SENT_REMINDERS.add(reminder_key)
+            messages_sent += 1
+            sent_count += len(digest["keys"])
         else:
-            failed_count += 1
+            failed_count += len(digest["keys"])
+            ledger.release(digest["keys"], on)
             print(f"Failed to send reminder: {result.get('error')}")
 
     return {
         "sent": sent_count,
         "failed": failed_count,
         "skipped": skipped_count,
-        "total": len(medications)
+        "messages": messages_sent,
+        "total": len(medications),
+        "duration_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(outcomes) / elapsed, 1) if outcomes and elapsed > 0 else 0.0,
+        "p95_latency_ms": latencies.percentile_ms(95)
     }
 
 
-async def run_reminder_cycle() -> Dict:
+async def dispatch_digests(digests: List[Dict]) -> List[Tuple[Dict, Dict, float]]:
+    """
+    Send digests with bounded concurrency
+
+    Patients are split into chunks that are sent concurrently, at most
+    REMINDER_SEND_CONCURRENCY at a time. Within a chunk, a patient's
+    digests go out in rounds (first digest of every patient, then the
+    second, ...), so one patient's messages are never sent out of order.
+
+    Returns:
+        (digest, result, latency_seconds) for every digest
+    """
+    by_patient: Dict[str, List[Dict]] = {}
+    for digest in digests:
+        by_patient.setdefault(digest["patient_id"], []).append(digest)
+
+    lanes = list(by_patient.values())
+    chunks = [lanes[i:i + REMINDER_CHUNK_SIZE] for i in range(0, len(lanes), REMINDER_CHUNK_SIZE)]
+    semaphore = asyncio.Semaphore(REMINDER_SEND_CONCURRENCY)
+
+    async def send_chunk(chunk: List[List[Dict]]) -> List[Tuple[Dict, Dict, float]]:
+        outcomes = []
+        async with semaphore:
+            for round_index in range(max(len(lane) for lane in chunk)):
+                batch = [lane[round_index] for lane in chunk if round_index < len(lane)]
+                started = clock.monotonic()
+                try:
+                    response = await send_notifications_batch([
+                        {"contact": d["contact"], "message": format_medication_digest(d["drug_names"], d["slot"])}
+                        for d in batch
+                    ])
+                    results = response.get("results", [])
+                except Exception as e:
+                    results = [{"success": False, "error": str(e)}] * len(batch)
+                latency = clock.monotonic() - started
+
+                for i, digest in enumerate(batch):
+                    result = results[i] if i < len(results) else {"success": False, "error": "No result returned"}
+                    outcomes.append((digest, result, latency))
+        return outcomes
+
+    chunk_outcomes = await asyncio.gather(*(send_chunk(chunk) for chunk in chunks))
+    return [outcome for outcomes in chunk_outcomes for outcome in outcomes]
+
+
+async def run_reminder_cycle(
+    slot: Optional[str] = None,
+    remind_after: Optional[time] = None,
+    remind_until: Optional[time] = None,
+    on: Optional[date] = None,
+    buckets: Optional[List[int]] = None
+) -> Dict:
     """
     Main function: Run one cycle of medication reminders
-    Should be called by cron job at appropriate intervals
+    Called by the reminder scheduler as reminder times come due, or manually
+
+    Args:
+        slot: Slot to run (defaults to the current slot unless a time window is given)
+        remind_after: Start of the reminder-time window (exclusive)
+        remind_until: End of the reminder-time window (inclusive)
+        on: Day the reminders belong to (defaults to today)
+        buckets: Shard buckets to cover (defaults to this worker's shard)
 
     Returns:
         Summary of reminder cycle execution
     """
     try:
-        # 1. Determine current slot
-        current_slot = get_current_slot()
-
-        # 2. Get medications due for this slot
-        due_medications = await get_due_medications(current_slot)
+        # 1. Determine current slot, or the window of reminder times
+        windowed = remind_after is not None or remind_until is not None
+        current_slot = slot or (None if windowed else get_current_slot())
+        label = f"{current_slot} slot" if current_slot else (
+            f"reminders {remind_after.strftime('%H:%M') if remind_after else '00:00'}"
+            f"-{remind_until.strftime('%H:%M') if remind_until else '24:00'}"
+        )
 
-        if not due_medications:
+        buckets = buckets if buckets is not None else shard_buckets()
+        shard = shard_label()
+
+        # 2. Stream due medications page by page straight into dispatch
+        totals = {"sent": 0, "failed": 0, "skipped": 0, "messages": 0, "total": 0}
+        latencies = LatencySample()
+        pages = 0
+        started = clock.monotonic()
+        cycle_progress.clear()
+        cycle_progress.update(running=True, shard=shard, label=label, started_at=datetime.now().isoformat(), pages=0, **totals)
+
+        try:
+            async for page in stream_due_medications(
+                current_slot, remind_after=remind_after, remind_until=remind_until, buckets=buckets
+            ):
+                pages += 1
+                result = await send_reminders_for_medications(page, latencies, on)
+                for field in totals:
+                    totals[field] += result[field]
+                cycle_progress.update(pages=pages, **totals)
+        finally:
+            cycle_progress["running"] = False
+
+        if not totals["total"]:
             return {
                 "success": True,
                 "slot": current_slot,
-                "message": "No medications due for this slot",
+                "shard": shard,
+                "message": f"No medications due for {label}",
                 "sent": 0,
                 "failed": 0,
-                "skipped": 0
+                "skipped": 0,
+                "messages": 0
             }
 
-        # 3. Send reminders
-        result = await send_reminders_for_medications(due_medications)
-
+        # 3. Summarize the cycle
+        elapsed = clock.monotonic() - started
         return {
             "success": True,
             "slot": current_slot,
-            "message": f"Reminder cycle completed for {current_slot} slot",
-            **result
+            "shard": shard,
+            "message": f"Reminder cycle completed for {label}",
+            **totals,
+            "pages": pages,
+            "duration_seconds": round(elapsed, 3),
+            "throughput_per_second": round(latencies.count / elapsed, 1) if elapsed > 0 else 0.0,
+            "p95_latency_ms": latencies.percentile_ms(95)
         }
 
     except Exception as e:
@@ -204,12 +485,11 @@ async def run_reminder_cycle() -> Dict:
 
 async def clear_daily_reminder_cache():
     """
-    Clear the reminder cache (should be run once daily)
-    In production, this would clean up database records
+    Drop sent-reminder records from previous days
+    Expired days are also dropped automatically when the date rolls over
     """
-    global SENT_REMINDERS
-    SENT_REMINDERS.clear()
-    return {"success": True, "message": "Reminder cache cleared"}
+    purged = get_reminder_ledger().purge_expired()
+    return {"success": True, "message": f"Reminder cache cleared ({purged} expired records removed)"}
 
 
 # Test function
@@ -3,18 +3,131 @@ Notification Agent
 Sends notifications via external API
 """
 
+import asyncio
 import httpx
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.send_scheduler import (
+    SendScheduler,
+    PRIORITY_CONFIRMATION,
+    PRIORITY_NORMAL,
+    PRIORITY_REMINDER,
+)
 
 
 # External notification API configuration
 NOTIFICATION_API_BASE = os.getenv("NOTIFICATION_API_URL", "http://localhost:5000")
 
+# Shared HTTP client pool configuration
+NOTIFICATION_MAX_CONNECTIONS = int(os.getenv("NOTIFICATION_MAX_CONNECTIONS", "100"))
+NOTIFICATION_MAX_KEEPALIVE = int(os.getenv("NOTIFICATION_MAX_KEEPALIVE", "20"))
+NOTIFICATION_KEEPALIVE_EXPIRY = float(os.getenv("NOTIFICATION_KEEPALIVE_EXPIRY", "30"))
+NOTIFICATION_HTTP2 = os.getenv("NOTIFICATION_HTTP2", "false").lower() in ("1", "true", "yes")
+NOTIFICATION_TIMEOUT = httpx.Timeout(10.0, connect=3.0, pool=5.0)
+
+# Messages per /send/batch call (the bridge accepts up to 500)
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "100"))
+
+
+class PoolMetrics:
+    """Counters for the shared notification HTTP client"""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.pool_timeouts = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "pool_timeouts": self.pool_timeouts,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "max_connections": NOTIFICATION_MAX_CONNECTIONS,
+            "saturation": round(self.in_flight / NOTIFICATION_MAX_CONNECTIONS, 3),
+            "http2": _client is not None and _client_http2,
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+def _rejected_by_bridge(status_code: int) -> bool:
+    """Responses that mean the bridge did not send the message (4xx, 503)"""
+    return 400 <= status_code < 500 or status_code == 503
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_client_http2 = False
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    global _client_http2
 
-async def send_notification(contact: str, message: str) -> Dict:
+    # HTTP/2 needs the optional "h2" package (pip install httpx[http2])
+    _client_http2 = False
+    if NOTIFICATION_HTTP2:
+        try:
+            import h2  # noqa: F401
+            _client_http2 = True
+        except ImportError:
+            print("NOTIFICATION_HTTP2 is set but h2 is not installed; using HTTP/1.1")
+
+    return httpx.AsyncClient(
+        base_url=NOTIFICATION_API_BASE,
+        timeout=NOTIFICATION_TIMEOUT,
+        http2=_client_http2,
+        limits=httpx.Limits(
+            max_connections=NOTIFICATION_MAX_CONNECTIONS,
+            max_keepalive_connections=NOTIFICATION_MAX_KEEPALIVE,
+            keepalive_expiry=NOTIFICATION_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def start_http_client():
+    """Create the process-wide HTTP client (called from the app lifespan)"""
+    global _client, _client_loop
+    if _client is None:
+        _client = _create_http_client()
+        _client_loop = asyncio.get_running_loop()
+
+
+async def close_http_client():
+    """Close the process-wide HTTP client and its pooled connections"""
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _client_loop = None
+
+
+def get_http_client() -> httpx.AsyncClient:
     """
-    Send notification via external WhatsApp bridge API
+    Get the shared HTTP client
+
+    Created lazily when the app lifespan has not run (scripts, tests).
+    Connections are bound to an event loop, so callers on another loop
+    get a client of their own.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = _create_http_client()
+        _client_loop = loop
+    return _client
+
+
+async def _post_notification(contact: str, message: str) -> Dict:
+    """
+    Send notification via external WhatsApp bridge API (unthrottled)
 
     API Endpoint: POST /send
     Body: {"contact": "...", "message": "..."}
@@ -26,37 +139,58 @@ async def send_notification(contact: str, message: str) -> Dict:
     Returns:
         Success/failure dict with API response
     """
-    try:
-        # Construct API endpoint
-        endpoint = f"{NOTIFICATION_API_BASE}/send"
-        
-        # Prepare payload
-        payload = {
-            "contact": contact,
-            "message": message
-        }
+    # Prepare payload
+    payload = {
+        "contact": contact,
+        "message": message
+    }
 
-        # Make POST request
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(endpoint, json=payload)
+    pool_metrics.requests += 1
+    pool_metrics.in_flight += 1
+    pool_metrics.peak_in_flight = max(pool_metrics.peak_in_flight, pool_metrics.in_flight)
 
-            if response.status_code == 200:
-                return {
-                    "success": True,
-                    "status": "sent",
-                    "message": "Notification sent successfully via WhatsApp",
-                    "contact": contact,
-                    "api_response": response.json()
-                }
-            else:
-                return {
-                    "success": False,
-                    "status": "failed",
-                    "error": f"API returned status {response.status_code}: {response.text}",
-                    "contact": contact
-                }
+    try:
+        response = await get_http_client().post("/send", json=payload)
 
+        if response.status_code == 200:
+            return {
+                "success": True,
+                "status": "sent",
+                "message": "Notification sent successfully via WhatsApp",
+                "contact": contact,
+                "api_response": response.json()
+            }
+        else:
+            pool_metrics.errors += 1
+            return {
+                "success": False,
+                "status": "failed",
+                "error": f"API returned status {response.status_code}: {response.text}",
+                "contact": contact,
+                "undelivered": _rejected_by_bridge(response.status_code)
+            }
+
+    except httpx.PoolTimeout:
+        pool_metrics.pool_timeouts += 1
+        pool_metrics.errors += 1
+        return {
+            "success": False,
+            "status": "failed",
+            "error": "Notification connection pool exhausted",
+            "contact": contact,
+            "undelivered": True
+        }
+    except (httpx.ConnectTimeout, httpx.ConnectError):
+        pool_metrics.errors += 1
+        return {
+            "success": False,
+            "status": "failed",
+            "error": "Notification API unreachable",
+            "contact": contact,
+            "undelivered": True
+        }
     except httpx.TimeoutException:
+        pool_metrics.errors += 1
         return {
             "success": False,
             "status": "failed",
@@ -64,6 +198,7 @@ async def send_notification(contact: str, message: str) -> Dict:
             "contact": contact
         }
     except Exception as e:
+        pool_metrics.errors += 1
         print(f"Error sending notification: {e}")
         return {
             "success": False,
@@ -71,6 +206,165 @@ async def send_notification(contact: str, message: str) -> Dict:
             "error": f"Failed to send notification: {str(e)}",
             "contact": contact
         }
+    finally:
+        pool_metrics.in_flight -= 1
+
+
+async def _post_notifications_batch(messages: List[Dict]) -> Dict:
+    """
+    Send many notifications via the bridge's batch endpoint (unthrottled)
+
+    API Endpoint: POST /send/batch
+    Body: {"messages": [{"contact": "...", "message": "..."}, ...]}
+
+    Messages are chunked into NOTIFICATION_BATCH_SIZE requests.
+
+    Args:
+        messages: List of {"contact", "message"} dicts
+
+    Returns:
+        Summary dict with one result per message, in input order
+    """
+    results: List[Dict] = []
+
+    for start in range(0, len(messages), NOTIFICATION_BATCH_SIZE):
+        chunk = messages[start:start + NOTIFICATION_BATCH_SIZE]
+        payload = {"messages": [{"contact": m["contact"], "message": m["message"]} for m in chunk]}
+
+        pool_metrics.requests += 1
+        pool_metrics.in_flight += 1
+        pool_metrics.peak_in_flight = max(pool_metrics.peak_in_flight, pool_metrics.in_flight)
+
+        try:
+            # The bridge sends sequentially, so allow time per message
+            timeout = httpx.Timeout(
+                NOTIFICATION_TIMEOUT.read + 2 * len(chunk),
+                connect=NOTIFICATION_TIMEOUT.connect,
+                pool=NOTIFICATION_TIMEOUT.pool
+            )
+            response = await get_http_client().post("/send/batch", json=payload, timeout=timeout)
+
+            if response.status_code == 200:
+                chunk_results = response.json().get("results", [])
+                results.extend(
+                    {
+                        "success": bool(item.get("success")),
+                        "status": "sent" if item.get("success") else "failed",
+                        "error": None if item.get("success") else item.get("error", "Send failed"),
+                        "contact": m["contact"]
+                    }
+                    for m, item in zip(chunk, chunk_results)
+                )
+                missing = chunk[len(chunk_results):]
+                error, undelivered = "No result returned by bridge", False
+            else:
+                pool_metrics.errors += 1
+                missing = chunk
+                error = f"API returned status {response.status_code}: {response.text}"
+                undelivered = _rejected_by_bridge(response.status_code)
+
+        except httpx.PoolTimeout:
+            pool_metrics.pool_timeouts += 1
+            pool_metrics.errors += 1
+            missing, error, undelivered = chunk, "Notification connection pool exhausted", True
+        except (httpx.ConnectTimeout, httpx.ConnectError):
+            pool_metrics.errors += 1
+            missing, error, undelivered = chunk, "Notification API unreachable", True
+        except httpx.TimeoutException:
+            pool_metrics.errors += 1
+            missing, error, undelivered = chunk, "Notification API timeout", False
+        except Exception as e:
+            pool_metrics.errors += 1
+            print(f"Error sending notification batch: {e}")
+            missing, error, undelivered = chunk, f"Failed to send notification batch: {str(e)}", False
+        finally:
+            pool_metrics.in_flight -= 1
+
+        results.extend(
+            {"success": False, "status": "failed", "error": error, "contact": m["contact"],
+             "undelivered": undelivered}
+            for m in missing
+        )
+
+    sent = sum(1 for r in results if r["success"])
+    return {
+        "success": sent == len(results),
+        "sent": sent,
+        "failed": len(results) - sent,
+        "results": results
+    }
+
+
+send_scheduler = SendScheduler(_post_notification, _post_notifications_batch)
+
+
+def _active_scheduler() -> Optional[SendScheduler]:
+    """The send scheduler, if it is running on the current event loop"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return send_scheduler if send_scheduler.loop is loop else None
+
+
+async def send_notification(contact: str, message: str, priority: int = PRIORITY_NORMAL) -> Dict:
+    """
+    Send a notification, rate limited by the send scheduler when it is running
+
+    Args:
+        contact: Contact identifier (phone number)
+        message: Message to send
+        priority: PRIORITY_CONFIRMATION, PRIORITY_NORMAL or PRIORITY_REMINDER
+
+    Returns:
+        Success/failure dict
+    """
+    scheduler = _active_scheduler()
+    if scheduler is None:
+        return await _post_notification(contact, message)
+    return await scheduler.submit(contact, message, priority)
+
+
+async def send_notifications_batch(messages: List[Dict], priority: int = PRIORITY_REMINDER) -> Dict:
+    """
+    Send many notifications, rate limited by the send scheduler when it is running
+
+    The scheduler regroups released messages into bridge batch calls.
+
+    Args:
+        messages: List of {"contact", "message"} dicts
+        priority: Priority class for every message
+
+    Returns:
+        Summary dict with one result per message, in input order
+    """
+    scheduler = _active_scheduler()
+    if scheduler is None:
+        return await _post_notifications_batch(messages)
+
+    results = await asyncio.gather(*(
+        scheduler.submit(m["contact"], m["message"], priority) for m in messages
+    ))
+    sent = sum(1 for r in results if r.get("success"))
+    return {
+        "success": sent == len(results),
+        "sent": sent,
+        "failed": len(results) - sent,
+        "results": list(results)
+    }
+
+
+def format_medication_reminder(drug_name: str, slot: str) -> str:
+    """Medication reminder message text"""
+    return f"Reminder: Time to take your medication - {drug_name} ({slot})"
+
+
+def format_medication_digest(drug_names: List[str], slot: str) -> str:
+    """Medication reminder text covering every drug due in one slot"""
+    if len(drug_names) == 1:
+        return format_medication_reminder(drug_names[0], slot)
+    lines = "\n".join(f"- {name}" for name in drug_names)
+    return f"Reminder: Time to take your {slot} medications ({len(drug_names)}):\n{lines}"
 
 
 async def send_appointment_reminder(contact: str, doctor_name: str, appointment_time: str) -> Dict:
@@ -86,7 +380,7 @@ async def send_appointment_reminder(contact: str, doctor_name: str, appointment_
         Success/failure dict
     """
     message = f"Reminder: You have an appointment with Dr. {doctor_name} at {appointment_time}"
-    return await send_notification(contact, message)
+    return await send_notification(contact, message, PRIORITY_REMINDER)
 
 
 async def send_medication_reminder(contact: str, drug_name: str, slot: str) -> Dict:
@@ -101,8 +395,7 @@ async def send_medication_reminder(contact: str, drug_name: str, slot: str) -> D
     Returns:
         Success/failure dict
     """
-    message = f"Reminder: Time to take your medication - {drug_name} ({slot})"
-    return await send_notification(contact, message)
+    return await send_notification(contact, format_medication_reminder(drug_name, slot), PRIORITY_REMINDER)
 
 
 async def send_booking_confirmation(contact: str, doctor_name: str, appointment_time: str) -> Dict:
@@ -118,7 +411,40 @@ async def send_booking_confirmation(contact: str, doctor_name: str, appointment_
         Success/failure dict
     """
     message = f"Appointment confirmed with Dr. {doctor_name} on {appointment_time}"
-    return await send_notification(contact, message)
+    return await send_notification(contact, message, PRIORITY_CONFIRMATION)
+
+
+async def send_series_confirmation(contact: str, doctor_name: str, appointment_times: List[str]) -> Dict:
+    """
+    Send one confirmation for a series of booked appointments
+
+    Args:
+        contact: Contact identifier
+        doctor_name: Name of the doctor
+        appointment_times: Booked appointment times (ISO format)
+
+    Returns:
+        Success/failure dict
+    """
+    lines = "\n".join(f"- {time}" for time in appointment_times)
+    message = f"{len(appointment_times)} appointments confirmed with Dr. {doctor_name}:\n{lines}"
+    return await send_notification(contact, message, PRIORITY_CONFIRMATION)
+
+
+async def send_reschedule_confirmation(contact: str, doctor_name: str, appointment_time: str) -> Dict:
+    """
+    Send reschedule confirmation notification
+
+    Args:
+        contact: Contact identifier
+        doctor_name: Name of the doctor
+        appointment_time: New appointment time (ISO format)
+
+    Returns:
+        Success/failure dict
+    """
+    message = f"Your appointment with Dr. {doctor_name} has been moved to {appointment_time}"
+    return await send_notification(contact, message, PRIORITY_CONFIRMATION)
 
 
 # Test function
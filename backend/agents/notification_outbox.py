@@ -0,0 +1,332 @@
+"""
+Notification Outbox
+Durable queue of outgoing notifications, drained by a background dispatcher
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+import sys
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.notification_agent import (
+    send_appointment_reminder,
+    send_booking_confirmation,
+    send_reschedule_confirmation,
+    send_series_confirmation,
+)
+
+
+OUTBOX_PATH = os.getenv("NOTIFICATION_OUTBOX_PATH", "notification_outbox.db")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BASE_BACKOFF_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_BACKOFF_SECONDS", "5"))
+OUTBOX_MAX_BACKOFF_SECONDS = 900.0
+OUTBOX_POLL_SECONDS = 5.0
+OUTBOX_BATCH_SIZE = 50
+
+# Sent rows are kept this long for auditing, then purged by the dispatcher
+OUTBOX_SENT_RETENTION_SECONDS = 7 * 24 * 3600.0
+OUTBOX_PURGE_INTERVAL_SECONDS = 3600.0
+
+# A claimed row becomes due again after this long if the worker dies mid-send;
+# while the send is queued in the send scheduler the lease is extended
+OUTBOX_LEASE_SECONDS = 60.0
+OUTBOX_LEASE_RENEW_SECONDS = OUTBOX_LEASE_SECONDS / 3
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_DEAD = "dead"
+
+# Notification kind -> notification_agent sender (called with the payload)
+SENDERS = {
+    "booking_confirmation": send_booking_confirmation,
+    "series_confirmation": send_series_confirmation,
+    "reschedule_confirmation": send_reschedule_confirmation,
+    "appointment_reminder": send_appointment_reminder,
+}
+
+
+class NotificationOutbox:
+    """
+    SQLite-backed outbox
+
+    Writes are a single local insert, so the request path never waits on
+    the WhatsApp bridge. Delivery is at-least-once: a row is leased before
+    sending and becomes due again if the process dies before marking it.
+    The attempt count taken at claim time identifies the lease, so a worker
+    whose lease was lost cannot mark the row.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)"
+        )
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def enqueue(self, kind: str, **payload) -> int:
+        """
+        Queue a notification for delivery
+
+        Args:
+            kind: Notification kind (key of SENDERS)
+            **payload: Keyword arguments for the sender
+
+        Returns:
+            Outbox row ID
+        """
+        if kind not in SENDERS:
+            raise ValueError(f"Unknown notification kind: {kind}")
+
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (kind, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), now, now)
+            )
+
+        self._wake()
+        return cursor.lastrowid
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> asyncio.Event:
+        """Attach the dispatcher's event loop so enqueues can wake it"""
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _wake(self):
+        # Enqueues may come from tool threads running their own event loops
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def claim_due(self, limit: int = OUTBOX_BATCH_SIZE) -> List[Dict]:
+        """Lease up to `limit` due rows for sending"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, kind, payload, attempts FROM outbox "
+                    "WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (STATUS_PENDING, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?",
+                    [(now + OUTBOX_LEASE_SECONDS, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return [
+            {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+            for row in rows
+        ]
+
+    def seconds_until_next_due(self) -> Optional[float]:
+        """Time until the earliest pending row comes due, or None if the queue is empty"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?",
+                (STATUS_PENDING,)
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0.0)
+
+    def extend_lease(self, row_id: int, attempts: int) -> bool:
+        """Push back a claimed row's lease; False if the lease is no longer held"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND attempts = ? AND status = ?",
+                (time.time() + OUTBOX_LEASE_SECONDS, row_id, attempts, STATUS_PENDING)
+            )
+        return bool(cursor.rowcount)
+
+    def mark_sent(self, row_id: int, attempts: int) -> bool:
+        """Record a delivery; False if the lease was lost (the row is left alone)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, last_error = NULL WHERE id = ? AND attempts = ? AND status = ?",
+                (STATUS_SENT, row_id, attempts, STATUS_PENDING)
+            )
+        return bool(cursor.rowcount)
+
+    def mark_failed(self, row_id: int, attempts: int, error: str) -> bool:
+        """Schedule a retry with exponential backoff, or dead-letter the row"""
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            status, next_attempt_at = STATUS_DEAD, time.time()
+        else:
+            backoff = min(OUTBOX_BASE_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+            status, next_attempt_at = STATUS_PENDING, time.time() + backoff * random.uniform(0.8, 1.2)
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, next_attempt_at = ?, last_error = ? "
+                "WHERE id = ? AND attempts = ? AND status = ?",
+                (status, next_attempt_at, error[:500], row_id, attempts, STATUS_PENDING)
+            )
+        return bool(cursor.rowcount)
+
+    def dead_letters(self, limit: int = 100) -> List[Dict]:
+        """Dead-lettered rows without their payloads (contacts and message details)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, attempts, last_error, created_at FROM outbox "
+                "WHERE status = ? ORDER BY id DESC LIMIT ?",
+                (STATUS_DEAD, limit)
+            ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "kind": row[1],
+                "attempts": row[2],
+                "last_error": row[3],
+                "created_at": row[4]
+            }
+            for row in rows
+        ]
+
+    def retry_dead_letter(self, row_id: int) -> bool:
+        """Move a dead-lettered row back to the queue"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ? WHERE id = ? AND status = ?",
+                (STATUS_PENDING, time.time(), row_id, STATUS_DEAD)
+            )
+        if cursor.rowcount:
+            self._wake()
+        return bool(cursor.rowcount)
+
+    def purge_sent(self, older_than_seconds: float = OUTBOX_SENT_RETENTION_SECONDS) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE status = ? AND created_at < ?",
+                (STATUS_SENT, time.time() - older_than_seconds)
+            )
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        counts = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+
+async def _keep_leased(outbox: NotificationOutbox, row: Dict):
+    """Extend a row's lease until cancelled (sends can wait in the send scheduler)"""
+    while True:
+        await asyncio.sleep(OUTBOX_LEASE_RENEW_SECONDS)
+        if not outbox.extend_lease(row["id"], row["attempts"]):
+            return
+
+
+async def deliver(outbox: NotificationOutbox, row: Dict):
+    """Send one outbox row and record the outcome"""
+    heartbeat = asyncio.create_task(_keep_leased(outbox, row))
+    try:
+        result = await SENDERS[row["kind"]](**row["payload"])
+        if result.get("success"):
+            recorded = outbox.mark_sent(row["id"], row["attempts"])
+        else:
+            recorded = outbox.mark_failed(row["id"], row["attempts"], result.get("error", "Unknown error"))
+    except Exception as e:
+        recorded = outbox.mark_failed(row["id"], row["attempts"], str(e))
+    finally:
+        heartbeat.cancel()
+
+    if not recorded:
+        print(f"Outbox row {row['id']} was re-claimed before its result was recorded")
+
+
+async def run_dispatcher(outbox: NotificationOutbox):
+    """
+    Drain the outbox until cancelled
+
+    Wakes immediately on enqueue, otherwise sleeps until the next retry
+    comes due (capped at the poll interval). Old sent rows are purged
+    every OUTBOX_PURGE_INTERVAL_SECONDS.
+    """
+    wakeup = outbox.bind(asyncio.get_running_loop())
+    next_purge = time.monotonic()
+
+    while True:
+        wakeup.clear()
+        if time.monotonic() >= next_purge:
+            next_purge = time.monotonic() + OUTBOX_PURGE_INTERVAL_SECONDS
+            try:
+                outbox.purge_sent()
+            except Exception as e:
+                print(f"Error purging notification outbox: {e}")
+
+        try:
+            rows = outbox.claim_due()
+            next_due = None if rows else outbox.seconds_until_next_due()
+        except Exception as e:
+            print(f"Error reading notification outbox: {e}")
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+            continue
+
+        if rows:
+            await asyncio.gather(*(deliver(outbox, row) for row in rows))
+            continue
+
+        timeout = OUTBOX_POLL_SECONDS if next_due is None else min(next_due, OUTBOX_POLL_SECONDS)
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+_outbox: Optional[NotificationOutbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> NotificationOutbox:
+    """Get the process-wide outbox (opened on first use)"""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = NotificationOutbox()
+    return _outbox
+
+
+def enqueue_notification(kind: str, **payload) -> Optional[int]:
+    """
+    Queue a notification without failing the caller
+
+    Returns:
+        Outbox row ID, or None if the outbox could not be written
+    """
+    try:
+        return get_outbox().enqueue(kind, **payload)
+    except Exception as e:
+        print(f"Failed to queue {kind} notification: {e}")
+        return None
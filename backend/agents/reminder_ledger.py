@@ -0,0 +1,205 @@
+"""
+Reminder Ledger
+Persistent record of sent medication reminders, shared between workers
+"""
+
+import os
+import sqlite3
+import struct
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+import sys
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.reminder_shards import shard_label
+
+
+LEDGER_PATH = os.getenv("REMINDER_LEDGER_PATH", "reminder_ledger.db")
+LEDGER_RETENTION_DAYS = int(os.getenv("REMINDER_LEDGER_RETENTION_DAYS", "2"))
+
+SLOTS = ("morning", "afternoon", "night")
+SLOT_ORDINALS = {slot: i for i, slot in enumerate(SLOTS)}
+
+# patient UUID (16 bytes) + drug UUID (16 bytes) + slot ordinal (1 byte)
+_KEY_FORMAT = struct.Struct(">16s16sB")
+# schedule UUID (16 bytes) + reminder offset ordinal (1 byte)
+_APPOINTMENT_KEY_FORMAT = struct.Struct(">16sB")
+
+
+def shard_ledger_path(path: str = LEDGER_PATH, label: Optional[str] = shard_label()) -> str:
+    """Each shard keeps its own ledger file, so shards never contend on writes"""
+    if not label:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{label}{ext}"
+
+
+def reminder_key(patient_id, drug_id, slot: str) -> bytes:
+    """Compact 33-byte key for one reminder within a day partition"""
+    return _KEY_FORMAT.pack(
+        UUID(str(patient_id)).bytes,
+        UUID(str(drug_id)).bytes,
+        SLOT_ORDINALS[slot]
+    )
+
+
+def appointment_reminder_key(schedule_id, offset_index: int) -> bytes:
+    """Compact 17-byte key for one appointment reminder (cannot collide with reminder_key)"""
+    return _APPOINTMENT_KEY_FORMAT.pack(UUID(str(schedule_id)).bytes, offset_index)
+
+
+class ReminderLedger:
+    """
+    SQLite-backed sent-reminder ledger
+
+    Rows are partitioned by day ordinal and claimed with INSERT OR IGNORE,
+    so concurrent workers sharing the file never both send the same
+    reminder. An exact in-memory set per day sits in front of the table;
+    a miss falls through to SQLite because another worker may have sent
+    the reminder. Partitions older than the retention window are dropped
+    from both automatically when the day rolls over.
+    """
+
+    def __init__(self, path: str = shard_ledger_path(), retention_days: int = LEDGER_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sent_reminders (
+                day INTEGER NOT NULL,
+                reminder_key BLOB NOT NULL,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (day, reminder_key)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_state (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        self._cache: Dict[int, Set[bytes]] = {}
+        self._current_day: Optional[int] = None
+
+    def _roll(self, day: int):
+        # Called with the lock held. Only today's date advances the window:
+        # claims for other days (catch-up, future dates) must not purge.
+        if day != date.today().toordinal() or day == self._current_day:
+            return
+        self._current_day = day
+        self._purge_before(day - self.retention_days + 1)
+
+    def _purge_before(self, day: int) -> int:
+        for old in [d for d in self._cache if d < day]:
+            del self._cache[old]
+        cursor = self._conn.execute("DELETE FROM sent_reminders WHERE day < ?", (day,))
+        return cursor.rowcount
+
+    def seen(self, key: bytes, on: Optional[date] = None) -> bool:
+        """Fast check against this worker's cache only"""
+        day = (on or date.today()).toordinal()
+        with self._lock:
+            return key in self._cache.get(day, ())
+
+    def claim(self, keys: List[bytes], on: Optional[date] = None) -> List[bool]:
+        """
+        Atomically record reminders as sent
+
+        Returns:
+            One flag per key: True if this call claimed it, False if it was
+            already recorded (by this or another worker)
+        """
+        day = (on or date.today()).toordinal()
+        now = time.time()
+
+        with self._lock:
+            self._roll(day)
+            cache = self._cache.setdefault(day, set())
+
+            claimed = []
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    if key in cache:
+                        claimed.append(False)
+                        continue
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO sent_reminders (day, reminder_key, sent_at) VALUES (?, ?, ?)",
+                        (day, key, now)
+                    )
+                    claimed.append(cursor.rowcount == 1)
+                    cache.add(key)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                for key, ok in zip(keys, claimed):
+                    if ok:
+                        cache.discard(key)
+                raise
+
+        return claimed
+
+    def release(self, keys: List[bytes], on: Optional[date] = None):
+        """Forget claims whose send failed so a later cycle retries them"""
+        day = (on or date.today()).toordinal()
+        with self._lock:
+            cache = self._cache.get(day, set())
+            for key in keys:
+                cache.discard(key)
+            self._conn.executemany(
+                "DELETE FROM sent_reminders WHERE day = ? AND reminder_key = ?",
+                [(day, key) for key in keys]
+            )
+
+    def purge_expired(self, on: Optional[date] = None) -> int:
+        """Drop partitions before the given day (defaults to today)"""
+        day = (on or date.today()).toordinal()
+        with self._lock:
+            return self._purge_before(day)
+
+    def get_state(self, name: str) -> Optional[str]:
+        """Read a small named value stored alongside the ledger"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM ledger_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ledger_state (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, value)
+            )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, COUNT(*) FROM sent_reminders GROUP BY day ORDER BY day"
+            ).fetchall()
+            cached = sum(len(keys) for keys in self._cache.values())
+        return {
+            "partitions": {date.fromordinal(day).isoformat(): count for day, count in rows},
+            "cached_keys": cached
+        }
+
+
+_ledger: Optional[ReminderLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_reminder_ledger() -> ReminderLedger:
+    """Get the process-wide ledger (opened on first use)"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = ReminderLedger()
+    return _ledger
@@ -0,0 +1,375 @@
+"""
+Reminder Scheduler
+Runs medication reminder cycles as reminder times come due, from the app lifespan
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import socket
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+import sys
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import get_async_supabase_client
+from change_feed import change_bus
+from agents.medication_reminder_agent import run_reminder_cycle, get_reminder_times, cycle_progress
+from agents.reminder_ledger import get_reminder_ledger
+from agents.reminder_shards import REMINDER_SHARD_COUNT, REMINDER_SHARD_INDEX, shard_label
+
+
+REMINDER_SCHEDULER_ENABLED = os.getenv("REMINDER_SCHEDULER_ENABLED", "true").lower() == "true"
+# "db" (lease row in Postgres), "file" (lock file next to the ledger) or "none"
+REMINDER_LEADER_ELECTION = os.getenv("REMINDER_LEADER_ELECTION", "db").lower()
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "300"))
+
+# Reminders missed for longer than this are skipped after downtime
+REMINDER_CATCHUP_HOURS = float(os.getenv("REMINDER_CATCHUP_HOURS", "6"))
+# At most this many missed reminder times are sent in one wake
+REMINDER_CATCHUP_MAX = int(os.getenv("REMINDER_CATCHUP_MAX", "3"))
+
+# How often the set of reminder times is reloaded from the database
+REMINDER_TIMES_REFRESH_SECONDS = 300.0
+JOB_PREFIX = "medication_reminders"
+# Each shard has its own lease and progress
+JOB_NAME = f"{JOB_PREFIX}:{shard_label()}" if shard_label() else JOB_PREFIX
+
+
+def day_windows(start: datetime, end: datetime) -> List[Tuple[date, Optional[time], Optional[time]]]:
+    """
+    Split (start, end] into per-day (day, after, until) reminder-time windows
+
+    after is exclusive and until inclusive; None means the start or end of
+    the day.
+    """
+    windows = []
+    day = start.date()
+    while day <= end.date():
+        after = start.time() if day == start.date() else None
+        until = end.time() if day == end.date() else None
+        windows.append((day, after, until))
+        day += timedelta(days=1)
+    return windows
+
+
+def catchup_start(start: datetime, now: datetime, times: List[time]) -> datetime:
+    """
+    Move start forward so (start, now] holds at most REMINDER_CATCHUP_MAX
+    reminder times; older missed times are skipped
+    """
+    due = [
+        at
+        for offset in range((now.date() - start.date()).days + 1)
+        for at in (datetime.combine(start.date() + timedelta(days=offset), t) for t in times)
+        if start < at <= now
+    ]
+    if len(due) <= REMINDER_CATCHUP_MAX:
+        return start
+    return due[-REMINDER_CATCHUP_MAX - 1]
+
+
+class ReminderTimeline:
+    """
+    Min-heap of upcoming reminder datetimes
+
+    Built from the distinct reminder times for today and tomorrow, so the
+    scheduler sleeps exactly until the next time anyone is due.
+    """
+
+    def __init__(self):
+        self.times: List[time] = []
+        self.loaded_at: Optional[datetime] = None
+        self._heap: List[datetime] = []
+
+    def load(self, times: List[time], now: datetime):
+        self.times = sorted(times)
+        self.loaded_at = now
+        self._heap = [
+            datetime.combine(now.date() + timedelta(days=offset), t)
+            for offset in (0, 1)
+            for t in self.times
+        ]
+        self._heap = [at for at in self._heap if at > now]
+        heapq.heapify(self._heap)
+
+    def invalidate(self, event: Optional[Dict] = None):
+        """Reload on the next wake; reminder times may have changed (see change_feed)"""
+        self.loaded_at = None
+
+    def is_stale(self, now: datetime) -> bool:
+        return (
+            self.loaded_at is None
+            or (now - self.loaded_at).total_seconds() >= REMINDER_TIMES_REFRESH_SECONDS
+            or now.date() != self.loaded_at.date()
+        )
+
+    def next_due(self, now: datetime) -> Optional[datetime]:
+        """Earliest reminder time after now (passed entries are discarded)"""
+        while self._heap and self._heap[0] <= now:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+
+class LocalLease:
+    """Always leader; state kept in the local ledger. For single-worker setups."""
+
+    election = "none"
+    # Nothing to renew; wake only for reminders and time refreshes
+    renew_seconds = REMINDER_TIMES_REFRESH_SECONDS
+
+    def __init__(self, name: str = JOB_NAME):
+        self.name = name
+        self.is_leader = False
+
+    async def acquire(self) -> bool:
+        self.is_leader = True
+        return True
+
+    def load_state(self) -> Dict:
+        value = get_reminder_ledger().get_state(f"scheduler:{self.name}")
+        return json.loads(value) if value else {}
+
+    async def save_state(self, state: Dict):
+        get_reminder_ledger().set_state(f"scheduler:{self.name}", json.dumps(state))
+
+
+class FileLease(LocalLease):
+    """
+    Leader is whichever process holds an exclusive lock on a file next to
+    the ledger. Covers several workers on one host.
+    """
+
+    election = "file"
+
+    def __init__(self, name: str = JOB_NAME):
+        super().__init__(name)
+        self._handle = None
+
+    async def acquire(self) -> bool:
+        if self._handle is not None:
+            return True
+
+        import fcntl
+
+        handle = open(f"{get_reminder_ledger().path}.{self.name}.lock", "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            self.is_leader = False
+            return False
+
+        # Held until the process exits
+        self._handle = handle
+        self.is_leader = True
+        return True
+
+
+class DatabaseLease:
+    """
+    Leader is whichever worker holds the job's row in scheduler_leases.
+    Covers workers spread over several hosts; progress lives in the row.
+    """
+
+    election = "db"
+
+    def __init__(self, name: str = JOB_NAME, ttl_seconds: int = REMINDER_LEASE_SECONDS):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.renew_seconds = ttl_seconds / 3
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self._state: Dict = {}
+
+    async def acquire(self) -> bool:
+        supabase = get_async_supabase_client()
+        try:
+            response = await supabase.rpc("acquire_scheduler_lease", {
+                "p_name": self.name,
+                "p_holder": self.holder,
+                "p_ttl_seconds": self.ttl_seconds
+            }).execute()
+            result = response.data or {}
+        except Exception as e:
+            print(f"Error acquiring scheduler lease: {e}")
+            result = {}
+
+        self.is_leader = bool(result.get("acquired"))
+        if self.is_leader:
+            self._state = result.get("state") or {}
+        return self.is_leader
+
+    def load_state(self) -> Dict:
+        return dict(self._state)
+
+    async def save_state(self, state: Dict):
+        supabase = get_async_supabase_client()
+        await supabase.table("scheduler_leases").update({"state": state}).eq(
+            "name", self.name
+        ).eq("holder", self.holder).execute()
+        self._state = dict(state)
+
+
+LEASES = {"db": DatabaseLease, "file": FileLease, "none": LocalLease}
+
+
+class ReminderScheduler:
+    """Fires reminder cycles as reminder times come due while this worker is leader"""
+
+    def __init__(self, lease=None):
+        self.lease = lease or LEASES.get(REMINDER_LEADER_ELECTION, DatabaseLease)()
+        self.timeline = ReminderTimeline()
+        self.rolled_on: Optional[date] = None
+        self.next_run: Optional[datetime] = None
+        self.running = False
+
+    async def run(self):
+        """Schedule reminder cycles until cancelled"""
+        self.running = True
+        try:
+            while True:
+                try:
+                    self.roll_ledger()
+                    if await self.lease.acquire():
+                        now = datetime.now()
+                        if self.timeline.is_stale(now):
+                            self.timeline.load(await get_reminder_times(), now)
+                        await self.run_due_cycles()
+                except Exception as e:
+                    print(f"Error in reminder scheduler: {e}")
+
+                # Sleep until the next reminder, waking early to renew the lease
+                now = datetime.now()
+                self.next_run = self.timeline.next_due(now)
+                delay = self.lease.renew_seconds
+                if self.next_run is not None:
+                    delay = min(delay, (self.next_run - now).total_seconds() + 0.5)
+                await asyncio.sleep(max(delay, 0.5))
+        finally:
+            self.running = False
+
+    def roll_ledger(self):
+        """Drop expired ledger days once per date (each worker owns its ledger)"""
+        today = date.today()
+        if self.rolled_on == today:
+            return
+        ledger = get_reminder_ledger()
+        ledger.purge_expired(today - timedelta(days=ledger.retention_days - 1))
+        self.rolled_on = today
+
+    async def run_due_cycles(self):
+        """
+        Run every reminder time in (last run, now]
+
+        After downtime the window is clamped to REMINDER_CATCHUP_HOURS and
+        to the last REMINDER_CATCHUP_MAX reminder times, and each day in it
+        is sent as one streamed cycle.
+        """
+        state = self.lease.load_state()
+        now = datetime.now()
+        window_start = now - timedelta(hours=REMINDER_CATCHUP_HOURS)
+        last_run = datetime.fromisoformat(state["last_run"]) if state.get("last_run") else None
+        start = max(last_run, window_start) if last_run else window_start
+        start = catchup_start(start, now, self.timeline.times)
+
+        for day, after, until in day_windows(start, now):
+            # Not gated on the cached times: one may have been added since the last refresh
+            result = await self.run_leased(run_reminder_cycle(remind_after=after, remind_until=until, on=day))
+            if result is None:
+                return  # Lease lost mid-cycle; the new leader owns this window
+            if result.get("total"):
+                state["last_result"] = {
+                    "day": day.isoformat(),
+                    "remind_after": after.isoformat() if after else None,
+                    "remind_until": until.isoformat() if until else None,
+                    "finished_at": datetime.now().isoformat(),
+                    "success": result.get("success"),
+                    "sent": result.get("sent", 0),
+                    "failed": result.get("failed", 0),
+                    "skipped": result.get("skipped", 0)
+                }
+            if not result.get("success"):
+                return  # Retry this window on the next wake
+
+            state["last_run"] = datetime.combine(day, until).isoformat() if until else \
+                datetime.combine(day + timedelta(days=1), time(0)).isoformat()
+            await self.lease.save_state(state)
+
+            # Renew between cycles; stop if another worker took over
+            if not await self.lease.acquire():
+                return
+
+    async def run_leased(self, cycle) -> Optional[Dict]:
+        """
+        Run a cycle while renewing the lease every renew_seconds
+
+        A cycle can outlast the lease TTL, and another worker's ledger would
+        not know what this one sent, so the cycle is cancelled as soon as a
+        renewal fails. Returns None in that case.
+        """
+        task = asyncio.ensure_future(cycle)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.lease.renew_seconds)
+                if done:
+                    return task.result()
+                if not await self.lease.acquire():
+                    print("Reminder scheduler lost its lease mid-cycle; stopping the cycle")
+                    return None
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    def status(self) -> Dict:
+        state = self.lease.load_state() if self.lease.is_leader else {}
+        return {
+            "enabled": REMINDER_SCHEDULER_ENABLED,
+            "running": self.running,
+            "election": self.lease.election,
+            "shard": {"index": REMINDER_SHARD_INDEX, "count": REMINDER_SHARD_COUNT} if shard_label() else None,
+            "leader": self.lease.is_leader,
+            "reminder_times": [t.strftime("%H:%M") for t in self.timeline.times],
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+            "last_run": state.get("last_run"),
+            "last_result": state.get("last_result"),
+            "current_cycle": dict(cycle_progress)
+        }
+
+
+async def get_shard_progress() -> List[Dict]:
+    """
+    Progress of every reminder shard
+
+    With database leases this reads every shard's lease row, so any
+    worker can report on all shards; otherwise only the local shard is known.
+    """
+    if not isinstance(reminder_scheduler.lease, DatabaseLease):
+        return [{"name": JOB_NAME, **reminder_scheduler.status()}]
+
+    supabase = get_async_supabase_client()
+    response = await supabase.table("scheduler_leases").select(
+        "name, holder, expires_at, state"
+    ).like("name", f"{JOB_PREFIX}%").order("name").execute()
+
+    now = datetime.now().astimezone()
+    shards = []
+    for row in response.data or []:
+        state = row.get("state") or {}
+        expires_at = datetime.fromisoformat(row["expires_at"].replace("Z", "+00:00"))
+        shards.append({
+            "name": row["name"],
+            "holder": row["holder"],
+            "active": expires_at > now,
+            "last_run": state.get("last_run"),
+            "last_result": state.get("last_result")
+        })
+    return shards
+
+
+reminder_scheduler = ReminderScheduler()
+change_bus.subscribe("drug_slots", reminder_scheduler.timeline.invalidate)
@@ -0,0 +1,35 @@
+"""
+Reminder Shards
+Splits patients across reminder workers by a stable hash of the patient ID
+"""
+
+import os
+from typing import List, Optional
+
+
+# Fixed number of hash buckets; must match shard_bucket in supabase_schema.sql
+SHARD_BUCKETS = 64
+
+REMINDER_SHARD_COUNT = int(os.getenv("REMINDER_SHARD_COUNT", "1"))
+REMINDER_SHARD_INDEX = int(os.getenv("REMINDER_SHARD_INDEX", "0"))
+
+
+def shard_buckets(index: int = REMINDER_SHARD_INDEX, count: int = REMINDER_SHARD_COUNT) -> Optional[List[int]]:
+    """
+    Hash buckets owned by a shard, or None when sharding is off
+
+    Bucket b belongs to shard b % count, so every bucket has exactly one
+    owner and shards differ in size by at most one bucket.
+    """
+    if count <= 1:
+        return None
+    if count > SHARD_BUCKETS:
+        raise ValueError(f"REMINDER_SHARD_COUNT cannot exceed {SHARD_BUCKETS}")
+    if not 0 <= index < count:
+        raise ValueError(f"REMINDER_SHARD_INDEX must be between 0 and {count - 1}")
+    return [bucket for bucket in range(SHARD_BUCKETS) if bucket % count == index]
+
+
+def shard_label(index: int = REMINDER_SHARD_INDEX, count: int = REMINDER_SHARD_COUNT) -> Optional[str]:
+    """Name suffix for per-shard state (None when sharding is off)"""
+    return f"shard-{index}-of-{count}" if count > 1 else None
@@ -13,7 +13,15 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from supabase_client import get_supabase_client
+from repository import get_repository
+from agents.slot_holds import slot_holds, slot_key
+
+
+# Bookable time blocks per working day (start hour, 24h clock)
+SLOT_HOURS = [9, 11, 14, 16]  # 9AM, 11AM, 2PM, 4PM
+SLOT_DURATION_MINUTES = 60
+WEEKEND_DAYS = [5, 6]  # Saturday, Sunday
+SUGGESTION_DAYS = 14  # Days searched for free slots
 
 
 class Slot:
@@ -73,40 +81,34 @@ async def get_patient_doctors(pid: UUID) -> List[Dict]:
     """
     Retrieve all doctors associated with a patient via prescriptions
     """
-    supabase = get_supabase_client()
-
     try:
-        # Query doctors table for this patient
-        response = supabase.table("doctors").select("did, doctor_name, doctor_id_external").eq("pid", str(pid)).execute()
-
-        if not response.data:
-            return []
-
-        return response.data
+        # Cached across requests; misses are batched per request
+        return await get_repository().get_patient_doctors(str(pid))
     except Exception as e:
         print(f"Error fetching patient doctors: {e}")
         return []
 
 
-async def get_existing_appointments(pid: UUID, start_date: datetime) -> List[str]:
+async def get_existing_appointments(did: str, start_date: datetime) -> List[str]:
     """
-    Get existing appointment times for a patient to avoid conflicts
-    Returns list of ISO datetime strings
+    Get the doctor's booked block starts in the suggestion window
+    Returns ISO datetime strings of every block an appointment overlaps
     """
-    supabase = get_supabase_client()
+    # Imported here: availability_grid imports this module
+    from agents.availability_grid import get_booked_times, parse_db_datetime
 
-    try:
-        # Query schedule table for this patient
-        # Note: schedule table doesn't have datetime field in current schema
-        # For now, we'll return empty list - this can be extended when
-        # appointment_time field is added to schedule table
-        response = supabase.table("schedule").select("*").eq("pid", str(pid)).execute()
+    window_start = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    booked = await get_booked_times([did], window_start, window_start + timedelta(days=SUGGESTION_DAYS))
 
-        # TODO: When appointment_time is added to schema, filter by date
-        return []
-    except Exception as e:
-        print(f"Error fetching existing appointments: {e}")
-        return []
+    duration = timedelta(minutes=SLOT_DURATION_MINUTES)
+    blocked = set()
+    for row in booked:
+        appointment = parse_db_datetime(row["appointment_time"])
+        hour = appointment.replace(minute=0, second=0, microsecond=0)
+        for block in (hour, hour + timedelta(hours=1)):
+            if abs(block - appointment) < duration:
+                blocked.add(block.isoformat())
+    return sorted(blocked)
 
 
 def generate_available_slots(
@@ -126,12 +128,10 @@ def generate_available_slots(
     # Generate slots between 9 AM and 5 PM, skip weekends
     slot_count = 0
     days_checked = 0
-    max_days = 14  # Check up to 2 weeks ahead
-
-    while slot_count < num_slots and days_checked < max_days:
+    while slot_count < num_slots and days_checked < SUGGESTION_DAYS:
         # Skip weekends
-        if current_date.weekday() not in [5, 6]:  # Not Saturday or Sunday
-            for hour in [9, 11, 14, 16]:  # 9AM, 11AM, 2PM, 4PM
+        if current_date.weekday() not in WEEKEND_DAYS:
+            for hour in SLOT_HOURS:
                 slot_time = current_date.replace(hour=hour)
                 slot_iso = slot_time.isoformat()
 
@@ -175,24 +175,28 @@ async def suggest_slots(user_input: str, pid: UUID) -> List[Dict]:
                 "slots": []
             }]
 
-        # 3. Get existing appointments to avoid conflicts
-        existing_appointments = await get_existing_appointments(pid, target_date)
-
-        # 4. Generate slots for the first doctor (can be extended to all doctors)
+        # 3. Pick the first doctor (can be extended to all doctors)
         primary_doctor = doctors[0]
         doctor_name = primary_doctor["doctor_name"]
         doctor_id = primary_doctor["did"]
 
-        # 5. Generate available slots
+        # 4. Get the doctor's booked blocks to avoid conflicts
+        existing_appointments = await get_existing_appointments(doctor_id, target_date)
+
+        # 5. Generate available slots, skipping slots held for other patients
+        held_times = [time for _, time in slot_holds.held_by_others([doctor_id], pid)]
         available_slots = generate_available_slots(
             target_date,
             doctor_name,
             doctor_id,
-            existing_appointments,
+            existing_appointments + held_times,
             num_slots=3
         )
 
-        # 6. Return formatted response
+        # 6. Hold the suggestions for this patient (replaces any earlier holds)
+        slot_holds.hold(pid, [slot_key(slot.doctor_id, slot.datetime) for slot in available_slots])
+
+        # 7. Return formatted response
         return [slot.to_dict() for slot in available_slots]
 
     except Exception as e:
@@ -0,0 +1,278 @@
+"""
+Send Scheduler
+Priority queue with global and per-contact rate limiting for outgoing messages
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+# Priority classes (lower is sent first)
+PRIORITY_CONFIRMATION = 0
+PRIORITY_NORMAL = 1
+PRIORITY_REMINDER = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CONFIRMATION: "confirmation",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_REMINDER: "reminder",
+}
+
+# Rate limits: steady rate plus burst capacity
+SEND_RATE_PER_SECOND = float(os.getenv("SEND_RATE_PER_SECOND", "5"))
+SEND_BURST = float(os.getenv("SEND_BURST", "10"))
+CONTACT_RATE_PER_MINUTE = float(os.getenv("CONTACT_RATE_PER_MINUTE", "20"))
+CONTACT_BURST = float(os.getenv("CONTACT_BURST", "5"))
+
+SEND_MAX_BATCH = int(os.getenv("SEND_MAX_BATCH", "50"))
+SEND_MAX_IN_FLIGHT = int(os.getenv("SEND_MAX_IN_FLIGHT", "4"))
+SEND_QUEUE_LIMIT = int(os.getenv("SEND_QUEUE_LIMIT", "100000"))
+
+RATE_WINDOW_SECONDS = 60.0
+MAX_CONTACT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket; refilled lazily on access"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def refund(self):
+        """Return a token taken for a send that never went out"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+# (priority, sequence, contact, message, future)
+QueueItem = Tuple[int, int, str, str, asyncio.Future]
+
+
+class SendScheduler:
+    """
+    Smooths outgoing messages to the maximum safe send rate
+
+    Messages wait in a priority heap. A message is released when both the
+    global bucket and its contact's bucket have a token; messages whose
+    contact is throttled are parked until their contact refills, so they
+    do not block other contacts. Ready messages are grouped into batches.
+    Sends that certainly never went out (results flagged "undelivered",
+    e.g. pool or connect failures, 4xx or 503 from the bridge) give their
+    tokens back; read timeouts may have been delivered, so they keep theirs.
+    """
+
+    def __init__(
+        self,
+        send_one: Callable[[str, str], Awaitable[Dict]],
+        send_batch: Callable[[List[Dict]], Awaitable[Dict]]
+    ):
+        self._send_one = send_one
+        self._send_batch = send_batch
+
+        self._queue: List[QueueItem] = []
+        self._deferred: List[Tuple[float, QueueItem]] = []
+        self._sequence = itertools.count()
+
+        self._global_bucket = TokenBucket(SEND_RATE_PER_SECOND, SEND_BURST)
+        self._contact_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+        self._slots = asyncio.Semaphore(SEND_MAX_IN_FLIGHT)
+        self._wakeup: Optional[asyncio.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._sent_times: deque = deque()
+        self._in_flight = 0
+        self.sent_total = 0
+        self.failed_total = 0
+        self.rejected_total = 0
+
+    async def submit(self, contact: str, message: str, priority: int = PRIORITY_NORMAL) -> Dict:
+        """
+        Queue a message and wait for its delivery result
+
+        Must be called on the scheduler's event loop.
+        """
+        if len(self._queue) + len(self._deferred) >= SEND_QUEUE_LIMIT:
+            self.rejected_total += 1
+            return {
+                "success": False,
+                "status": "failed",
+                "error": "Send queue is full",
+                "contact": contact
+            }
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), contact, message, future))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return await future
+
+    async def run(self):
+        """Release queued messages until cancelled"""
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        try:
+            while True:
+                now = time.monotonic()
+                self._release_deferred(now)
+
+                batch = self._take_ready(now)
+                if batch:
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._dispatch(batch))
+                    task.add_done_callback(lambda _: self._slots.release())
+                    continue
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_wait(now))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._fail_pending("Send scheduler stopped")
+            self.loop = None
+
+    def _contact_bucket(self, contact: str, now: float) -> TokenBucket:
+        bucket = self._contact_buckets.get(contact)
+        if bucket is not None:
+            self._contact_buckets.move_to_end(contact)
+            return bucket
+
+        if len(self._contact_buckets) >= MAX_CONTACT_BUCKETS:
+            # Full buckets carry no state worth keeping; past that, drop the least recently used
+            for key in [k for k, b in self._contact_buckets.items() if b.is_full(now)]:
+                del self._contact_buckets[key]
+            while len(self._contact_buckets) >= MAX_CONTACT_BUCKETS:
+                self._contact_buckets.popitem(last=False)
+
+        bucket = TokenBucket(CONTACT_RATE_PER_MINUTE / 60.0, CONTACT_BURST)
+        self._contact_buckets[contact] = bucket
+        return bucket
+
+    def _take_ready(self, now: float) -> List[QueueItem]:
+        batch = []
+        while self._queue and len(batch) < SEND_MAX_BATCH:
+            if self._global_bucket.wait_time(now) > 0:
+                break
+
+            item = heapq.heappop(self._queue)
+            if item[4].done():
+                continue  # Caller gave up
+
+            bucket = self._contact_bucket(item[2], now)
+            wait = bucket.wait_time(now)
+            if wait > 0:
+                heapq.heappush(self._deferred, (now + wait, item))
+                continue
+
+            bucket.take()
+            self._global_bucket.take()
+            batch.append(item)
+        return batch
+
+    def _release_deferred(self, now: float):
+        while self._deferred and self._deferred[0][0] <= now:
+            _, item = heapq.heappop(self._deferred)
+            heapq.heappush(self._queue, item)
+
+    def _next_wait(self, now: float) -> Optional[float]:
+        waits = []
+        if self._queue:
+            waits.append(self._global_bucket.wait_time(now))
+        if self._deferred:
+            waits.append(self._deferred[0][0] - now)
+        return max(min(waits), 0.001) if waits else None
+
+    async def _dispatch(self, batch: List[QueueItem]):
+        self._in_flight += 1
+        try:
+            if len(batch) == 1:
+                results = [await self._send_one(batch[0][2], batch[0][3])]
+            else:
+                response = await self._send_batch([
+                    {"contact": contact, "message": message}
+                    for _, _, contact, message, _ in batch
+                ])
+                results = response.get("results", [])
+        except Exception as e:
+            results = []
+            error = str(e)
+        else:
+            error = "No result returned"
+        finally:
+            self._in_flight -= 1
+
+        now = time.monotonic()
+        for i, (_, _, contact, _, future) in enumerate(batch):
+            result = results[i] if i < len(results) else {
+                "success": False, "status": "failed", "error": error, "contact": contact
+            }
+            if result.get("success"):
+                self.sent_total += 1
+                self._sent_times.append(now)
+            else:
+                self.failed_total += 1
+            if result.get("undelivered"):
+                self._global_bucket.refund()
+                bucket = self._contact_buckets.get(contact)
+                if bucket is not None:
+                    bucket.refund()
+            if not future.done():
+                future.set_result(result)
+
+    def _fail_pending(self, error: str):
+        items = self._queue + [item for _, item in self._deferred]
+        self._queue, self._deferred = [], []
+        for _, _, contact, _, future in items:
+            if not future.done():
+                future.set_result({"success": False, "status": "failed", "error": error, "contact": contact})
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        while self._sent_times and self._sent_times[0] < now - RATE_WINDOW_SECONDS:
+            self._sent_times.popleft()
+
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for item in itertools.chain(self._queue, (item for _, item in self._deferred)):
+            depth[PRIORITY_NAMES.get(item[0], "normal")] += 1
+
+        return {
+            "running": self.loop is not None,
+            "queue_depth": depth,
+            "throttled": len(self._deferred),
+            "in_flight_batches": self._in_flight,
+            "send_rate_per_second": round(len(self._sent_times) / RATE_WINDOW_SECONDS, 3),
+            "sent_total": self.sent_total,
+            "failed_total": self.failed_total,
+            "rejected_total": self.rejected_total,
+            "limits": {
+                "global_per_second": SEND_RATE_PER_SECOND,
+                "global_burst": SEND_BURST,
+                "contact_per_minute": CONTACT_RATE_PER_MINUTE,
+                "contact_burst": CONTACT_BURST,
+            },
+        }
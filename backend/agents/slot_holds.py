@@ -0,0 +1,124 @@
+"""
+Slot Holds
+Short-lived reservations of suggested slots between suggestion and booking
+"""
+
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+
+SLOT_HOLD_TTL_SECONDS = float(os.getenv("SLOT_HOLD_TTL_SECONDS", "300"))
+
+SlotKey = Tuple[str, str]  # (doctor_id, normalized ISO datetime)
+
+
+def slot_key(doctor_id, slot: Union[str, datetime]) -> SlotKey:
+    """Normalize a (doctor, time) pair so suggested and booked slots compare equal"""
+    if isinstance(slot, str):
+        slot = datetime.fromisoformat(slot.replace("Z", "+00:00"))
+    # Offsets are converted to UTC first, like availability_grid.normalize_datetime
+    if slot.tzinfo is not None:
+        slot = slot.astimezone(timezone.utc).replace(tzinfo=None)
+    slot = slot.replace(second=0, microsecond=0)
+    return str(doctor_id), slot.isoformat()
+
+
+class SlotHoldStore:
+    """
+    In-process hold store with heap-based expiry
+
+    Each slot is held by at most one patient; each patient holds only the
+    slots from their latest suggestion. Expired holds are dropped lazily
+    from the heap on every access, so no background task is needed.
+    """
+
+    def __init__(self, ttl_seconds: float = SLOT_HOLD_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._holds: Dict[SlotKey, Tuple[str, float]] = {}
+        self._by_patient: Dict[str, Set[SlotKey]] = {}
+        self._heap: List[Tuple[float, SlotKey, str]] = []
+        self._lock = threading.Lock()
+
+    def hold(self, pid, slots: Iterable[SlotKey], ttl_seconds: Optional[float] = None) -> List[SlotKey]:
+        """
+        Replace a patient's holds with a new set of slots
+
+        Slots currently held by another patient are skipped.
+
+        Returns:
+            The slot keys now held by the patient
+        """
+        pid = str(pid)
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+
+        with self._lock:
+            self._expire()
+            self._release_patient(pid)
+
+            held = []
+            for key in slots:
+                current = self._holds.get(key)
+                if current and current[0] != pid:
+                    continue
+                self._holds[key] = (pid, expires_at)
+                heapq.heappush(self._heap, (expires_at, key, pid))
+                held.append(key)
+
+            if held:
+                self._by_patient[pid] = set(held)
+            return held
+
+    def release_patient(self, pid):
+        """Release every hold owned by a patient"""
+        with self._lock:
+            self._release_patient(str(pid))
+
+    def holder(self, key: SlotKey) -> Optional[str]:
+        """Patient currently holding a slot, if any"""
+        with self._lock:
+            self._expire()
+            current = self._holds.get(key)
+            return current[0] if current else None
+
+    def held_by_others(self, doctor_ids: Iterable[str], pid=None) -> List[SlotKey]:
+        """Slots of the given doctors held by patients other than pid"""
+        doctors = {str(did) for did in doctor_ids}
+        pid = str(pid) if pid is not None else None
+
+        with self._lock:
+            self._expire()
+            return [
+                key for key, (holder, _) in self._holds.items()
+                if key[0] in doctors and holder != pid
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._holds)
+
+    def _release_patient(self, pid: str):
+        for key in self._by_patient.pop(pid, ()):
+            current = self._holds.get(key)
+            if current and current[0] == pid:
+                del self._holds[key]
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key, pid = heapq.heappop(self._heap)
+            # Skip stale heap entries superseded by a later hold or release
+            if self._holds.get(key) == (pid, expires_at):
+                del self._holds[key]
+                keys = self._by_patient.get(pid)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_patient[pid]
+
+
+slot_holds = SlotHoldStore()
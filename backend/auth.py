@@ -17,6 +17,9 @@ JWT_SECRET = os.getenv("JWT_SECRET", "vita-care-super-secret-key-change-in-produ
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRATION_HOURS = int(os.getenv("JWT_EXPIRATION_HOURS", "24"))
 
+# Patient IDs allowed to use operational endpoints (comma-separated; none by default)
+ADMIN_USER_IDS = {pid.strip() for pid in os.getenv("ADMIN_USER_IDS", "").split(",") if pid.strip()}
+
 
 def hash_password(password: str) -> str:
     """
@@ -0,0 +1,190 @@
+"""
+Change Feed
+Broadcasts row changes to in-process caches, across workers via Postgres LISTEN/NOTIFY
+"""
+
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+# "postgres" (LISTEN on row_changes, needs DATABASE_URL) or "local" (this process only)
+CHANGE_FEED = os.getenv("CHANGE_FEED", "postgres" if DATABASE_URL else "local").lower()
+CHANGE_CHANNEL = "row_changes"
+
+# Handlers receive {"table", "op", "id", "pid", ...}; op "RESET" means
+# events may have been missed and everything from the table must go
+ChangeHandler = Callable[[Dict], None]
+
+
+class ChangeBus:
+    """
+    Routes row-change events to the caches that hold those rows
+
+    Writes made by this worker are published directly, so its own caches
+    are invalidated before the write returns. Changes from other workers
+    arrive through the feed. Handlers must be cheap and thread-safe.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[ChangeHandler]] = defaultdict(list)
+        self.events = 0
+        self.resets = 0
+
+    def subscribe(self, table: str, handler: ChangeHandler):
+        self._handlers[table].append(handler)
+
+    def publish(self, table: str, op: str, id=None, pid=None, **fields):
+        """Announce a change made by this worker"""
+        self.dispatch({
+            "table": table,
+            "op": op,
+            "id": str(id) if id is not None else None,
+            "pid": str(pid) if pid is not None else None,
+            **fields
+        })
+
+    def dispatch(self, event: Dict):
+        self.events += 1
+        for handler in self._handlers.get(event.get("table"), ()):
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"Error handling {event.get('table')} change: {e}")
+
+    def reset(self):
+        """Tell every subscriber to drop its cached rows"""
+        self.resets += 1
+        for table in list(self._handlers):
+            self.dispatch({"table": table, "op": "RESET"})
+
+    def stats(self) -> Dict:
+        return {
+            "events": self.events,
+            "resets": self.resets,
+            "subscribed_tables": sorted(self._handlers)
+        }
+
+
+change_bus = ChangeBus()
+
+
+class LocalChangeFeed:
+    """Only this worker's own writes; for single-worker setups and tests"""
+
+    name = "local"
+
+    def __init__(self, bus: ChangeBus = change_bus):
+        self.bus = bus
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict:
+        return {"feed": self.name, **self.bus.stats()}
+
+
+class PostgresChangeFeed(LocalChangeFeed):
+    """
+    LISTENs on the row_changes channel filled by the notify_row_change triggers
+
+    The connection is watched by the event loop (add_reader), so no
+    thread is held. Notifications sent while disconnected are lost, so
+    every (re)connect resets all subscribers.
+    """
+
+    name = "postgres"
+
+    def __init__(self, bus: ChangeBus = change_bus, dsn: Optional[str] = DATABASE_URL,
+                 channel: str = CHANGE_CHANNEL):
+        super().__init__(bus)
+        self.dsn = dsn
+        self.channel = channel
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.dsn:
+            raise ValueError("DATABASE_URL must be set when CHANGE_FEED=postgres")
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _connect(self):
+        import psycopg2
+
+        # Keepalives turn a silently dropped connection into a read error
+        conn = psycopg2.connect(
+            self.dsn, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        return conn
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        delay = 1.0
+        while True:
+            try:
+                conn = await loop.run_in_executor(None, self._connect)
+            except Exception as e:
+                print(f"Change feed connection failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+                continue
+
+            delay = 1.0
+            self.connected = True
+            self.bus.reset()
+
+            lost = loop.create_future()
+            loop.add_reader(conn.fileno(), self._drain, conn, lost)
+            try:
+                error = await lost
+                print(f"Change feed connection lost: {error}")
+            finally:
+                loop.remove_reader(conn.fileno())
+                conn.close()
+                self.connected = False
+
+    def _drain(self, conn, lost: asyncio.Future):
+        try:
+            conn.poll()
+        except Exception as e:
+            if not lost.done():
+                lost.set_result(e)
+            return
+
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self.bus.dispatch(event)
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "connected": self.connected}
+
+
+CHANGE_FEEDS = {"postgres": PostgresChangeFeed, "local": LocalChangeFeed}
+
+change_feed = CHANGE_FEEDS.get(CHANGE_FEED, LocalChangeFeed)()
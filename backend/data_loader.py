@@ -0,0 +1,132 @@
+"""
+Request-Scoped Data Loaders
+Batches keyed lookups made in the same event-loop tick into one in_() query
+"""
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from supabase_client import get_async_supabase_client
+
+
+# (table, key column, columns) -> DataLoader for the current request; None outside a scope
+_scope: ContextVar[Optional[Dict[Tuple[str, str, str], "DataLoader"]]] = ContextVar(
+    "data_loader_scope", default=None
+)
+
+
+class DataLoader:
+    """
+    Loads rows of one table by one key column
+
+    Every load() issued before the event loop next runs its callbacks
+    joins one batch, fetched with a single in_() query. Results, misses
+    included, are cached for the loader's lifetime, so a loader only lives
+    as long as one request. Returned rows are shared between callers and
+    must not be mutated.
+    """
+
+    def __init__(self, table: str, key_column: str, columns: str = "*"):
+        self.table = table
+        self.key_column = key_column
+        # The key column is needed to route rows back to their callers
+        if columns != "*" and key_column not in [c.strip() for c in columns.split(",")]:
+            columns = f"{columns}, {key_column}"
+        self.columns = columns
+        self._results: Dict[str, asyncio.Future] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.queries = 0
+        self.hits = 0
+
+    async def load(self, key) -> List[Dict]:
+        """All rows whose key column equals key"""
+        key = str(key)
+        future = self._results.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._results[key] = future
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            self._pending[key] = future
+        else:
+            self.hits += 1
+        # A cancelled caller must not cancel the lookup for everyone else
+        return await asyncio.shield(future)
+
+    async def load_one(self, key) -> Optional[Dict]:
+        """The row whose key column equals key (for unique keys)"""
+        rows = await self.load(key)
+        return rows[0] if rows else None
+
+    async def load_many(self, keys) -> List[List[Dict]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def clear(self, key=None):
+        """Forget a cached key (or everything) after writing to it"""
+        if key is None:
+            self._results.clear()
+        else:
+            self._results.pop(str(key), None)
+
+    def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: Dict[str, asyncio.Future]):
+        try:
+            supabase = get_async_supabase_client()
+            response = await supabase.table(self.table).select(self.columns).in_(
+                self.key_column, list(batch)
+            ).execute()
+            self.queries += 1
+        except Exception as e:
+            for key, future in batch.items():
+                self._results.pop(key, None)  # A later load retries
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        grouped: Dict[str, List[Dict]] = {key: [] for key in batch}
+        for row in response.data or []:
+            grouped.setdefault(str(row[self.key_column]), []).append(row)
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(grouped[key])
+
+
+def get_loader(table: str, key_column: str, columns: str = "*") -> DataLoader:
+    """
+    Get the current request's loader for (table, key column, columns)
+
+    Outside a loader_scope (background jobs, scripts) every call gets a
+    fresh loader, so nothing is shared or cached between callers.
+    """
+    scope = _scope.get()
+    if scope is None:
+        return DataLoader(table, key_column, columns)
+
+    name = (table, key_column, columns)
+    loader = scope.get(name)
+    if loader is None:
+        loader = scope[name] = DataLoader(table, key_column, columns)
+    return loader
+
+
+@contextmanager
+def loader_scope():
+    """Give the enclosed work (one request) its own loaders and cache"""
+    token = _scope.set({})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def invalidate(table: str):
+    """Drop the current request's cached rows of a table after writing to it"""
+    for (loaded_table, _, _), loader in (_scope.get() or {}).items():
+        if loaded_table == table:
+            loader.clear()
@@ -0,0 +1,146 @@
+"""
+Entity Cache
+Process-wide read-through cache for rarely changing rows (patients, doctors)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from dotenv import load_dotenv
+
+from change_feed import change_bus, CHANGE_FEED
+
+load_dotenv()
+
+# With the Postgres change feed, other workers' writes invalidate entries
+# within milliseconds and the TTL is only a backstop
+ENTITY_CACHE_TTL_SECONDS = float(os.getenv(
+    "ENTITY_CACHE_TTL_SECONDS", "3600" if CHANGE_FEED == "postgres" else "300"
+))
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "10000"))
+
+
+class EntityCache:
+    """
+    TTL + LRU cache keyed by entity id
+
+    Entries are invalidated by row-change events (see change_feed) and
+    expire after ttl_seconds in case an event is missed. When full, the
+    least recently used entry is evicted.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float = ENTITY_CACHE_TTL_SECONDS,
+                 max_entries: int = ENTITY_CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a load that raced one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, key) -> Tuple[bool, Any]:
+        """(found, value) for a fresh entry; a found entry becomes most recently used"""
+        key = str(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, generation: int = None):
+        """Store a value (skipped if the cache was invalidated since generation)"""
+        key = str(key)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def get_or_load(self, key, load: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value or load and cache it
+
+        Missing entities (None) are not cached, so a row created right
+        after a miss is found on the next read.
+        """
+        found, value = self.lookup(key)
+        if found:
+            return value
+
+        generation = self._generation
+        value = await load()
+        if value is not None:
+            self.put(key, value, generation)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.pop(str(key), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+# Patient rows by pid (include password_hash; strip before returning to clients)
+patient_cache = EntityCache("patients")
+# A patient's doctors (list of rows) by pid
+patient_doctors_cache = EntityCache("patient_doctors")
+
+ENTITY_CACHES = {cache.name: cache for cache in (patient_cache, patient_doctors_cache)}
+
+
+def _invalidate_on(cache: EntityCache, key_field: str):
+    def handler(event: Dict):
+        key = event.get(key_field)
+        if event["op"] == "RESET" or key is None:
+            cache.clear()
+        else:
+            cache.invalidate(key)
+    return handler
+
+
+change_bus.subscribe("patients", _invalidate_on(patient_cache, "id"))
+change_bus.subscribe("doctors", _invalidate_on(patient_doctors_cache, "pid"))
+
+
+def entity_cache_stats() -> Dict:
+    return {name: cache.stats() for name, cache in ENTITY_CACHES.items()}
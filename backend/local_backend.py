@@ -0,0 +1,780 @@
+"""
+Local Backend
+SQLite stand-in for the Supabase table API, for CI and load tests without a network
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, time, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from postgrest import APIError, APIResponse
+
+load_dotenv()
+
+# ":memory:" (one process, empty on start) or a file path to keep data between runs
+LOCAL_DATABASE_PATH = os.getenv("LOCAL_DATABASE_PATH", ":memory:")
+
+# Mirrors supabase_schema.sql. UUIDs, dates and timestamps are stored as text;
+# timestamps are normalized to UTC ISO strings, so they compare as text.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+  pid TEXT PRIMARY KEY DEFAULT (uuid4()),
+  username TEXT UNIQUE NOT NULL,
+  name TEXT NOT NULL,
+  password_hash TEXT NOT NULL,
+  phone TEXT UNIQUE NOT NULL,
+  email TEXT UNIQUE,
+  dob TEXT,
+  created_at TEXT DEFAULT (utc_now()),
+  updated_at TEXT DEFAULT (utc_now())
+);
+
+CREATE TABLE IF NOT EXISTS uploads (
+  upload_id TEXT PRIMARY KEY DEFAULT (uuid4()),
+  pid TEXT NOT NULL REFERENCES patients(pid) ON DELETE CASCADE,
+  file_hash TEXT UNIQUE NOT NULL,
+  file_name TEXT NOT NULL,
+  file_size INTEGER NOT NULL,
+  file_type TEXT NOT NULL,
+  upload_timestamp TEXT DEFAULT (utc_now()),
+  extraction_status TEXT CHECK (extraction_status IN ('pending','success','failed')) DEFAULT 'pending',
+  gemini_response_hash TEXT,
+  error_message TEXT
+);
+
+CREATE TABLE IF NOT EXISTS doctors (
+  did TEXT PRIMARY KEY DEFAULT (uuid4()),
+  doctor_name TEXT NOT NULL,
+  doctor_id_external TEXT,
+  pid TEXT NOT NULL REFERENCES patients(pid) ON DELETE CASCADE,
+  upload_id TEXT REFERENCES uploads(upload_id) ON DELETE SET NULL,
+  created_at TEXT DEFAULT (utc_now()),
+  UNIQUE(pid, doctor_name, doctor_id_external)
+);
+
+CREATE TABLE IF NOT EXISTS drugs (
+  drug_id TEXT PRIMARY KEY DEFAULT (uuid4()),
+  pid TEXT NOT NULL REFERENCES patients(pid) ON DELETE CASCADE,
+  upload_id TEXT NOT NULL REFERENCES uploads(upload_id) ON DELETE CASCADE,
+  drug_name TEXT NOT NULL,
+  created_at TEXT DEFAULT (utc_now()),
+  shard_bucket INTEGER GENERATED ALWAYS AS (shard_bucket(pid)) STORED,
+  UNIQUE(pid, drug_name, upload_id)
+);
+
+CREATE TABLE IF NOT EXISTS drug_slots (
+  slot_id TEXT PRIMARY KEY DEFAULT (uuid4()),
+  drug_id TEXT NOT NULL REFERENCES drugs(drug_id) ON DELETE CASCADE,
+  slot TEXT CHECK (slot IN ('morning','afternoon','night')) NOT NULL,
+  created_at TEXT DEFAULT (utc_now()),
+  remind_at TEXT,
+  UNIQUE(drug_id, slot)
+);
+
+CREATE TABLE IF NOT EXISTS schedule (
+  schedule_id TEXT PRIMARY KEY DEFAULT (uuid4()),
+  pid TEXT NOT NULL REFERENCES patients(pid) ON DELETE CASCADE,
+  did TEXT REFERENCES doctors(did) ON DELETE SET NULL,
+  upload_id TEXT NOT NULL REFERENCES uploads(upload_id) ON DELETE CASCADE,
+  appointment_time TEXT,
+  created_at TEXT DEFAULT (utc_now())
+);
+
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+  name TEXT PRIMARY KEY,
+  holder TEXT,
+  expires_at TEXT NOT NULL DEFAULT (utc_now()),
+  state TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_uploads_pid ON uploads(pid);
+CREATE INDEX IF NOT EXISTS idx_drugs_pid_drug ON drugs(pid, drug_id);
+CREATE INDEX IF NOT EXISTS idx_drugs_shard_bucket ON drugs(shard_bucket, pid);
+CREATE INDEX IF NOT EXISTS idx_drug_slots_slot ON drug_slots(slot, drug_id);
+CREATE INDEX IF NOT EXISTS idx_schedule_pid ON schedule(pid);
+CREATE INDEX IF NOT EXISTS idx_schedule_did_time ON schedule(did, appointment_time);
+CREATE INDEX IF NOT EXISTS idx_schedule_appointment_time ON schedule(appointment_time);
+CREATE INDEX IF NOT EXISTS idx_doctors_pid ON doctors(pid);
+
+-- The schedule exclusion constraints: no two appointments of the same
+-- doctor or patient within 60 minutes of each other
+CREATE TRIGGER IF NOT EXISTS schedule_no_overlap_insert BEFORE INSERT ON schedule
+WHEN NEW.appointment_time IS NOT NULL AND EXISTS (
+  SELECT 1 FROM schedule s
+  WHERE (s.did = NEW.did OR s.pid = NEW.pid)
+    AND s.appointment_time IS NOT NULL
+    AND abs(strftime('%s', s.appointment_time) - strftime('%s', NEW.appointment_time)) < 3600
+)
+BEGIN
+  SELECT RAISE(ABORT, 'conflicting key value violates exclusion constraint "schedule_no_overlap"');
+END;
+
+CREATE TRIGGER IF NOT EXISTS schedule_no_overlap_update BEFORE UPDATE OF appointment_time, did, pid ON schedule
+WHEN NEW.appointment_time IS NOT NULL AND EXISTS (
+  SELECT 1 FROM schedule s
+  WHERE s.schedule_id <> NEW.schedule_id
+    AND (s.did = NEW.did OR s.pid = NEW.pid)
+    AND s.appointment_time IS NOT NULL
+    AND abs(strftime('%s', s.appointment_time) - strftime('%s', NEW.appointment_time)) < 3600
+)
+BEGIN
+  SELECT RAISE(ABORT, 'conflicting key value violates exclusion constraint "schedule_no_overlap"');
+END;
+
+-- Slot default reminder times (set_default_remind_at)
+CREATE TRIGGER IF NOT EXISTS set_drug_slots_remind_at AFTER INSERT ON drug_slots
+WHEN NEW.remind_at IS NULL
+BEGIN
+  UPDATE drug_slots SET remind_at = CASE NEW.slot
+    WHEN 'morning' THEN '08:00:00' WHEN 'afternoon' THEN '13:00:00' ELSE '20:00:00' END
+  WHERE slot_id = NEW.slot_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reset_drug_slots_remind_at AFTER UPDATE OF remind_at ON drug_slots
+WHEN NEW.remind_at IS NULL
+BEGIN
+  UPDATE drug_slots SET remind_at = CASE NEW.slot
+    WHEN 'morning' THEN '08:00:00' WHEN 'afternoon' THEN '13:00:00' ELSE '20:00:00' END
+  WHERE slot_id = NEW.slot_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_patients_updated_at AFTER UPDATE ON patients
+BEGIN
+  UPDATE patients SET updated_at = utc_now() WHERE pid = NEW.pid;
+END;
+
+CREATE VIEW IF NOT EXISTS due_medications AS
+SELECT
+  ds.slot_id,
+  ds.slot,
+  ds.drug_id,
+  d.drug_name,
+  d.pid,
+  p.name AS patient_name,
+  p.phone AS patient_phone,
+  ds.remind_at,
+  d.shard_bucket
+FROM drug_slots ds
+JOIN drugs d ON d.drug_id = ds.drug_id
+JOIN patients p ON p.pid = d.pid;
+
+CREATE VIEW IF NOT EXISTS reminder_times AS
+SELECT DISTINCT remind_at FROM drug_slots;
+"""
+
+TIMESTAMP_COLUMNS = {"created_at", "updated_at", "upload_timestamp", "appointment_time", "expires_at"}
+JSON_COLUMNS = {"state"}
+
+# Filter operators (as in PostgREST's eq.x / gt.x syntax) -> SQL
+OPERATORS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE"}
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+EMBEDDED = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\((.*)\)$", re.S)
+LOGIC_GROUP = re.compile(r"^(and|or)\((.*)\)$", re.S)
+
+
+def _shard_bucket(pid: Optional[str]) -> Optional[int]:
+    # Stands in for hashtext(pid) & 63; buckets differ from Postgres but are stable
+    return None if pid is None else zlib.crc32(pid.encode()) & 63
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _timestamptz(value) -> str:
+    """Normalize a timestamp to UTC ISO text, as Postgres returns timestamptz"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)  # Supabase sessions run in UTC
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _db_value(column: str, value):
+    """Convert a Python or JSON value to what the local table stores"""
+    if value is None:
+        return None
+    if column in TIMESTAMP_COLUMNS:
+        return _timestamptz(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _row(row: sqlite3.Row) -> Dict:
+    data = dict(row)
+    for column in JSON_COLUMNS.intersection(data):
+        if isinstance(data[column], str):
+            data[column] = json.loads(data[column])
+    return data
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas outside parentheses ("a, b(c, d)" -> ["a", "b(c, d)"])"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        depth += (char == "(") - (char == ")")
+        current.append(char)
+    parts.append("".join(current).strip())
+    return [part for part in parts if part]
+
+
+def _api_error(e: sqlite3.Error) -> APIError:
+    """Report a SQLite constraint failure with the Postgres error code PostgREST would send"""
+    message = str(e)
+    if "exclusion constraint" in message:
+        code = "23P01"
+    elif message.startswith("UNIQUE"):
+        code, message = "23505", f"duplicate key value violates unique constraint ({message})"
+    elif message.startswith("FOREIGN KEY"):
+        code, message = "23503", "insert or update violates foreign key constraint"
+    elif message.startswith("NOT NULL"):
+        code = "23502"
+    elif message.startswith("CHECK"):
+        code = "23514"
+    else:
+        code = "XX000"
+    return APIError({"message": message, "code": code, "hint": None, "details": None})
+
+
+def _is_exclusion(e: sqlite3.Error) -> bool:
+    return "exclusion constraint" in str(e)
+
+
+def _is_foreign_key(e: sqlite3.Error) -> bool:
+    return str(e).startswith("FOREIGN KEY")
+
+
+class LocalStore:
+    """
+    One SQLite connection shared by every local client in the process
+
+    Statements are serialized by a lock, so the store is safe to use from
+    the event loop and from worker threads at once.
+    """
+
+    def __init__(self, path: str = LOCAL_DATABASE_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function("uuid4", 0, lambda: str(uuid.uuid4()))
+        self.conn.create_function("utc_now", 0, _utc_now)
+        self.conn.create_function("shard_bucket", 1, _shard_bucket, deterministic=True)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA case_sensitive_like = ON")  # LIKE is case-sensitive in Postgres
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+        self._columns: Dict[str, List[str]] = {}
+        self.queries = 0
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def columns(self, table: str) -> List[str]:
+        """Column names of a table or view (PGRST205 if there is none)"""
+        columns = self._columns.get(table)
+        if columns is None:
+            rows = self.conn.execute(f'PRAGMA table_xinfo("{table}")').fetchall() if IDENTIFIER.match(table) else []
+            if not rows:
+                raise APIError({
+                    "message": f"Could not find the table 'public.{table}' in the schema cache",
+                    "code": "PGRST205", "hint": None, "details": None
+                })
+            columns = self._columns[table] = [row["name"] for row in rows]
+        return columns
+
+    def relationship(self, table: str, embedded: str) -> Tuple[str, str, bool]:
+        """
+        How rows of an embedded table attach to rows of table
+
+        Returns (column of table, column of embedded, many): a foreign key
+        from table embeds one row, one from embedded embeds a list.
+        """
+        self.columns(embedded)
+        for fk in self.conn.execute(f'PRAGMA foreign_key_list("{table}")'):
+            if fk["table"] == embedded:
+                return fk["from"], fk["to"], False
+        for fk in self.conn.execute(f'PRAGMA foreign_key_list("{embedded}")'):
+            if fk["table"] == table:
+                return fk["to"], fk["from"], True
+        raise APIError({
+            "message": f"Could not find a relationship between '{table}' and '{embedded}' in the schema cache",
+            "code": "PGRST200", "hint": None, "details": None
+        })
+
+    def rows_by_rowid(self, table: str, rowids: List[int]) -> List[Dict]:
+        if not rowids:
+            return []
+        placeholders = ", ".join("?" * len(rowids))
+        rows = {
+            row["rowid"]: row
+            for row in self.conn.execute(f'SELECT rowid, * FROM "{table}" WHERE rowid IN ({placeholders})', rowids)
+        }
+        result = []
+        for rowid in rowids:
+            data = _row(rows[rowid])
+            del data["rowid"]
+            result.append(data)
+        return result
+
+
+class LocalQuery:
+    """
+    Query builder with the postgrest-py surface this project uses
+
+    select (with embedded relations, e.g. "schedule_id, patients(phone)"),
+    insert, update and delete; eq/neq/gt/gte/lt/lte/like/in_ filters and
+    or_ logic trees; order and limit. execute() returns an APIResponse;
+    constraint violations raise APIError with the Postgres error code.
+    """
+
+    def __init__(self, store: LocalStore, table: str):
+        self.store = store
+        self.table = table
+        self._method = "select"
+        self._columns = "*"
+        self._count: Optional[str] = None
+        self._payload = None
+        self._where: List[Tuple[str, list]] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+
+    def select(self, *columns: str, count: Optional[str] = None) -> "LocalQuery":
+        self._method = "select"
+        self._columns = ",".join(columns) or "*"
+        self._count = count
+        return self
+
+    def insert(self, rows, **options) -> "LocalQuery":
+        self._method = "insert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values: Dict, **options) -> "LocalQuery":
+        self._method = "update"
+        self._payload = values
+        return self
+
+    def delete(self, **options) -> "LocalQuery":
+        self._method = "delete"
+        return self
+
+    def eq(self, column: str, value) -> "LocalQuery":
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value) -> "LocalQuery":
+        return self._filter(column, "neq", value)
+
+    def gt(self, column: str, value) -> "LocalQuery":
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value) -> "LocalQuery":
+        return self._filter(column, "gte", value)
+
+    def lt(self, column: str, value) -> "LocalQuery":
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value) -> "LocalQuery":
+        return self._filter(column, "lte", value)
+
+    def like(self, column: str, pattern: str) -> "LocalQuery":
+        return self._filter(column, "like", pattern)
+
+    def in_(self, column: str, values) -> "LocalQuery":
+        return self._filter(column, "in", list(values))
+
+    def or_(self, filters: str, reference_table: Optional[str] = None) -> "LocalQuery":
+        """PostgREST logic tree, e.g. "pid.gt.X,and(pid.eq.X,slot_id.gt.Y)" """
+        self._where.append(self._logic(filters, " OR "))
+        return self
+
+    def order(self, column: str, *, desc: bool = False, nullsfirst: Optional[bool] = None,
+              foreign_table: Optional[str] = None) -> "LocalQuery":
+        self._check_column(column)
+        # Postgres puts NULLs last ascending and first descending
+        nulls_first = desc if nullsfirst is None else nullsfirst
+        self._order.append(f'"{column}" {"DESC" if desc else "ASC"} NULLS {"FIRST" if nulls_first else "LAST"}')
+        return self
+
+    def limit(self, size: int, *, foreign_table: Optional[str] = None) -> "LocalQuery":
+        self._limit = size
+        return self
+
+    def execute(self) -> APIResponse:
+        return self._run()
+
+    def _check_column(self, column: str):
+        if column not in self.store.columns(self.table):
+            raise APIError({
+                "message": f"column {self.table}.{column} does not exist",
+                "code": "42703", "hint": None, "details": None
+            })
+
+    def _condition(self, column: str, operator: str, value) -> Tuple[str, list]:
+        self._check_column(column)
+        if operator == "in":
+            if not value:
+                return "0", []
+            return f'"{column}" IN ({", ".join("?" * len(value))})', [_db_value(column, v) for v in value]
+        if operator not in OPERATORS:
+            raise APIError({
+                "message": f"failed to parse filter ({operator})",
+                "code": "PGRST100", "hint": None, "details": None
+            })
+        return f'"{column}" {OPERATORS[operator]} ?', [_db_value(column, value)]
+
+    def _filter(self, column: str, operator: str, value) -> "LocalQuery":
+        self._where.append(self._condition(column, operator, value))
+        return self
+
+    def _logic(self, expression: str, joiner: str) -> Tuple[str, list]:
+        terms, params = [], []
+        for term in _split_top_level(expression):
+            group = LOGIC_GROUP.match(term)
+            if group:
+                sql, args = self._logic(group.group(2), f" {group.group(1).upper()} ")
+            else:
+                column, operator, value = term.split(".", 2)
+                if operator == "in":
+                    value = _split_top_level(value[1:-1])
+                sql, args = self._condition(column, operator, value)
+            terms.append(f"({sql})")
+            params.extend(args)
+        return joiner.join(terms), params
+
+    def _where_clause(self) -> Tuple[str, list]:
+        if not self._where:
+            return "", []
+        params = [arg for _, args in self._where for arg in args]
+        return " WHERE " + " AND ".join(f"({sql})" for sql, _ in self._where), params
+
+    def _run(self) -> APIResponse:
+        with self.store.lock:
+            self.store.queries += 1
+            self.store.columns(self.table)
+            try:
+                return getattr(self, f"_run_{self._method}")()
+            except sqlite3.Error as e:
+                raise _api_error(e) from None
+
+    def _run_select(self) -> APIResponse:
+        where, params = self._where_clause()
+        count = None
+        if self._count or self._columns.strip() == "count":
+            count = self.store.conn.execute(f'SELECT COUNT(*) FROM "{self.table}"{where}', params).fetchone()[0]
+        if self._columns.strip() == "count":
+            # select("count") is the row count aggregate
+            data = [] if self._limit == 0 else [{"count": count}]
+            return APIResponse.model_construct(data=data, count=count if self._count else None)
+
+        columns, embeds, hidden = [], [], []
+        for item in _split_top_level(self._columns):
+            embedded = EMBEDDED.match(item)
+            if embedded:
+                name, inner = embedded.groups()
+                local, remote, many = self.store.relationship(self.table, name)
+                embeds.append((name, inner or "*", local, remote, many))
+                continue
+            if item != "*":
+                self._check_column(item)
+            columns.append(item)
+        # Join columns are fetched even when not selected, then dropped
+        if "*" not in columns:
+            for _, _, local, _, _ in embeds:
+                if local not in columns:
+                    columns.append(local)
+                    hidden.append(local)
+
+        select_list = ", ".join("*" if column == "*" else f'"{column}"' for column in columns)
+        sql = f'SELECT {select_list} FROM "{self.table}"{where}'
+        if self._order:
+            sql += " ORDER BY " + ", ".join(self._order)
+        if self._limit is not None:
+            sql += " LIMIT ?"
+            params = params + [self._limit]
+        rows = [_row(row) for row in self.store.conn.execute(sql, params)]
+
+        for name, inner, local, remote, many in embeds:
+            self._embed(rows, name, inner, local, remote, many)
+        for row in rows:
+            for column in hidden:
+                row.pop(column, None)
+        return APIResponse.model_construct(data=rows, count=count)
+
+    def _embed(self, rows: List[Dict], name: str, inner: str, local: str, remote: str, many: bool):
+        keys = list({row[local] for row in rows if row.get(local) is not None})
+        inner_columns = _split_top_level(inner)
+        select = inner if "*" in inner_columns or remote in inner_columns else f"{inner}, {remote}"
+        related: Dict[str, List[Dict]] = {}
+        if keys:
+            for item in LocalQuery(self.store, name).select(select).in_(remote, keys)._run_select().data:
+                related.setdefault(item[remote], []).append(item)
+        for row in rows:
+            matches = related.get(row.get(local), [])
+            if select != inner:
+                matches = [{k: v for k, v in item.items() if k != remote} for item in matches]
+            row[name] = matches if many else (matches[0] if matches else None)
+
+    def _run_insert(self) -> APIResponse:
+        rowids = []
+        with self.store.transaction() as conn:
+            for row in self._payload:
+                for column in row:
+                    self._check_column(column)
+                if row:
+                    names = ", ".join(f'"{column}"' for column in row)
+                    sql = f'INSERT INTO "{self.table}" ({names}) VALUES ({", ".join("?" * len(row))}) RETURNING rowid'
+                else:
+                    sql = f'INSERT INTO "{self.table}" DEFAULT VALUES RETURNING rowid'
+                rowids.append(conn.execute(sql, [_db_value(c, v) for c, v in row.items()]).fetchone()[0])
+            data = self.store.rows_by_rowid(self.table, rowids)
+        return APIResponse.model_construct(data=data, count=None)
+
+    def _run_update(self) -> APIResponse:
+        for column in self._payload:
+            self._check_column(column)
+        where, params = self._where_clause()
+        assignments = ", ".join(f'"{column}" = ?' for column in self._payload)
+        values = [_db_value(c, v) for c, v in self._payload.items()]
+        with self.store.transaction() as conn:
+            rowids = [row[0] for row in conn.execute(
+                f'UPDATE "{self.table}" SET {assignments}{where} RETURNING rowid', values + params
+            ).fetchall()]
+            # Re-read so values set by triggers (remind_at defaults) are returned
+            data = self.store.rows_by_rowid(self.table, rowids)
+        return APIResponse.model_construct(data=data, count=None)
+
+    def _run_delete(self) -> APIResponse:
+        where, params = self._where_clause()
+        with self.store.transaction() as conn:
+            data = [_row(row) for row in conn.execute(f'DELETE FROM "{self.table}"{where} RETURNING *', params).fetchall()]
+        return APIResponse.model_construct(data=data, count=None)
+
+
+# ================================================
+# RPC functions (Python ports of the plpgsql in supabase_schema.sql)
+# ================================================
+
+def _latest_upload(conn: sqlite3.Connection, pid: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT upload_id FROM uploads WHERE pid = ? ORDER BY upload_timestamp DESC, rowid DESC LIMIT 1", (pid,)
+    ).fetchone()
+    return row["upload_id"] if row else None
+
+
+def _insert_appointment(conn: sqlite3.Connection, pid: str, did: str, upload_id: str, appointment_time: str) -> str:
+    return conn.execute(
+        "INSERT INTO schedule (pid, did, upload_id, appointment_time) VALUES (?, ?, ?, ?) RETURNING schedule_id",
+        (pid, did, upload_id, appointment_time)
+    ).fetchone()["schedule_id"]
+
+
+def _booking_context(conn: sqlite3.Connection, pid: str, did: str, upload_id: Optional[str]) -> Dict:
+    """Shared validation of book_appointment and book_appointment_series"""
+    patient = conn.execute("SELECT phone FROM patients WHERE pid = ?", (pid,)).fetchone()
+    if patient is None:
+        return {"status": "invalid", "error": "Patient not found"}
+    doctor = conn.execute("SELECT doctor_name FROM doctors WHERE did = ?", (did,)).fetchone()
+    if doctor is None:
+        return {"status": "invalid", "error": "Doctor not found"}
+    upload_id = upload_id or _latest_upload(conn, pid)
+    if upload_id is None:
+        return {"status": "no_upload", "error": "No prescription found for patient"}
+    return {"upload_id": upload_id, "doctor_name": doctor["doctor_name"], "phone": patient["phone"]}
+
+
+def book_appointment(conn, p_pid, p_did, p_appointment_time, p_upload_id=None) -> Dict:
+    context = _booking_context(conn, p_pid, p_did, p_upload_id)
+    if "status" in context:
+        return context
+    try:
+        schedule_id = _insert_appointment(conn, p_pid, p_did, context["upload_id"], _timestamptz(p_appointment_time))
+    except sqlite3.IntegrityError as e:
+        if _is_exclusion(e):
+            return {"status": "conflict", "error": "Slot is no longer available"}
+        if _is_foreign_key(e):
+            return {"status": "invalid", "error": "Prescription reference not found"}
+        raise
+    return {"status": "confirmed", "schedule_id": schedule_id, **context}
+
+
+def book_appointment_series(conn, p_pid, p_did, p_times, p_upload_id=None) -> Dict:
+    context = _booking_context(conn, p_pid, p_did, p_upload_id)
+    if "status" in context:
+        return context
+    results = []
+    for appointment_time in map(_timestamptz, p_times):
+        try:
+            schedule_id = _insert_appointment(conn, p_pid, p_did, context["upload_id"], appointment_time)
+        except sqlite3.IntegrityError as e:
+            if _is_exclusion(e):
+                results.append({"appointment_time": appointment_time, "status": "conflict",
+                                "error": "Slot is no longer available"})
+                continue
+            if _is_foreign_key(e):
+                # The upload reference is the same for every time, so nothing was inserted yet
+                return {"status": "invalid", "error": "Prescription reference not found"}
+            raise
+        results.append({"appointment_time": appointment_time, "status": "confirmed", "schedule_id": schedule_id})
+    return {"status": "completed", **context, "results": results}
+
+
+def reschedule_appointment(conn, p_schedule_id, p_pid, p_new_time) -> Dict:
+    current = conn.execute(
+        "SELECT s.did, s.appointment_time, d.doctor_name, p.phone FROM schedule s "
+        "JOIN patients p ON p.pid = s.pid LEFT JOIN doctors d ON d.did = s.did "
+        "WHERE s.schedule_id = ? AND s.pid = ?",
+        (p_schedule_id, p_pid)
+    ).fetchone()
+    if current is None:
+        return {"status": "not_found", "error": "Appointment not found"}
+
+    new_time = _timestamptz(p_new_time)
+    try:
+        conn.execute("UPDATE schedule SET appointment_time = ? WHERE schedule_id = ?", (new_time, p_schedule_id))
+    except sqlite3.IntegrityError as e:
+        if _is_exclusion(e):
+            return {"status": "conflict", "error": "Slot is no longer available"}
+        raise
+    return {
+        "status": "rescheduled",
+        "schedule_id": p_schedule_id,
+        "doctor_id": current["did"],
+        "doctor_name": current["doctor_name"],
+        "phone": current["phone"],
+        "previous_time": current["appointment_time"],
+        "appointment_time": new_time
+    }
+
+
+def acquire_scheduler_lease(conn, p_name, p_holder, p_ttl_seconds) -> Dict:
+    now = datetime.now(timezone.utc)
+    expires_at = _timestamptz(datetime.fromtimestamp(now.timestamp() + p_ttl_seconds, timezone.utc))
+    row = conn.execute("SELECT holder, expires_at FROM scheduler_leases WHERE name = ?", (p_name,)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO scheduler_leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                     (p_name, p_holder, expires_at))
+    elif row["holder"] == p_holder or datetime.fromisoformat(row["expires_at"]) < now:
+        conn.execute("UPDATE scheduler_leases SET holder = ?, expires_at = ? WHERE name = ?",
+                     (p_holder, expires_at, p_name))
+
+    row = conn.execute("SELECT holder, state FROM scheduler_leases WHERE name = ?", (p_name,)).fetchone()
+    return {"acquired": row["holder"] == p_holder, "holder": row["holder"], "state": json.loads(row["state"])}
+
+
+RPC_FUNCTIONS = {
+    "book_appointment": book_appointment,
+    "book_appointment_series": book_appointment_series,
+    "reschedule_appointment": reschedule_appointment,
+    "acquire_scheduler_lease": acquire_scheduler_lease,
+}
+
+
+class LocalRpc:
+    """A call to one of RPC_FUNCTIONS, run in a single transaction"""
+
+    def __init__(self, store: LocalStore, name: str, params: Dict):
+        self.store = store
+        self.name = name
+        self.params = params
+
+    def execute(self) -> APIResponse:
+        return self._run()
+
+    def _run(self) -> APIResponse:
+        function = RPC_FUNCTIONS.get(self.name)
+        if function is None:
+            raise APIError({
+                "message": f"Could not find the function public.{self.name} in the schema cache",
+                "code": "PGRST202", "hint": None, "details": None
+            })
+        with self.store.lock:
+            self.store.queries += 1
+            try:
+                with self.store.transaction() as conn:
+                    return APIResponse.model_construct(data=function(conn, **self.params), count=None)
+            except sqlite3.Error as e:
+                raise _api_error(e) from None
+
+
+class AsyncLocalQuery(LocalQuery):
+    async def execute(self) -> APIResponse:
+        return self._run()
+
+
+class AsyncLocalRpc(LocalRpc):
+    async def execute(self) -> APIResponse:
+        return self._run()
+
+
+class LocalClient:
+    """Stands in for supabase.Client: table() / from_() / rpc() over the shared store"""
+
+    query_class = LocalQuery
+    rpc_class = LocalRpc
+
+    def __init__(self, store: Optional[LocalStore] = None):
+        self.store = store or get_local_store()
+
+    def table(self, table_name: str) -> LocalQuery:
+        return self.query_class(self.store, table_name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[Dict] = None) -> LocalRpc:
+        return self.rpc_class(self.store, fn, params or {})
+
+
+class AsyncLocalClient(LocalClient):
+    """
+    Stands in for supabase.AsyncClient
+
+    Queries run inline on the event loop: an indexed SQLite lookup takes
+    microseconds, less than handing it to a thread would.
+    """
+
+    query_class = AsyncLocalQuery
+    rpc_class = AsyncLocalRpc
+
+    async def aclose(self):
+        pass
+
+
+_store: Optional[LocalStore] = None
+_store_lock = threading.Lock()
+
+
+def get_local_store() -> LocalStore:
+    """Get the process-wide store at LOCAL_DATABASE_PATH, creating its schema on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LocalStore()
+        return _store
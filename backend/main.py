@@ -1,12 +1,16 @@
+import asyncio
 import os
 import uuid
+from contextlib import asynccontextmanager, suppress
 from typing import Optional
 
 import uvicorn
 from agent import process_interaction
+from tools import bind_app_loop
 from auth import create_access_token, hash_password, verify_password
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Header, Depends, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from models import (
     ChatRequest,
@@ -16,14 +20,58 @@ from models import (
     AuthResponse,
     UserProfile,
 )
-from supabase_client import get_supabase_client
+from supabase_client import start_async_client, close_async_client
+from repository import get_repository
+from data_loader import loader_scope
+from change_feed import change_feed
 from agents.agent_router import router as agent_router
+from agents.notification_agent import start_http_client, close_http_client, send_scheduler
+from agents.notification_outbox import get_outbox, run_dispatcher
+from agents.reminder_scheduler import reminder_scheduler, REMINDER_SCHEDULER_ENABLED
+from agents.appointment_reminders import run_appointment_reminders, APPOINTMENT_REMINDERS_ENABLED
 
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start shared clients and background workers on startup, stop them on shutdown
+    """
+    await start_http_client()
+    await start_async_client()
+    await get_repository().start()
+    await change_feed.start()
+    bind_app_loop(asyncio.get_running_loop())
+
+    background_tasks = [
+        asyncio.create_task(send_scheduler.run()),
+        asyncio.create_task(run_dispatcher(get_outbox())),
+    ]
+    if REMINDER_SCHEDULER_ENABLED:
+        background_tasks.append(asyncio.create_task(reminder_scheduler.run()))
+    if APPOINTMENT_REMINDERS_ENABLED:
+        background_tasks.append(asyncio.create_task(run_appointment_reminders()))
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+    for task in background_tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+
+    bind_app_loop(None)
+    await change_feed.stop()
+    await get_repository().close()
+    await close_async_client()
+    await close_http_client()
+
+
 app = FastAPI(
     title="VITA-Care API",
     description="Voice-Integrated Task-Autonomous Care Coordination Agent",
+    lifespan=lifespan,
 )
 
 # CORS Setup
@@ -41,6 +89,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def request_data_loaders(request, call_next):
+    """Give each request its own batched, cached data loaders"""
+    with loader_scope():
+        return await call_next(request)
+
+
 # Include agent router
 app.include_router(agent_router)
 
@@ -87,13 +143,13 @@ async def register(request: UserRegisterRequest):
     Register a new user
     Creates patient record in Supabase and returns JWT token
     """
-    supabase = get_supabase_client()
+    repository = get_repository()
 
     try:
         # Check if username already exists
-        existing_user = supabase.table("patients").select("*").eq("username", request.username).execute()
+        existing_user = await repository.get_patient_by_username(request.username)
 
-        if existing_user.data and len(existing_user.data) > 0:
+        if existing_user:
             raise HTTPException(status_code=400, detail="Username already exists")
 
         # Hash password
@@ -109,12 +165,11 @@ async def register(request: UserRegisterRequest):
             "dob": request.dob or None,
         }
 
-        response = supabase.table("patients").insert(new_user).execute()
+        user_data = await repository.create_patient(new_user)
 
-        if not response.data or len(response.data) == 0:
+        if not user_data:
             raise HTTPException(status_code=500, detail="Failed to create user")
 
-        user_data = response.data[0]
         user_id = str(user_data["pid"])
 
         # Create JWT token
@@ -142,17 +197,15 @@ async def login(request: UserLoginRequest):
     Login user
     Validates credentials and returns JWT token
     """
-    supabase = get_supabase_client()
+    repository = get_repository()
 
     try:
         # Find user by username
-        response = supabase.table("patients").select("*").eq("username", request.username.lower()).execute()
+        user_data = await repository.get_patient_by_username(request.username.lower())
 
-        if not response.data or len(response.data) == 0:
+        if not user_data:
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
-        user_data = response.data[0]
-
         # Verify password
         if not verify_password(request.password, user_data["password_hash"]):
             raise HTTPException(status_code=401, detail="Invalid username or password")
@@ -184,16 +237,14 @@ async def get_profile(user_id: str = Depends(get_current_user)):
     Get current user's profile
     Requires valid JWT token
     """
-    supabase = get_supabase_client()
+    repository = get_repository()
 
     try:
-        response = supabase.table("patients").select("*").eq("pid", user_id).execute()
+        user_data = await repository.get_patient(user_id)
 
-        if not response.data or len(response.data) == 0:
+        if not user_data:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_data = response.data[0]
-
         return UserProfile(
             pid=str(user_data["pid"]),
             username=user_data["username"],
@@ -229,7 +280,10 @@ async def chat_endpoint(request: ChatRequest, user_id: str = Depends(get_current
             logs=[{"tool": "mock_tool", "status": "skipped", "args": {}}],
         )
 
-    result = process_interaction(request.message, request.conversation_history, user_id)
+    # The model and tool calls block; keep them off the event loop
+    result = await run_in_threadpool(
+        process_interaction, request.message, request.conversation_history, user_id
+    )
 
     return ChatResponse(
         response=result["response"],
@@ -256,7 +310,7 @@ async def upload_prescription(
     )
 
     try:
-        supabase = get_supabase_client()
+        repository = get_repository()
 
         # Validate file
         is_valid, error_msg = await validate_upload_file(file)
@@ -269,8 +323,7 @@ async def upload_prescription(
         file_hash = calculate_file_hash(content)
 
         # Check for duplicate upload
-        existing = supabase.table("uploads").select("upload_id").eq("file_hash", file_hash).eq("pid", user_id).execute()
-        if existing.data:
+        if await repository.upload_exists(user_id, file_hash):
             raise HTTPException(status_code=400, detail="This prescription has already been uploaded")
 
         # Extract data using Gemini
@@ -279,64 +332,22 @@ async def upload_prescription(
         # Normalize and validate
         normalized_data = normalize_extracted_data(raw_data)
 
-        # Store in database
-        # 1. Create upload record
-        upload_data = {
-            "pid": user_id,
-            "file_hash": file_hash,
-            "file_name": file.filename,
-            "file_size": len(content),
-            "file_type": file.content_type,
-            "extraction_status": "success"
-        }
-        upload_result = supabase.table("uploads").insert(upload_data).execute()
-        upload_id = upload_result.data[0]["upload_id"]
-
-        # 2. Create or get doctor record
-        doctor_data = {
-            "doctor_name": normalized_data["doctor_name"],
-            "doctor_id_external": normalized_data.get("doctor_id_external"),
-            "pid": user_id,
-            "upload_id": upload_id
-        }
-
-        # Try to find existing doctor
-        existing_doctor = supabase.table("doctors").select("did").eq("doctor_name", doctor_data["doctor_name"]).eq("pid", user_id).execute()
-
-        if existing_doctor.data:
-            doctor_id = existing_doctor.data[0]["did"]
-        else:
-            doctor_result = supabase.table("doctors").insert(doctor_data).execute()
-            doctor_id = doctor_result.data[0]["did"]
-
-        # 3. Create drug records and drug_slots
-        drug_ids = []
-        for drug in normalized_data["drugs"]:
-            # Insert drug
-            drug_data = {
-                "pid": user_id,
-                "upload_id": upload_id,
-                "drug_name": drug["drug_name"]
-            }
-            drug_result = supabase.table("drugs").insert(drug_data).execute()
-            drug_id = drug_result.data[0]["drug_id"]
-            drug_ids.append(drug_id)
-
-            # Insert drug slots
-            for slot in drug["slots"]:
-                slot_data = {
-                    "drug_id": drug_id,
-                    "slot": slot
-                }
-                supabase.table("drug_slots").insert(slot_data).execute()
-
-        # 4. Create schedule record
-        schedule_data = {
-            "pid": user_id,
-            "did": doctor_id,
-            "upload_id": upload_id
-        }
-        supabase.table("schedule").insert(schedule_data).execute()
+        # Store upload record, doctor, drugs with their slots and the follow-up schedule
+        upload_id = await repository.save_prescription(
+            user_id,
+            upload={
+                "file_hash": file_hash,
+                "file_name": file.filename,
+                "file_size": len(content),
+                "file_type": file.content_type,
+                "extraction_status": "success"
+            },
+            doctor={
+                "doctor_name": normalized_data["doctor_name"],
+                "doctor_id_external": normalized_data.get("doctor_id_external")
+            },
+            drugs=normalized_data["drugs"]
+        )
 
         return {
             "message": "Prescription uploaded successfully",
@@ -0,0 +1,441 @@
+"""
+Data Repository
+Hot-path queries behind one interface, served by PostgREST or a direct Postgres pool
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from supabase_client import get_async_supabase_client
+from data_loader import get_loader, invalidate
+from entity_cache import patient_cache, patient_doctors_cache
+from change_feed import change_bus
+
+load_dotenv()
+
+# "supabase" (PostgREST over HTTPS), "postgres" (direct connection pool)
+# or "local" (the table API served from SQLite, see local_backend)
+DATA_BACKEND = os.getenv("DATA_BACKEND", "supabase").lower()
+
+# Direct connection settings (postgres backend only)
+DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_POOL_MAX = int(os.getenv("DATABASE_POOL_MAX", "10"))
+
+DUE_MEDICATION_COLUMNS = "slot_id, slot, drug_id, drug_name, pid, patient_name, patient_phone"
+DOCTOR_COLUMNS = "did, doctor_name, doctor_id_external"
+
+
+class SupabaseRepository:
+    """Hot-path queries over the async PostgREST client"""
+
+    name = "supabase"
+
+    async def start(self):
+        pass  # The async client is started by the app lifespan
+
+    async def close(self):
+        pass
+
+    async def get_patient_by_username(self, username: str) -> Optional[Dict]:
+        supabase = get_async_supabase_client()
+        response = await supabase.table("patients").select("*").eq("username", username).execute()
+        return response.data[0] if response.data else None
+
+    async def get_patient(self, pid: str) -> Optional[Dict]:
+        # Cached across requests, misses batched per request (the row is shared; do not mutate it)
+        return await patient_cache.get_or_load(pid, lambda: get_loader("patients", "pid").load_one(pid))
+
+    async def create_patient(self, patient: Dict) -> Optional[Dict]:
+        supabase = get_async_supabase_client()
+        response = await supabase.table("patients").insert(patient).execute()
+        if not response.data:
+            return None
+        change_bus.publish("patients", "INSERT", id=response.data[0]["pid"], pid=response.data[0]["pid"])
+        return response.data[0]
+
+    async def get_patient_doctors(self, pid: str) -> List[Dict]:
+        """Doctors from a patient's prescriptions (cached; the list is shared)"""
+        return await patient_doctors_cache.get_or_load(
+            pid, lambda: get_loader("doctors", "pid", DOCTOR_COLUMNS).load(pid)
+        )
+
+    async def fetch_due_medications(
+        self,
+        slot: Optional[str] = None,
+        remind_after: Optional[time] = None,
+        remind_until: Optional[time] = None,
+        buckets: Optional[List[int]] = None,
+        after: Optional[Tuple[str, str]] = None,
+        limit: int = 1000
+    ) -> List[Dict]:
+        """One keyset page of due_medications ordered by (pid, slot_id)"""
+        supabase = get_async_supabase_client()
+        query = supabase.table("due_medications").select(DUE_MEDICATION_COLUMNS)
+        if slot:
+            query = query.eq("slot", slot)
+        if remind_after is not None:
+            query = query.gt("remind_at", remind_after.isoformat())
+        if remind_until is not None:
+            query = query.lte("remind_at", remind_until.isoformat())
+        if buckets is not None:
+            query = query.in_("shard_bucket", buckets)
+        if after is not None:
+            last_pid, last_slot_id = after
+            query = query.or_(f"pid.gt.{last_pid},and(pid.eq.{last_pid},slot_id.gt.{last_slot_id})")
+        response = await query.order("pid").order("slot_id").limit(limit).execute()
+        return response.data or []
+
+    async def book_appointment(self, pid: str, did: str, appointment_time: datetime,
+                               upload_id: Optional[str] = None) -> Optional[Dict]:
+        supabase = get_async_supabase_client()
+        response = await supabase.rpc("book_appointment", {
+            "p_pid": pid,
+            "p_did": did,
+            "p_appointment_time": appointment_time.isoformat(),
+            "p_upload_id": upload_id
+        }).execute()
+        return response.data
+
+    async def book_appointment_series(self, pid: str, did: str, appointment_times: List[datetime],
+                                      upload_id: Optional[str] = None) -> Optional[Dict]:
+        """Book several times in one call; per-time results come back in the order given"""
+        supabase = get_async_supabase_client()
+        response = await supabase.rpc("book_appointment_series", {
+            "p_pid": pid,
+            "p_did": did,
+            "p_times": [appointment_time.isoformat() for appointment_time in appointment_times],
+            "p_upload_id": upload_id
+        }).execute()
+        return response.data
+
+    async def upload_exists(self, pid: str, file_hash: str) -> bool:
+        supabase = get_async_supabase_client()
+        response = await supabase.table("uploads").select("upload_id").eq(
+            "file_hash", file_hash
+        ).eq("pid", pid).execute()
+        return bool(response.data)
+
+    async def save_prescription(self, pid: str, upload: Dict, doctor: Dict, drugs: List[Dict]) -> str:
+        """
+        Persist an extracted prescription
+
+        Creates the upload record, reuses or creates the doctor, inserts
+        each drug with its slots and a follow-up schedule row.
+
+        Returns:
+            The new upload_id
+        """
+        supabase = get_async_supabase_client()
+
+        upload_result = await supabase.table("uploads").insert({**upload, "pid": pid}).execute()
+        upload_id = upload_result.data[0]["upload_id"]
+
+        existing_doctor = next(
+            (row for row in await self.get_patient_doctors(pid) if row["doctor_name"] == doctor["doctor_name"]),
+            None
+        )
+        if existing_doctor:
+            doctor_id = existing_doctor["did"]
+        else:
+            doctor_result = await supabase.table("doctors").insert(
+                {**doctor, "pid": pid, "upload_id": upload_id}
+            ).execute()
+            doctor_id = doctor_result.data[0]["did"]
+
+        for drug in drugs:
+            drug_result = await supabase.table("drugs").insert({
+                "pid": pid,
+                "upload_id": upload_id,
+                "drug_name": drug["drug_name"]
+            }).execute()
+            drug_id = drug_result.data[0]["drug_id"]
+            if drug["slots"]:
+                await supabase.table("drug_slots").insert(
+                    [{"drug_id": drug_id, "slot": slot} for slot in drug["slots"]]
+                ).execute()
+
+        await supabase.table("schedule").insert({
+            "pid": pid,
+            "did": doctor_id,
+            "upload_id": upload_id
+        }).execute()
+
+        invalidate("doctors")
+        publish_prescription_changes(pid, drugs)
+        return upload_id
+
+
+# Statements prepared once on every pooled connection: name -> (parameter types, SQL)
+PREPARED_STATEMENTS: Dict[str, Tuple[str, str]] = {
+    "patient_by_username": ("text", "SELECT * FROM patients WHERE username = $1"),
+    "patient_by_id": ("uuid", "SELECT * FROM patients WHERE pid = $1"),
+    "doctors_by_patient": ("uuid", f"SELECT {DOCTOR_COLUMNS}, pid FROM doctors WHERE pid = $1"),
+    "insert_patient": (
+        "text, text, text, text, text, date",
+        "INSERT INTO patients (username, name, password_hash, email, phone, dob) "
+        "VALUES ($1, $2, $3, $4, $5, $6) RETURNING *"
+    ),
+    # NULL parameters disable their filter; (pid, slot_id) > ($5, $6) is the keyset
+    "due_medications_page": (
+        "text, time, time, smallint[], uuid, uuid, integer",
+        f"SELECT {DUE_MEDICATION_COLUMNS} FROM due_medications "
+        "WHERE ($1::text IS NULL OR slot = $1) "
+        "AND ($2::time IS NULL OR remind_at > $2) "
+        "AND ($3::time IS NULL OR remind_at <= $3) "
+        "AND ($4::smallint[] IS NULL OR shard_bucket = ANY($4)) "
+        "AND ($5::uuid IS NULL OR (pid, slot_id) > ($5, $6)) "
+        "ORDER BY pid, slot_id LIMIT $7"
+    ),
+    "book_appointment": (
+        "uuid, uuid, timestamptz, uuid",
+        "SELECT book_appointment($1, $2, $3, $4) AS result"
+    ),
+    "book_appointment_series": (
+        "uuid, uuid, timestamptz[], uuid",
+        "SELECT book_appointment_series($1, $2, $3, $4) AS result"
+    ),
+    "upload_exists": ("uuid, text", "SELECT 1 FROM uploads WHERE file_hash = $2 AND pid = $1"),
+    "insert_upload": (
+        "uuid, text, text, integer, text, text",
+        "INSERT INTO uploads (pid, file_hash, file_name, file_size, file_type, extraction_status) "
+        "VALUES ($1, $2, $3, $4, $5, $6) RETURNING upload_id"
+    ),
+    "doctor_by_name": ("uuid, text", "SELECT did FROM doctors WHERE pid = $1 AND doctor_name = $2"),
+    "insert_doctor": (
+        "uuid, text, text, uuid",
+        "INSERT INTO doctors (pid, doctor_name, doctor_id_external, upload_id) "
+        "VALUES ($1, $2, $3, $4) RETURNING did"
+    ),
+    "insert_drug": (
+        "uuid, uuid, text",
+        "INSERT INTO drugs (pid, upload_id, drug_name) VALUES ($1, $2, $3) RETURNING drug_id"
+    ),
+    "insert_drug_slots": (
+        "uuid, text[]",
+        "INSERT INTO drug_slots (drug_id, slot) SELECT $1, unnest($2)"
+    ),
+    "insert_followup": (
+        "uuid, uuid, uuid",
+        "INSERT INTO schedule (pid, did, upload_id) VALUES ($1, $2, $3)"
+    ),
+}
+
+
+def publish_prescription_changes(pid: str, drugs: List[Dict]):
+    """Announce the rows a saved prescription added (see change_feed)"""
+    change_bus.publish("doctors", "INSERT", pid=pid)
+    change_bus.publish("drugs", "INSERT", pid=pid)
+    if any(drug["slots"] for drug in drugs):
+        change_bus.publish("drug_slots", "INSERT", pid=pid)
+
+
+def _json_row(row) -> Dict:
+    """Shape a database row like a PostgREST JSON row (UUIDs and times as strings)"""
+    return {
+        key: value.isoformat() if isinstance(value, (datetime, date, time)) else value
+        for key, value in row.items()
+    }
+
+
+class PostgresRepository:
+    """
+    Hot-path queries over a direct Postgres connection pool
+
+    Each query is a server-side prepared statement on a pooled, kept-open
+    connection, so it skips the HTTPS round trip, PostgREST and re-planning.
+    psycopg2 is blocking, so statements run on a dedicated executor with
+    one thread per pooled connection; the pool is never exhausted and the
+    event loop never waits on the database.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: Optional[str] = DATABASE_URL, max_size: int = DATABASE_POOL_MAX):
+        self.dsn = dsn
+        self.max_size = max_size
+        self._pool = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        from psycopg2.extensions import connection
+        from psycopg2.pool import ThreadedConnectionPool
+
+        class PreparedConnection(connection):
+            """A connection that remembers whether PREPARED_STATEMENTS ran on it"""
+            prepared = False
+
+        with self._lock:
+            if self._pool is None:
+                if not self.dsn:
+                    raise ValueError("DATABASE_URL must be set when DATA_BACKEND=postgres")
+                # minconn == maxconn: putconn closes connections beyond minconn,
+                # and every new connection would have to PREPARE again
+                self._pool = ThreadedConnectionPool(
+                    self.max_size, self.max_size, self.dsn, connection_factory=PreparedConnection
+                )
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_size, thread_name_prefix="postgres"
+                )
+
+    async def start(self):
+        """Open the pool (called from the app lifespan; otherwise on first query)"""
+        if self._pool is None:
+            await asyncio.get_running_loop().run_in_executor(None, self._open)
+
+    async def close(self):
+        with self._lock:
+            pool, executor = self._pool, self._executor
+            self._pool, self._executor = None, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if pool is not None:
+            pool.closeall()
+
+    def _prepare(self, conn):
+        with conn.cursor() as cur:
+            for name, (types, sql) in PREPARED_STATEMENTS.items():
+                cur.execute(f"PREPARE {name} ({types}) AS {sql}")
+        conn.commit()
+        conn.prepared = True
+
+    def _transaction(self, work):
+        """Run work(cursor) in one transaction on a pooled connection (executor thread)"""
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+
+        conn = self._pool.getconn()
+        broken = False
+        try:
+            if not conn.prepared:
+                self._prepare(conn)
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    return work(cur)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._pool.putconn(conn, close=broken)
+
+    async def _run(self, work):
+        await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._transaction, work)
+
+    async def _fetch(self, statement: str, *args) -> List[Dict]:
+        params = ", ".join(["%s"] * len(args))
+
+        def work(cur):
+            cur.execute(f"EXECUTE {statement} ({params})" if args else f"EXECUTE {statement}", args)
+            return [_json_row(row) for row in cur.fetchall()] if cur.description else []
+
+        return await self._run(work)
+
+    async def get_patient_by_username(self, username: str) -> Optional[Dict]:
+        rows = await self._fetch("patient_by_username", username)
+        return rows[0] if rows else None
+
+    async def get_patient(self, pid: str) -> Optional[Dict]:
+        async def load():
+            rows = await self._fetch("patient_by_id", pid)
+            return rows[0] if rows else None
+
+        return await patient_cache.get_or_load(pid, load)
+
+    async def create_patient(self, patient: Dict) -> Optional[Dict]:
+        rows = await self._fetch(
+            "insert_patient",
+            patient["username"], patient["name"], patient["password_hash"],
+            patient.get("email"), patient["phone"], patient.get("dob")
+        )
+        if not rows:
+            return None
+        change_bus.publish("patients", "INSERT", id=rows[0]["pid"], pid=rows[0]["pid"])
+        return rows[0]
+
+    async def get_patient_doctors(self, pid: str) -> List[Dict]:
+        return await patient_doctors_cache.get_or_load(pid, lambda: self._fetch("doctors_by_patient", pid))
+
+    async def fetch_due_medications(
+        self,
+        slot: Optional[str] = None,
+        remind_after: Optional[time] = None,
+        remind_until: Optional[time] = None,
+        buckets: Optional[List[int]] = None,
+        after: Optional[Tuple[str, str]] = None,
+        limit: int = 1000
+    ) -> List[Dict]:
+        last_pid, last_slot_id = after or (None, None)
+        return await self._fetch(
+            "due_medications_page",
+            slot or None, remind_after, remind_until,
+            list(buckets) if buckets is not None else None,
+            last_pid, last_slot_id, limit
+        )
+
+    async def book_appointment(self, pid: str, did: str, appointment_time: datetime,
+                               upload_id: Optional[str] = None) -> Optional[Dict]:
+        rows = await self._fetch("book_appointment", pid, did, appointment_time, upload_id)
+        return rows[0]["result"] if rows else None
+
+    async def book_appointment_series(self, pid: str, did: str, appointment_times: List[datetime],
+                                      upload_id: Optional[str] = None) -> Optional[Dict]:
+        rows = await self._fetch("book_appointment_series", pid, did, list(appointment_times), upload_id)
+        return rows[0]["result"] if rows else None
+
+    async def upload_exists(self, pid: str, file_hash: str) -> bool:
+        return bool(await self._fetch("upload_exists", pid, file_hash))
+
+    async def save_prescription(self, pid: str, upload: Dict, doctor: Dict, drugs: List[Dict]) -> str:
+        """Persist an extracted prescription in one transaction (see SupabaseRepository)"""
+
+        def work(cur):
+            cur.execute("EXECUTE insert_upload (%s, %s, %s, %s, %s, %s)", (
+                pid, upload["file_hash"], upload["file_name"], upload["file_size"],
+                upload["file_type"], upload.get("extraction_status", "success")
+            ))
+            upload_id = str(cur.fetchone()["upload_id"])
+
+            cur.execute("EXECUTE doctor_by_name (%s, %s)", (pid, doctor["doctor_name"]))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("EXECUTE insert_doctor (%s, %s, %s, %s)", (
+                    pid, doctor["doctor_name"], doctor.get("doctor_id_external"), upload_id
+                ))
+                row = cur.fetchone()
+            doctor_id = str(row["did"])
+
+            for drug in drugs:
+                cur.execute("EXECUTE insert_drug (%s, %s, %s)", (pid, upload_id, drug["drug_name"]))
+                drug_id = cur.fetchone()["drug_id"]
+                if drug["slots"]:
+                    cur.execute("EXECUTE insert_drug_slots (%s, %s)", (drug_id, list(drug["slots"])))
+
+            cur.execute("EXECUTE insert_followup (%s, %s, %s)", (pid, doctor_id, upload_id))
+            return upload_id
+
+        upload_id = await self._run(work)
+        invalidate("doctors")
+        publish_prescription_changes(pid, drugs)
+        return upload_id
+
+
+REPOSITORIES = {"supabase": SupabaseRepository, "local": SupabaseRepository, "postgres": PostgresRepository}
+
+_repository = None
+
+
+def get_repository():
+    """Get the process-wide repository selected by DATA_BACKEND"""
+    global _repository
+    if _repository is None:
+        if DATA_BACKEND not in REPOSITORIES:
+            raise ValueError(f"Unknown DATA_BACKEND '{DATA_BACKEND}' (expected one of {', '.join(REPOSITORIES)})")
+        _repository = REPOSITORIES[DATA_BACKEND]()
+    return _repository
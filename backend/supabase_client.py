@@ -3,8 +3,12 @@ Supabase Client Configuration
 Initializes and provides Supabase client instance
 """
 
+import asyncio
 import os
-from supabase import create_client, Client
+from typing import Optional
+
+import httpx
+from supabase import create_client, Client, AsyncClient, AsyncClientOptions
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,18 +17,34 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# "local" serves the table API from SQLite (see local_backend) instead of
+# Supabase, so tests and load tests run the real code paths offline
+DATA_BACKEND = os.getenv("DATA_BACKEND", "supabase").lower()
+
+# Async client connection pool (PostgREST keeps connections alive, so reuse them)
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+SUPABASE_TIMEOUT = httpx.Timeout(15.0, connect=5.0, pool=5.0)
+
 # Initialize Supabase client
 supabase_client: Client = None
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables. Please add it to .env file.")
+if DATA_BACKEND == "local":
+    from local_backend import LocalClient, AsyncLocalClient, LOCAL_DATABASE_PATH
 
-try:
-    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase client initialized successfully")
-except Exception as e:
-    print(f"❌ Failed to initialize Supabase client: {e}")
-    raise
+    supabase_client = LocalClient()
+    print(f"✅ Local backend initialized ({LOCAL_DATABASE_PATH})")
+else:
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables. Please add it to .env file.")
+
+    try:
+        supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        print("✅ Supabase client initialized successfully")
+    except Exception as e:
+        print(f"❌ Failed to initialize Supabase client: {e}")
+        raise
 
 
 def get_supabase_client() -> Client:
@@ -37,6 +57,65 @@ def get_supabase_client() -> Client:
     return supabase_client
 
 
+_async_client: Optional[AsyncClient] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _create_async_client() -> AsyncClient:
+    if DATA_BACKEND == "local":
+        return AsyncLocalClient()
+
+    # One pooled httpx client carries every PostgREST request, so the DNS
+    # lookup and TLS handshake are paid once per kept-alive connection
+    http = httpx.AsyncClient(
+        timeout=SUPABASE_TIMEOUT,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return AsyncClient(SUPABASE_URL, SUPABASE_KEY, AsyncClientOptions(httpx_client=http))
+
+
+async def start_async_client():
+    """Create the process-wide async client (called from the app lifespan)"""
+    global _async_client, _async_client_loop
+    if _async_client is None:
+        _async_client = _create_async_client()
+        _async_client_loop = asyncio.get_running_loop()
+
+
+async def close_async_client():
+    """Close the process-wide async client and its pooled connections"""
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        if DATA_BACKEND == "local":
+            await _async_client.aclose()
+        else:
+            await _async_client.postgrest.session.aclose()
+        _async_client = None
+        _async_client_loop = None
+
+
+def get_async_supabase_client() -> AsyncClient:
+    """
+    Get the async Supabase client
+
+    Queries are awaited (`await client.table(...).execute()`) instead of
+    blocking the event loop. Created lazily when the app lifespan has not
+    run (scripts); connections are bound to an event loop, so callers on
+    another loop get a client of their own.
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = _create_async_client()
+        _async_client_loop = loop
+    return _async_client
+
+
 def test_connection() -> bool:
     """
     Test Supabase connection
@@ -88,6 +88,7 @@ CREATE TABLE IF NOT EXISTS schedule (
   pid UUID NOT NULL REFERENCES patients(pid) ON DELETE CASCADE,
   did UUID REFERENCES doctors(did) ON DELETE SET NULL,
   upload_id UUID NOT NULL REFERENCES uploads(upload_id) ON DELETE CASCADE,
+  appointment_time TIMESTAMP WITH TIME ZONE,
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
@@ -99,9 +100,359 @@ CREATE INDEX IF NOT EXISTS idx_uploads_status ON uploads(extraction_status);
 CREATE INDEX IF NOT EXISTS idx_drugs_pid ON drugs(pid);
 CREATE INDEX IF NOT EXISTS idx_drugs_upload ON drugs(upload_id);
 CREATE INDEX IF NOT EXISTS idx_schedule_pid ON schedule(pid);
+CREATE INDEX IF NOT EXISTS idx_schedule_did_time ON schedule(did, appointment_time);
+CREATE INDEX IF NOT EXISTS idx_schedule_appointment_time ON schedule(appointment_time) WHERE appointment_time IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_doctors_pid ON doctors(pid);
 CREATE INDEX IF NOT EXISTS idx_patients_username ON patients(username);
 
+-- ================================================
+-- BOOKING CONFLICT PREVENTION
+-- ================================================
+-- A doctor (or patient) cannot hold two overlapping appointments.
+-- Rows without appointment_time (prescription follow-ups) are not constrained.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE schedule DROP CONSTRAINT IF EXISTS schedule_doctor_no_overlap;
+ALTER TABLE schedule ADD CONSTRAINT schedule_doctor_no_overlap
+  EXCLUDE USING gist (
+    did WITH =,
+    tstzrange(appointment_time, appointment_time + INTERVAL '60 minutes') WITH &&
+  ) WHERE (appointment_time IS NOT NULL);
+
+ALTER TABLE schedule DROP CONSTRAINT IF EXISTS schedule_patient_no_overlap;
+ALTER TABLE schedule ADD CONSTRAINT schedule_patient_no_overlap
+  EXCLUDE USING gist (
+    pid WITH =,
+    tstzrange(appointment_time, appointment_time + INTERVAL '60 minutes') WITH &&
+  ) WHERE (appointment_time IS NOT NULL);
+
+-- ================================================
+-- ATOMIC BOOKING (called via supabase.rpc)
+-- ================================================
+-- Validates patient and doctor, picks the latest upload as the prescription
+-- reference when none is given, and inserts the appointment in one call.
+-- Also returns the patient phone and doctor name for the confirmation.
+-- Returns {"status": "confirmed" | "invalid" | "no_upload" | "conflict", ...}
+CREATE OR REPLACE FUNCTION book_appointment(
+  p_pid UUID,
+  p_did UUID,
+  p_appointment_time TIMESTAMP WITH TIME ZONE,
+  p_upload_id UUID DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+  v_upload_id UUID := p_upload_id;
+  v_schedule_id UUID;
+  v_phone TEXT;
+  v_doctor_name TEXT;
+BEGIN
+  SELECT phone INTO v_phone FROM patients WHERE pid = p_pid;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('status', 'invalid', 'error', 'Patient not found');
+  END IF;
+
+  SELECT doctor_name INTO v_doctor_name FROM doctors WHERE did = p_did;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('status', 'invalid', 'error', 'Doctor not found');
+  END IF;
+
+  IF v_upload_id IS NULL THEN
+    SELECT upload_id INTO v_upload_id
+    FROM uploads
+    WHERE pid = p_pid
+    ORDER BY upload_timestamp DESC
+    LIMIT 1;
+
+    IF v_upload_id IS NULL THEN
+      RETURN jsonb_build_object('status', 'no_upload', 'error', 'No prescription found for patient');
+    END IF;
+  END IF;
+
+  INSERT INTO schedule (pid, did, upload_id, appointment_time)
+  VALUES (p_pid, p_did, v_upload_id, p_appointment_time)
+  RETURNING schedule_id INTO v_schedule_id;
+
+  RETURN jsonb_build_object(
+    'status', 'confirmed',
+    'schedule_id', v_schedule_id,
+    'upload_id', v_upload_id,
+    'doctor_name', v_doctor_name,
+    'phone', v_phone
+  );
+EXCEPTION
+  WHEN exclusion_violation THEN
+    RETURN jsonb_build_object('status', 'conflict', 'error', 'Slot is no longer available');
+  WHEN foreign_key_violation THEN
+    RETURN jsonb_build_object('status', 'invalid', 'error', 'Prescription reference not found');
+END;
+$$ LANGUAGE plpgsql;
+
+-- ================================================
+-- BULK / RECURRING BOOKING (called via supabase.rpc)
+-- ================================================
+-- Validates once, then inserts every requested time in one call. Each
+-- occurrence runs in its own subtransaction so a conflict on one does not
+-- roll back the others. Returns one result object per requested time.
+CREATE OR REPLACE FUNCTION book_appointment_series(
+  p_pid UUID,
+  p_did UUID,
+  p_times TIMESTAMP WITH TIME ZONE[],
+  p_upload_id UUID DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+  v_upload_id UUID := p_upload_id;
+  v_time TIMESTAMP WITH TIME ZONE;
+  v_schedule_id UUID;
+  v_results JSONB := '[]'::JSONB;
+  v_phone TEXT;
+  v_doctor_name TEXT;
+BEGIN
+  SELECT phone INTO v_phone FROM patients WHERE pid = p_pid;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('status', 'invalid', 'error', 'Patient not found');
+  END IF;
+
+  SELECT doctor_name INTO v_doctor_name FROM doctors WHERE did = p_did;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('status', 'invalid', 'error', 'Doctor not found');
+  END IF;
+
+  IF v_upload_id IS NULL THEN
+    SELECT upload_id INTO v_upload_id
+    FROM uploads
+    WHERE pid = p_pid
+    ORDER BY upload_timestamp DESC
+    LIMIT 1;
+
+    IF v_upload_id IS NULL THEN
+      RETURN jsonb_build_object('status', 'no_upload', 'error', 'No prescription found for patient');
+    END IF;
+  END IF;
+
+  FOREACH v_time IN ARRAY p_times LOOP
+    BEGIN
+      INSERT INTO schedule (pid, did, upload_id, appointment_time)
+      VALUES (p_pid, p_did, v_upload_id, v_time)
+      RETURNING schedule_id INTO v_schedule_id;
+
+      v_results := v_results || jsonb_build_object(
+        'appointment_time', v_time, 'status', 'confirmed', 'schedule_id', v_schedule_id
+      );
+    EXCEPTION
+      WHEN exclusion_violation THEN
+        v_results := v_results || jsonb_build_object(
+          'appointment_time', v_time, 'status', 'conflict', 'error', 'Slot is no longer available'
+        );
+    END;
+  END LOOP;
+
+  RETURN jsonb_build_object(
+    'status', 'completed',
+    'upload_id', v_upload_id,
+    'doctor_name', v_doctor_name,
+    'phone', v_phone,
+    'results', v_results
+  );
+EXCEPTION
+  WHEN foreign_key_violation THEN
+    RETURN jsonb_build_object('status', 'invalid', 'error', 'Prescription reference not found');
+END;
+$$ LANGUAGE plpgsql;
+
+-- ================================================
+-- ATOMIC RESCHEDULE (called via supabase.rpc)
+-- ================================================
+-- Moves an appointment owned by p_pid to a new time in one statement; the
+-- exclusion constraints reject the move if the new time overlaps another
+-- booking. Returns the contact details needed for the confirmation message.
+CREATE OR REPLACE FUNCTION reschedule_appointment(
+  p_schedule_id UUID,
+  p_pid UUID,
+  p_new_time TIMESTAMP WITH TIME ZONE
+)
+RETURNS JSONB AS $$
+DECLARE
+  v_did UUID;
+  v_previous_time TIMESTAMP WITH TIME ZONE;
+  v_doctor_name TEXT;
+  v_phone TEXT;
+BEGIN
+  SELECT s.did, s.appointment_time, d.doctor_name, p.phone
+  INTO v_did, v_previous_time, v_doctor_name, v_phone
+  FROM schedule s
+  JOIN patients p ON p.pid = s.pid
+  LEFT JOIN doctors d ON d.did = s.did
+  WHERE s.schedule_id = p_schedule_id AND s.pid = p_pid
+  FOR UPDATE OF s;
+
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('status', 'not_found', 'error', 'Appointment not found');
+  END IF;
+
+  UPDATE schedule SET appointment_time = p_new_time WHERE schedule_id = p_schedule_id;
+
+  RETURN jsonb_build_object(
+    'status', 'rescheduled',
+    'schedule_id', p_schedule_id,
+    'doctor_id', v_did,
+    'doctor_name', v_doctor_name,
+    'phone', v_phone,
+    'previous_time', v_previous_time,
+    'appointment_time', p_new_time
+  );
+EXCEPTION
+  WHEN exclusion_violation THEN
+    RETURN jsonb_build_object('status', 'conflict', 'error', 'Slot is no longer available');
+END;
+$$ LANGUAGE plpgsql;
+
+-- ================================================
+-- DUE MEDICATIONS (reminder pipeline)
+-- ================================================
+-- Each drug slot carries its own reminder time. Rows inserted without one
+-- get the slot default (morning 08:00, afternoon 13:00, night 20:00).
+ALTER TABLE drug_slots ADD COLUMN IF NOT EXISTS remind_at TIME;
+
+CREATE OR REPLACE FUNCTION set_default_remind_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.remind_at IS NULL THEN
+    NEW.remind_at := CASE NEW.slot
+      WHEN 'morning' THEN TIME '08:00'
+      WHEN 'afternoon' THEN TIME '13:00'
+      ELSE TIME '20:00'
+    END;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS set_drug_slots_remind_at ON drug_slots;
+CREATE TRIGGER set_drug_slots_remind_at BEFORE INSERT OR UPDATE ON drug_slots
+  FOR EACH ROW EXECUTE FUNCTION set_default_remind_at();
+
+-- Backfill existing rows through the trigger
+UPDATE drug_slots SET remind_at = NULL WHERE remind_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_drug_slots_slot ON drug_slots(slot, drug_id);
+CREATE INDEX IF NOT EXISTS idx_drug_slots_remind_at ON drug_slots(remind_at, drug_id);
+CREATE INDEX IF NOT EXISTS idx_drugs_pid_drug ON drugs(pid, drug_id);
+
+-- Stable hash bucket (0-63) of the patient, used to split reminder work
+-- across worker shards. Must match SHARD_BUCKETS in agents/reminder_shards.py.
+ALTER TABLE drugs ADD COLUMN IF NOT EXISTS shard_bucket SMALLINT
+  GENERATED ALWAYS AS ((hashtext(pid::text) & 63)::smallint) STORED;
+CREATE INDEX IF NOT EXISTS idx_drugs_shard_bucket ON drugs(shard_bucket, pid);
+
+-- Flat view of every drug slot with its patient's contact details.
+-- The reminder cycle pages through it by (pid, slot_id) for one slot
+-- or one range of reminder times, optionally limited to a shard's buckets.
+CREATE OR REPLACE VIEW due_medications AS
+SELECT
+  ds.slot_id,
+  ds.slot,
+  ds.drug_id,
+  d.drug_name,
+  d.pid,
+  p.name AS patient_name,
+  p.phone AS patient_phone,
+  ds.remind_at,
+  d.shard_bucket
+FROM drug_slots ds
+JOIN drugs d ON d.drug_id = ds.drug_id
+JOIN patients p ON p.pid = d.pid;
+
+-- Distinct reminder times, used by the scheduler to decide when to wake.
+CREATE OR REPLACE VIEW reminder_times AS
+SELECT DISTINCT remind_at FROM drug_slots;
+
+-- ================================================
+-- SCHEDULER LEADER ELECTION
+-- ================================================
+-- One row per background job. A worker runs the job only while it holds
+-- the lease; the row also carries the job's progress so a new leader
+-- picks up where the previous one stopped.
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+  name TEXT PRIMARY KEY,
+  holder TEXT,
+  expires_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+  state JSONB NOT NULL DEFAULT '{}'::jsonb
+);
+
+-- Take or renew a lease. The advisory lock serializes concurrent callers
+-- for the same job within the transaction.
+-- Returns {"acquired": bool, "holder": text, "state": jsonb}
+CREATE OR REPLACE FUNCTION acquire_scheduler_lease(
+  p_name TEXT,
+  p_holder TEXT,
+  p_ttl_seconds INTEGER
+) RETURNS JSONB AS $$
+DECLARE
+  v_row scheduler_leases%ROWTYPE;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('scheduler_lease:' || p_name));
+
+  INSERT INTO scheduler_leases (name, holder, expires_at)
+  VALUES (p_name, p_holder, NOW() + make_interval(secs => p_ttl_seconds))
+  ON CONFLICT (name) DO UPDATE
+    SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+    WHERE scheduler_leases.holder = p_holder OR scheduler_leases.expires_at < NOW();
+
+  SELECT * INTO v_row FROM scheduler_leases WHERE name = p_name;
+
+  RETURN jsonb_build_object(
+    'acquired', v_row.holder = p_holder,
+    'holder', v_row.holder,
+    'state', v_row.state
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+-- ================================================
+-- ROW CHANGE FEED (cache invalidation across workers)
+-- ================================================
+-- Every change to a cached table is announced on the 'row_changes'
+-- channel; each worker LISTENs and drops its cached copies.
+-- Payload: {"table", "op", "id", "pid", "appointment_time"} (never whole
+-- rows: patients carry password hashes and NOTIFY payloads are capped).
+-- The trigger argument names the table's primary key column.
+CREATE OR REPLACE FUNCTION notify_row_change()
+RETURNS TRIGGER AS $$
+DECLARE
+  v_row JSONB := to_jsonb(COALESCE(NEW, OLD));
+BEGIN
+  PERFORM pg_notify('row_changes', jsonb_build_object(
+    'table', TG_TABLE_NAME,
+    'op', TG_OP,
+    'id', v_row->>TG_ARGV[0],
+    'pid', v_row->>'pid',
+    'appointment_time', v_row->>'appointment_time'
+  )::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS patients_row_change ON patients;
+CREATE TRIGGER patients_row_change AFTER INSERT OR UPDATE OR DELETE ON patients
+  FOR EACH ROW EXECUTE FUNCTION notify_row_change('pid');
+
+DROP TRIGGER IF EXISTS doctors_row_change ON doctors;
+CREATE TRIGGER doctors_row_change AFTER INSERT OR UPDATE OR DELETE ON doctors
+  FOR EACH ROW EXECUTE FUNCTION notify_row_change('did');
+
+DROP TRIGGER IF EXISTS drugs_row_change ON drugs;
+CREATE TRIGGER drugs_row_change AFTER INSERT OR UPDATE OR DELETE ON drugs
+  FOR EACH ROW EXECUTE FUNCTION notify_row_change('drug_id');
+
+DROP TRIGGER IF EXISTS drug_slots_row_change ON drug_slots;
+CREATE TRIGGER drug_slots_row_change AFTER INSERT OR UPDATE OR DELETE ON drug_slots
+  FOR EACH ROW EXECUTE FUNCTION notify_row_change('slot_id');
+
+DROP TRIGGER IF EXISTS schedule_row_change ON schedule;
+CREATE TRIGGER schedule_row_change AFTER INSERT OR UPDATE OR DELETE ON schedule
+  FOR EACH ROW EXECUTE FUNCTION notify_row_change('schedule_id');
+
 -- ================================================
 -- DISABLE ROW LEVEL SECURITY (RLS) FOR API ACCESS
 -- ================================================
@@ -114,6 +465,7 @@ ALTER TABLE doctors DISABLE ROW LEVEL SECURITY;
 ALTER TABLE drugs DISABLE ROW LEVEL SECURITY;
 ALTER TABLE drug_slots DISABLE ROW LEVEL SECURITY;
 ALTER TABLE schedule DISABLE ROW LEVEL SECURITY;
+ALTER TABLE scheduler_leases DISABLE ROW LEVEL SECURITY;
 
 -- ================================================
 -- TRIGGER FOR UPDATED_AT TIMESTAMP
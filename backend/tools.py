@@ -3,9 +3,30 @@ import datetime
 from uuid import UUID
 from typing import Optional
 
-from supabase_client import get_supabase_client
+from repository import get_repository
 from agents.scheduling_agent import suggest_slots
-from agents.booking_agent import book_slot, cancel_booking
+from agents.booking_agent import book_slot, cancel_booking, reschedule_booking
+from agents.idempotency import run_idempotent, tool_key, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_TOOL_TTL_SECONDS
+
+# Event loop of the running app (set from the lifespan)
+_app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind_app_loop(loop: Optional[asyncio.AbstractEventLoop]):
+    global _app_loop
+    _app_loop = loop
+
+
+def run_async(coro):
+    """
+    Run an agent coroutine from a (threadpool) tool call
+
+    While the app is serving, the coroutine runs on its event loop so it
+    shares the pooled async clients; scripts get a private loop.
+    """
+    if _app_loop is not None and _app_loop.is_running():
+        return asyncio.run_coroutine_threadsafe(coro, _app_loop).result()
+    return asyncio.run(coro)
 
 # --- Tool Implementations ---
 
@@ -15,17 +36,13 @@ def get_patient_record(patient_id: str):
     Args:
         patient_id: The ID of the patient (UUID).
     """
-    supabase = get_supabase_client()
     try:
-        response = supabase.table("patients").select("*").eq("pid", patient_id).execute()
-        if not response.data:
+        patient = run_async(get_repository().get_patient(patient_id))
+        if not patient:
             return {"error": "Patient not found", "status": "failed"}
-        
-        patient = response.data[0]
-        # Remove sensitive data
-        if "password_hash" in patient:
-            del patient["password_hash"]
-        return patient
+
+        # Remove sensitive data (the row may be shared through the request's loader)
+        return {key: value for key, value in patient.items() if key != "password_hash"}
     except Exception as e:
         return {"error": f"Database error: {str(e)}", "status": "failed"}
 
@@ -39,7 +56,7 @@ def check_appointment_availability(user_query: str, patient_id: str):
     """
     try:
         # Run async agent function synchronously
-        slots = asyncio.run(suggest_slots(user_query, UUID(patient_id)))
+        slots = run_async(suggest_slots(user_query, UUID(patient_id)))
         return {"slots": slots, "status": "success"}
     except ValueError:
         return {"error": "Invalid patient ID format.", "status": "failed"}
@@ -51,7 +68,11 @@ def check_appointment_availability(user_query: str, patient_id: str):
 
 
 def book_appointment(
-    patient_id: str, doctor_id: str, datetime_str: str, upload_id: Optional[str] = None
+    patient_id: str,
+    doctor_id: str,
+    datetime_str: str,
+    upload_id: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
 ):
     """
     Books an appointment. 
@@ -60,10 +81,21 @@ def book_appointment(
         doctor_id: The ID of the doctor (obtained from availability check).
         datetime_str: ISO format datetime string of the slot.
         upload_id: Optional prescription ID.
+        idempotency_key: Optional key; repeating a call with the same key returns the first result.
     """
     try:
         slot_dt = datetime.datetime.fromisoformat(datetime_str)
-        result = asyncio.run(book_slot(UUID(patient_id), UUID(doctor_id), slot_dt, upload_id))
+        pid, did = UUID(patient_id), UUID(doctor_id)
+
+        # Re-issued identical calls from the function-calling loop collapse onto one booking;
+        # cancels and reschedules drop these keys (see forget_tool_results)
+        key, ttl = idempotency_key, IDEMPOTENCY_TTL_SECONDS
+        if not key:
+            key, ttl = tool_key(did, slot_dt.isoformat(), upload_id or ""), IDEMPOTENCY_TOOL_TTL_SECONDS
+
+        result = run_async(run_idempotent(
+            f"booking:{pid}", key, lambda: book_slot(pid, did, slot_dt, upload_id), ttl
+        ))
         return result
     except ValueError as ve:
         if "UUID" in str(ve) or "badly formed" in str(ve).lower():
@@ -76,24 +108,59 @@ def book_appointment(
         return {"error": "Booking failed. Please try again.", "status": "failed"}
 
 
-def reschedule_appointment(appointment_id: str, new_datetime_str: str):
+def reschedule_appointment(
+    appointment_id: str,
+    new_datetime_str: str,
+    patient_id: str,
+    idempotency_key: Optional[str] = None,
+):
     """
-    Reschedules an existing appointment.
+    Moves an existing appointment to a new time in one step.
+    Use this instead of cancelling and booking again.
+    Args:
+        appointment_id: The ID of the appointment schedule to move.
+        new_datetime_str: ISO format datetime string of the new slot.
+        patient_id: The ID of the patient who owns the appointment.
+        idempotency_key: Optional key; repeating a call with the same key returns the first result.
     """
-    return {
-        "error": "Rescheduling is not currently supported. Please cancel the existing appointment and book a new one.",
-        "status": "failed"
-    }
+    try:
+        sid, pid = UUID(appointment_id), UUID(patient_id)
+        new_dt = datetime.datetime.fromisoformat(new_datetime_str)
+
+        key, ttl = idempotency_key, IDEMPOTENCY_TTL_SECONDS
+        if not key:
+            key, ttl = tool_key(sid, new_dt.isoformat()), IDEMPOTENCY_TOOL_TTL_SECONDS
+
+        result = run_async(run_idempotent(
+            f"reschedule:{pid}", key, lambda: reschedule_booking(sid, pid, new_dt), ttl
+        ))
+        return result
+    except ValueError as ve:
+        if "UUID" in str(ve) or "badly formed" in str(ve).lower():
+            return {"error": "Invalid ID format provided.", "status": "failed"}
+        return {"error": "Invalid date/time format.", "status": "failed"}
+    except Exception as e:
+        return {"error": f"Reschedule failed: {str(e)}", "status": "failed"}
 
 
-def cancel_appointment_tool(schedule_id: str):
+def cancel_appointment_tool(schedule_id: str, patient_id: str, idempotency_key: Optional[str] = None):
     """
     Cancels an existing appointment.
     Args:
         schedule_id: The ID of the appointment schedule.
+        patient_id: The ID of the patient who owns the appointment.
+        idempotency_key: Optional key; repeating a call with the same key returns the first result.
     """
     try:
-        result = asyncio.run(cancel_booking(UUID(schedule_id)))
+        sid, pid = UUID(schedule_id), UUID(patient_id)
+
+        key, ttl = idempotency_key, IDEMPOTENCY_TTL_SECONDS
+        if not key:
+            key, ttl = tool_key(sid), IDEMPOTENCY_TOOL_TTL_SECONDS
+
+        result = run_async(run_idempotent(
+            f"cancel:{pid}", key, lambda: cancel_booking(sid, pid), ttl
+        ))
         return result
     except Exception as e:
         return {"error": f"Cancellation failed: {str(e)}", "status": "failed"}
@@ -0,0 +1,224 @@
+"""
+Verify the Local (SQLite) Backend
+Checks that the Python RPC ports in local_backend still match supabase_schema.sql
+and exercises booking, overlap rejection, rescheduling and scheduler leases
+"""
+
+import asyncio
+import inspect
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+
+# Always run against a throwaway in-memory store, whatever .env says
+os.environ["DATA_BACKEND"] = "local"
+os.environ["LOCAL_DATABASE_PATH"] = ":memory:"
+
+from local_backend import RPC_FUNCTIONS
+from repository import SupabaseRepository
+from supabase_client import get_async_supabase_client
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "supabase_schema.sql")
+
+FUNCTION_PATTERN = re.compile(
+    r"CREATE OR REPLACE FUNCTION (\w+)\(([^$]*?)\)\s*RETURNS JSONB AS \$\$(.*?)\$\$", re.S | re.I
+)
+
+
+def _balanced(text: str, start: int) -> str:
+    """Contents of the parenthesis opening at text[start]"""
+    depth = 0
+    for i in range(start, len(text)):
+        depth += {"(": 1, ")": -1}.get(text[i], 0)
+        if depth == 0:
+            return text[start + 1:i]
+    raise ValueError("Unbalanced parentheses in schema")
+
+
+def load_sql_functions() -> dict:
+    """
+    RPC signatures and result shapes from supabase_schema.sql
+
+    Returns:
+        {name: {"params": [(name, has_default)], "shapes": [set of keys], "statuses": set}}
+    """
+    with open(SCHEMA_PATH) as f:
+        schema = f.read()
+
+    functions = {}
+    for name, params, body in FUNCTION_PATTERN.findall(schema):
+        signature = [
+            (param.split()[0], "DEFAULT" in param.upper())
+            for param in params.split(",") if param.strip()
+        ]
+        shapes = []
+        for match in re.finditer(r"jsonb_build_object\(", body):
+            arguments = _balanced(body, match.end() - 1)
+            shapes.append(set(_arguments(arguments)[::2]))
+        statuses = set(re.findall(r"'status',\s*'(\w+)'", body))
+        functions[name] = {"params": signature, "shapes": shapes, "statuses": statuses}
+    return functions
+
+
+def _arguments(text: str) -> list:
+    """Top-level comma-separated arguments of a jsonb_build_object call"""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    parts.append(current.strip())
+    return [part.strip("'") for part in parts]
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise AssertionError(message)
+
+
+def verify_signatures(functions: dict):
+    """Every SQL RPC has a Python port with the same parameters, and vice versa"""
+    check(set(functions) == set(RPC_FUNCTIONS),
+          f"RPC sets differ: schema {sorted(functions)} vs local_backend {sorted(RPC_FUNCTIONS)}")
+
+    for name, spec in functions.items():
+        parameters = list(inspect.signature(RPC_FUNCTIONS[name]).parameters.values())[1:]  # skip conn
+        ported = [(p.name, p.default is not inspect.Parameter.empty) for p in parameters]
+        check(ported == spec["params"], f"{name}: schema takes {spec['params']}, port takes {ported}")
+        print(f"✅ {name:<26} signature matches")
+
+
+def expect(functions: dict, seen: dict, name: str, result: dict, status: str = None):
+    """Check an RPC result has the shape of one of the schema's return objects"""
+    check(set(result) in functions[name]["shapes"],
+          f"{name}: result keys {sorted(result)} match no jsonb_build_object in the schema")
+    if status is not None:
+        check(result.get("status") == status, f"{name}: expected {status}, got {result}")
+        seen.setdefault(name, set()).add(status)
+    return result
+
+
+async def verify_behaviour(functions: dict):
+    repository = SupabaseRepository()
+    supabase = get_async_supabase_client()
+    seen = {}
+
+    print("\n📊 Creating a patient and prescription...")
+    patient = await repository.create_patient({
+        "username": f"verify_{uuid.uuid4().hex[:12]}",
+        "name": "Verify Local",
+        "password_hash": "x",
+        "email": None,
+        "phone": "+10000000000",
+        "dob": None,
+    })
+    pid = patient["pid"]
+    upload_id = await repository.save_prescription(
+        pid,
+        upload={"file_hash": uuid.uuid4().hex, "file_name": "verify.pdf", "file_size": 1,
+                "file_type": "application/pdf", "extraction_status": "success"},
+        doctor={"doctor_name": "Dr. Verify", "doctor_id_external": None},
+        drugs=[{"drug_name": "Verifycillin", "slots": ["morning", "night"]}]
+    )
+    did = (await repository.get_patient_doctors(pid))[0]["did"]
+    loner = await repository.create_patient({
+        "username": f"verify_{uuid.uuid4().hex[:12]}",
+        "name": "No Prescription",
+        "password_hash": "x",
+        "email": None,
+        "phone": "+10000000001",
+        "dob": None,
+    })
+
+    print("\n📅 Booking:")
+    start = datetime.now().astimezone().replace(minute=0, second=0, microsecond=0) + timedelta(days=30)
+    booked = expect(functions, seen, "book_appointment",
+                    await repository.book_appointment(pid, did, start, upload_id), "confirmed")
+    expect(functions, seen, "book_appointment",
+           await repository.book_appointment(pid, did, start + timedelta(minutes=30)), "conflict")
+    expect(functions, seen, "book_appointment",
+           await repository.book_appointment(pid, str(uuid.uuid4()), start), "invalid")
+    expect(functions, seen, "book_appointment",
+           await repository.book_appointment(pid, did, start + timedelta(hours=5), str(uuid.uuid4())), "invalid")
+    expect(functions, seen, "book_appointment",
+           await repository.book_appointment(loner["pid"], did, start + timedelta(hours=5)), "no_upload")
+    print("✅ Booking confirmed; overlap, unknown doctor, bad upload and missing prescription rejected")
+
+    series = expect(functions, seen, "book_appointment_series", await repository.book_appointment_series(
+        pid, did, [start + timedelta(days=7 * i) for i in range(3)], upload_id
+    ), "completed")
+    statuses = [
+        expect(functions, seen, "book_appointment_series", item, item.get("status"))["status"]
+        for item in series["results"]
+    ]
+    check(statuses == ["conflict", "confirmed", "confirmed"], f"series results: {statuses}")
+    later = [start + timedelta(days=60)]
+    expect(functions, seen, "book_appointment_series",
+           await repository.book_appointment_series(pid, str(uuid.uuid4()), later), "invalid")
+    expect(functions, seen, "book_appointment_series",
+           await repository.book_appointment_series(pid, did, later, str(uuid.uuid4())), "invalid")
+    expect(functions, seen, "book_appointment_series",
+           await repository.book_appointment_series(loner["pid"], did, later), "no_upload")
+    print("✅ Series booked around the existing appointment")
+
+    print("\n🔁 Rescheduling:")
+
+    async def reschedule(schedule_id, owner, new_time):
+        response = await supabase.rpc("reschedule_appointment", {
+            "p_schedule_id": schedule_id, "p_pid": owner, "p_new_time": new_time.isoformat()
+        }).execute()
+        return response.data
+
+    expect(functions, seen, "reschedule_appointment",
+           await reschedule(booked["schedule_id"], pid, start + timedelta(days=7, minutes=30)), "conflict")
+    expect(functions, seen, "reschedule_appointment",
+           await reschedule(booked["schedule_id"], loner["pid"], start + timedelta(hours=3)), "not_found")
+    moved = expect(functions, seen, "reschedule_appointment",
+                   await reschedule(booked["schedule_id"], pid, start + timedelta(hours=3)), "rescheduled")
+    check(datetime.fromisoformat(moved["previous_time"]) == start, f"previous_time: {moved['previous_time']}")
+    expect(functions, seen, "book_appointment",
+           await repository.book_appointment(pid, did, start, upload_id), "confirmed")
+    print("✅ Overlapping move and foreign appointment rejected; freed slot bookable again")
+
+    print("\n🔒 Scheduler leases:")
+
+    async def acquire(holder, ttl):
+        response = await supabase.rpc("acquire_scheduler_lease", {
+            "p_name": "verify_job", "p_holder": holder, "p_ttl_seconds": ttl
+        }).execute()
+        return expect(functions, seen, "acquire_scheduler_lease", response.data)
+
+    check((await acquire("worker-a", 60))["acquired"], "first holder should acquire")
+    check(not (await acquire("worker-b", 60))["acquired"], "second holder should be refused")
+    check((await acquire("worker-a", -1))["acquired"], "holder should renew its own lease")
+    taken = await acquire("worker-b", 60)
+    check(taken["acquired"] and taken["state"] == {}, f"expired lease should pass on: {taken}")
+    print("✅ Lease acquired, refused, renewed and taken over after expiry")
+
+    for name, spec in functions.items():
+        missing = spec["statuses"] - seen.get(name, set())
+        check(not missing, f"{name}: statuses never exercised: {sorted(missing)}")
+
+
+async def verify():
+    try:
+        functions = load_sql_functions()
+        verify_signatures(functions)
+        await verify_behaviour(functions)
+        print("\n🎉 Local backend verified!")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Local Backend Verification")
+    print("=" * 60)
+    raise SystemExit(0 if asyncio.run(verify()) else 1)
@@ -34,6 +34,22 @@ export interface ScheduleSuggestResponse {
 	message: string;
 }
 
+export interface DoctorAvailability {
+	doctor_id: string;
+	doctor_name: string;
+	// One bitstring per day, one character per block ("1" = available)
+	availability: string[];
+}
+
+export interface AvailabilityGridResponse {
+	success: boolean;
+	start_date: string;
+	days: number;
+	blocks: string[];
+	block_minutes: number;
+	doctors: DoctorAvailability[];
+}
+
 export interface CancelBookingResponse {
 	success: boolean;
 	message: string;
@@ -78,6 +94,32 @@ export const suggestSlots = async (
 	}
 };
 
+/**
+ * Fetch the doctors x days x time-blocks availability grid for a calendar view
+ */
+export const getAvailabilityGrid = async (
+	patientId: string,
+	token: string,
+	startDate?: string,
+	days: number = 14
+): Promise<AvailabilityGridResponse> => {
+	try {
+		const client = createAuthClient(token);
+		const response = await client.post('/api/agents/schedule/grid', {
+			patient_id: patientId,
+			start_date: startDate,
+			days,
+		});
+
+		return response.data;
+	} catch (error: any) {
+		console.error('Error fetching availability grid:', error);
+		throw new Error(
+			error.response?.data?.detail || 'Failed to fetch availability'
+		);
+	}
+};
+
 /**
  * Book an appointment slot
  */
@@ -138,6 +180,56 @@ export const cancelAppointment = async (
 	}
 };
 
+/**
+ * Move an existing appointment to a new time
+ */
+export const rescheduleAppointment = async (
+	scheduleId: string,
+	appointmentTime: string,
+	token: string
+): Promise<BookingResponse> => {
+	try {
+		const client = createAuthClient(token);
+		const response = await client.post('/api/agents/booking/reschedule', {
+			schedule_id: scheduleId,
+			appointment_time: appointmentTime,
+		});
+
+		return response.data;
+	} catch (error: any) {
+		console.error('Error rescheduling appointment:', error);
+		throw new Error(
+			error.response?.data?.detail || 'Failed to reschedule appointment'
+		);
+	}
+};
+
+/**
+ * Set when a medication reminder is sent (HH:MM, or null for the slot default)
+ */
+export const setReminderTime = async (
+	drugId: string,
+	slot: 'morning' | 'afternoon' | 'night',
+	remindAt: string | null,
+	token: string
+): Promise<any> => {
+	try {
+		const client = createAuthClient(token);
+		const response = await client.post('/api/agents/reminders/time', {
+			drug_id: drugId,
+			slot,
+			remind_at: remindAt,
+		});
+
+		return response.data;
+	} catch (error: any) {
+		console.error('Error setting reminder time:', error);
+		throw new Error(
+			error.response?.data?.detail || 'Failed to set reminder time'
+		);
+	}
+};
+
 /**
  * Check agent system health
  */
@@ -75,6 +75,36 @@ app.post("/send-message", async (req, res) => {
     }
 });
 
+app.post("/send-messages", async (req, res) => {
+    const { messages } = req.body;
+
+    if (!Array.isArray(messages) || messages.length === 0) {
+        return res.status(400).json({ success: false, error: "messages must be a non-empty array" });
+    }
+
+    // WhatsApp Web sends one message at a time; batching saves the HTTP round trips
+    const results = [];
+    for (const item of messages) {
+        const { contact, message } = item || {};
+
+        if (!contact || !message) {
+            results.push({ contact, success: false, error: "Missing contact or message" });
+            continue;
+        }
+
+        try {
+            await wwclient.sendMessage("91" + contact + "@c.us", message);
+            results.push({ contact, success: true });
+        } catch (error) {
+            console.error(`Failed to send message to ${contact}:`, error);
+            results.push({ contact, success: false, error: (error as Error).message });
+        }
+    }
+
+    console.log(`Batch sent: ${results.filter((r) => r.success).length}/${results.length}`);
+    res.json({ success: results.every((r) => r.success), results });
+});
+
 app.get("/health", (req, res) => {
     res.json({ status: "ok", whatsapp_ready: wwclient.info !== undefined });
 });
@@ -1,26 +1,90 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import requests
+from pydantic import BaseModel, Field
+import httpx
 import uvicorn
 
-app = FastAPI()
+TS_API_BASE = os.getenv("TS_API_URL", "http://localhost:3001")
+MAX_BATCH_SIZE = 500
 
-TS_API_URL = "http://localhost:3001/send-message"
+# Concurrent requests allowed toward the TS bridge
+TS_MAX_CONCURRENCY = int(os.getenv("TS_MAX_CONCURRENCY", "8"))
+# How long a /health result is trusted before probing again
+HEALTH_CACHE_SECONDS = float(os.getenv("TS_HEALTH_CACHE_SECONDS", "5"))
+
+ts_client: Optional[httpx.AsyncClient] = None
+ts_slots: Optional[asyncio.Semaphore] = None
+health_cache = {"ready": False, "error": "Not checked yet", "checked_at": 0.0}
+health_lock: Optional[asyncio.Lock] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Creates the pooled client for the TS bridge and closes it on shutdown.
+    """
+    global ts_client, ts_slots, health_lock
+    ts_client = httpx.AsyncClient(
+        base_url=TS_API_BASE,
+        timeout=httpx.Timeout(10.0, connect=2.0),
+        limits=httpx.Limits(max_connections=TS_MAX_CONCURRENCY, max_keepalive_connections=TS_MAX_CONCURRENCY),
+    )
+    ts_slots = asyncio.Semaphore(TS_MAX_CONCURRENCY)
+    health_lock = asyncio.Lock()
+    yield
+    await ts_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 class MessageRequest(BaseModel):
     contact: str
     message: str
 
-def send_whatsapp_message(contact: str, message: str):
+class BatchMessageRequest(BaseModel):
+    messages: List[MessageRequest] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE)
+
+async def check_bridge_ready():
+    """
+    Returns (ready, error) for the TS bridge, probing /health at most
+    once per HEALTH_CACHE_SECONDS.
+    """
+    if time.monotonic() - health_cache["checked_at"] < HEALTH_CACHE_SECONDS:
+        return health_cache["ready"], health_cache["error"]
+
+    async with health_lock:
+        # Another request may have refreshed the cache while we waited
+        if time.monotonic() - health_cache["checked_at"] < HEALTH_CACHE_SECONDS:
+            return health_cache["ready"], health_cache["error"]
+
+        try:
+            response = await ts_client.get("/health", timeout=2.0)
+            response.raise_for_status()
+            ready = bool(response.json().get("whatsapp_ready"))
+            error = None if ready else "WhatsApp client is not ready"
+        except Exception as e:
+            ready, error = False, f"WhatsApp bridge unavailable: {e}"
+
+        health_cache.update(ready=ready, error=error, checked_at=time.monotonic())
+        return ready, error
+
+async def require_bridge_ready():
+    ready, error = await check_bridge_ready()
+    if not ready:
+        raise HTTPException(status_code=503, detail=error)
+
+async def send_whatsapp_message(contact: str, message: str):
     """
     Sends a message to a WhatsApp contact via the TypeScript bridge.
     """
     try:
-        response = requests.post(
-            TS_API_URL,
-            json={"contact": contact, "message": message},
-            timeout=10
-        )
+        async with ts_slots:
+            response = await ts_client.post(
+                "/send-message",
+                json={"contact": contact, "message": message}
+            )
         response.raise_for_status()
         result = response.json()
         if not result.get("success", False):
@@ -29,32 +93,69 @@ def send_whatsapp_message(contact: str, message: str):
     except Exception as e:
         return False, str(e)
 
+async def send_whatsapp_batch(messages: List[MessageRequest]):
+    """
+    Sends many messages with one call to the TypeScript bridge.
+    Returns one {"contact", "success", "error"} result per message.
+    """
+    try:
+        async with ts_slots:
+            response = await ts_client.post(
+                "/send-messages",
+                json={"messages": [m.dict() for m in messages]},
+                # The bridge sends sequentially, so allow time per message
+                timeout=httpx.Timeout(10.0 + 2 * len(messages), connect=2.0)
+            )
+        response.raise_for_status()
+        return response.json().get("results", [])
+    except Exception as e:
+        return [{"contact": m.contact, "success": False, "error": str(e)} for m in messages]
+
 @app.post("/send")
 async def trigger_message_send_post(request: MessageRequest):
     """
     Endpoint to trigger sending a WhatsApp message via POST JSON.
     """
-    success, error_msg = send_whatsapp_message(request.contact, request.message)
-    
+    await require_bridge_ready()
+    success, error_msg = await send_whatsapp_message(request.contact, request.message)
+
     if not success:
         raise HTTPException(status_code=500, detail=error_msg)
-        
+
     return {
         "contact": request.contact,
         "message": request.message,
         "success": True
     }
 
+@app.post("/send/batch")
+async def trigger_message_send_batch(request: BatchMessageRequest):
+    """
+    Endpoint to send many WhatsApp messages in one call.
+    Returns per-message results; individual failures do not fail the batch.
+    """
+    await require_bridge_ready()
+    results = await send_whatsapp_batch(request.messages)
+    sent = sum(1 for r in results if r.get("success"))
+
+    return {
+        "results": results,
+        "sent": sent,
+        "failed": len(results) - sent,
+        "success": sent == len(results)
+    }
+
 @app.get("/send/{contact}/{message}")
 async def trigger_message_send_get(contact: str, message: str):
     """
     Endpoint to trigger sending a WhatsApp message via GET path parameters.
     """
-    success, error_msg = send_whatsapp_message(contact, message)
-    
+    await require_bridge_ready()
+    success, error_msg = await send_whatsapp_message(contact, message)
+
     if not success:
         raise HTTPException(status_code=500, detail=error_msg)
-        
+
     return {
         "contact": contact,
         "message": message,
@@ -63,7 +164,8 @@ async def trigger_message_send_get(contact: str, message: str):
 
 @app.get("/status")
 async def get_status():
-    return {"status": "online"}
+    ready, error = await check_bridge_ready()
+    return {"status": "online", "whatsapp_ready": ready, "error": error}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=5000)